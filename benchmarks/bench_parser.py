@@ -0,0 +1,107 @@
+"""Parsing cost per merchant message.
+
+    python benchmarks/bench_parser.py [--corpus FILE] [--repeat N] [--json]
+
+Runs src.parser.parse_message over the corpus (one JSON object per line with
+"kind" and "text"), checks every message is classified as its "kind" says and
+that the ids/nicknames match the old inline parsing from handle_message, then
+reports the time per message for each kind, next to the old parsing.
+"""
+import argparse
+import json
+import os
+import re
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from src.parser import parse_message, MULTI_WORD_NICKNAMES, KIND_NOTIFICATION, KIND_APPEALS, KIND_FALLBACK
+
+CORPUS = os.path.join(os.path.dirname(os.path.abspath(__file__)), "parser_corpus.jsonl")
+
+def legacy_parse(original_message):
+    # handle_message before src/parser.py, kept to compare results and cost
+    message_text = original_message.lower()
+    has_russian = any(1040 <= ord(char) <= 1103 for char in original_message)
+    appeal_ids = re.findall(r"[0-9a-f]{8}-[0-9a-f]{4}-[0-9a-f]{4}-[0-9a-f]{4}-[0-9a-f]{12}", original_message)
+    if has_russian and appeal_ids:
+        return KIND_NOTIFICATION, appeal_ids, []
+    appeals = []
+    for line in original_message.split('\n'):
+        uuid_match = re.match(r"([0-9a-f]{8}-[0-9a-f]{4}-[0-9a-f]{4}-[0-9a-f]{4}-[0-9a-f]{12})\s+(.+)", line.strip())
+        if uuid_match:
+            message_parts = uuid_match.group(2).strip().split()
+            trader_nickname = message_parts[0].lower()
+            if len(message_parts) > 1 and message_parts[1].lower() in MULTI_WORD_NICKNAMES:
+                trader_nickname += " " + message_parts[1].lower()
+            appeals.append((uuid_match.group(1), trader_nickname))
+    if appeals:
+        return KIND_APPEALS, appeal_ids, appeals
+    message_text.strip().split()
+    return KIND_FALLBACK, appeal_ids, []
+
+def load_corpus(path):
+    with open(path, encoding="utf-8") as f:
+        return [json.loads(line) for line in f if line.strip()]
+
+def check(corpus):
+    errors = []
+    for number, entry in enumerate(corpus, 1):
+        parsed = parse_message(entry["text"])
+        kind, appeal_ids, appeals = legacy_parse(entry["text"])
+        if parsed.kind != entry["kind"] or parsed.kind != kind:
+            errors.append(f"#{number} ({entry.get('note', '')}): parsed as {parsed.kind}, expected {entry['kind']}, old parsing {kind}")
+        elif list(parsed.appeal_ids) != appeal_ids or list(parsed.appeals) != appeals:
+            errors.append(f"#{number} ({entry.get('note', '')}): ids/nicknames differ from the old parsing")
+    return errors
+
+def time_per_message(parse, texts, repeat):
+    best = None
+    for _ in range(repeat):
+        started = time.perf_counter()
+        for text in texts:
+            parse(text)
+        elapsed = time.perf_counter() - started
+        best = elapsed if best is None else min(best, elapsed)
+    return best / len(texts)
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--corpus", default=CORPUS)
+    parser.add_argument("--repeat", type=int, default=200)
+    parser.add_argument("--json", action="store_true", help="print results as JSON")
+    args = parser.parse_args()
+
+    corpus = load_corpus(args.corpus)
+    errors = check(corpus)
+    for error in errors:
+        print(error, file=sys.stderr)
+
+    results = {"messages": len(corpus), "errors": len(errors), "kinds": {}}
+    by_kind = {}
+    for entry in corpus:
+        by_kind.setdefault(entry["kind"], []).append(entry["text"])
+    by_kind["all"] = [entry["text"] for entry in corpus]
+    for kind, texts in by_kind.items():
+        parser_us = time_per_message(parse_message, texts, args.repeat) * 1e6
+        legacy_us = time_per_message(legacy_parse, texts, args.repeat) * 1e6
+        results["kinds"][kind] = {
+            "messages": len(texts),
+            "avg_chars": sum(map(len, texts)) // len(texts),
+            "parser_us": round(parser_us, 2),
+            "legacy_us": round(legacy_us, 2),
+            "speedup": round(legacy_us / parser_us, 2) if parser_us else None,
+        }
+
+    if args.json:
+        print(json.dumps(results, indent=2))
+    else:
+        print(f"{len(corpus)} messages, {len(errors)} mismatches")
+        print(f"{'kind':<14}{'msgs':>6}{'chars':>8}{'parser us':>12}{'old us':>10}{'speedup':>9}")
+        for kind, row in results["kinds"].items():
+            print(f"{kind:<14}{row['messages']:>6}{row['avg_chars']:>8}{row['parser_us']:>12}{row['legacy_us']:>10}{row['speedup']:>8}x")
+    sys.exit(1 if errors else 0)
+
+if __name__ == "__main__":
+    main()
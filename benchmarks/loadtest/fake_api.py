@@ -0,0 +1,73 @@
+"""Fake appeals API: /api/auth/login, /api/auth/refresh and /api/requests/.
+
+Latency is exponential around a configurable mean; error_rate of the calls
+answer 500. resolved_rate of the status lookups report the appeal as closed,
+which is what makes the bot drop reminders and skip callbacks.
+"""
+import asyncio
+import random
+import secrets
+from aiohttp import web
+
+class FakeAppealsAPI:
+    def __init__(self, host="127.0.0.1", port=0, latency=0.05, error_rate=0.0, resolved_rate=0.0, seed=None):
+        self.host = host
+        self.port = port
+        self.latency = latency
+        self.error_rate = error_rate
+        self.resolved_rate = resolved_rate
+        self.random = random.Random(seed)
+        self.calls = {"login": 0, "refresh": 0, "requests": 0, "errors": 0}
+        self._tokens = set()
+        self._runner = None
+
+    @property
+    def base_url(self):
+        return f"http://{self.host}:{self.port}"
+
+    async def _delay_or_fail(self, kind):
+        self.calls[kind] += 1
+        if self.latency:
+            await asyncio.sleep(self.random.expovariate(1 / self.latency))
+        if self.random.random() < self.error_rate:
+            self.calls["errors"] += 1
+            raise web.HTTPInternalServerError(text="fake appeals API error")
+
+    def _issue(self):
+        token = secrets.token_hex(16)
+        self._tokens.add(token)
+        return token
+
+    async def login(self, request):
+        await self._delay_or_fail("login")
+        return web.json_response({"access_token": self._issue(), "refresh_token": self._issue(),
+                                  "expires_in": 300, "refresh_expires_in": 1800})
+
+    async def refresh(self, request):
+        await self._delay_or_fail("refresh")
+        payload = await request.json()
+        if payload.get("refresh_token") not in self._tokens:
+            raise web.HTTPUnauthorized(text="unknown refresh token")
+        return web.json_response({"access_token": self._issue(), "expires_in": 300})
+
+    async def requests(self, request):
+        await self._delay_or_fail("requests")
+        token = request.headers.get("Authorization", "").removeprefix("Bearer ")
+        if token not in self._tokens:
+            raise web.HTTPUnauthorized(text="bad token")
+        status = "approved" if self.random.random() < self.resolved_rate else "pending"
+        return web.json_response([{"id": 1, "status": status, "amount_to_pay": "100.00",
+                                   "search": request.query.get("search")}])
+
+    async def start(self):
+        app = web.Application()
+        app.router.add_post("/api/auth/login", self.login)
+        app.router.add_post("/api/auth/refresh", self.refresh)
+        app.router.add_get("/api/requests/", self.requests)
+        self._runner = web.AppRunner(app, access_log=None)
+        await self._runner.setup()
+        await web.TCPSite(self._runner, self.host, self.port).start()
+        self.port = self._runner.addresses[0][1]
+
+    async def stop(self):
+        await self._runner.cleanup()
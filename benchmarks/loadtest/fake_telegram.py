@@ -0,0 +1,217 @@
+"""Minimal in-process Bot API server for load tests.
+
+Serves the methods the bot calls (getMe, getUpdates, setWebhook, send*/edit*,
+deleteMessage, answerCallbackQuery, ...), hands out updates queued with
+push_update() over long polling or by POSTing them to the bot's webhook, and
+reports every call to an observer so the load generator can time it. With
+balance() set it stands in for a load balancer in front of several webhook
+replicas: updates go round-robin, and a replica that does not answer is skipped.
+"""
+import asyncio
+import itertools
+import json
+import time
+from aiohttp import ClientSession, ClientTimeout, web
+
+BOT_USER = {"id": 1000000001, "is_bot": True, "first_name": "LoadTestBot", "username": "loadtest_bot",
+            "can_join_groups": True, "can_read_all_group_messages": True, "supports_inline_queries": False}
+
+SEND_METHODS = {"sendMessage": None, "sendPhoto": "photo", "sendDocument": "document",
+                "sendVideo": "video", "sendAnimation": "animation"}
+
+def media_object(kind, file_id):
+    unique = {"file_id": file_id, "file_unique_id": f"u-{file_id}"}
+    if kind == "photo":
+        return [dict(unique, width=800, height=600)]
+    if kind in ("video", "animation"):
+        return dict(unique, width=640, height=480, duration=3, mime_type="video/mp4")
+    return dict(unique, file_name="receipt.pdf", mime_type="application/pdf")
+
+class FakeTelegram:
+    def __init__(self, host="127.0.0.1", port=0, latency=0.0):
+        self.host = host
+        self.port = port
+        self.latency = latency          # seconds added to every Bot API call
+        self.chats = {}                 # chat id -> chat object
+        self.messages = {}              # (chat id, message id) -> message the bot sent
+        self.calls = {}                 # method -> count
+        self.observer = None            # callable(method, params, result, monotonic time)
+        self.webhook_url = None
+        self.webhook_secret = None
+        self.webhook_targets = None     # set by balance(): replicas to spread updates over
+        self.webhook_failures = 0       # deliveries a replica refused or did not answer
+        self._updates = []
+        self._update_ids = itertools.count(1)
+        self._message_ids = itertools.count(1)
+        self._callback_ids = itertools.count(1)
+        self._new_updates = asyncio.Event()
+        self._delivery = None
+        self._session = None
+        self._runner = None
+        self.ready = asyncio.Event()    # set once the bot polls or sets its webhook
+
+    @property
+    def base_url(self):
+        return f"http://{self.host}:{self.port}"
+
+    def balance(self, urls):
+        self.webhook_targets = itertools.cycle(urls)
+
+    def add_chat(self, chat_id, title):
+        self.chats[chat_id] = {"id": chat_id, "type": "supergroup", "title": title}
+
+    def next_message_id(self):
+        return next(self._message_ids)
+
+    # --- updates ---
+
+    def push_update(self, payload):
+        update = dict(payload, update_id=next(self._update_ids))
+        if self.webhook_url:
+            self._delivery.put_nowait(update)
+        else:
+            self._updates.append(update)
+            self._new_updates.set()
+        return update["update_id"]
+
+    def message_update(self, chat_id, user, text=None, media=None, file_id=None):
+        message = {"message_id": self.next_message_id(), "date": time.time(), "chat": self.chats[chat_id], "from": user}
+        if media:
+            message[media] = media_object(media, file_id)
+            message["caption"] = text
+        else:
+            message["text"] = text
+        self.push_update({"message": message})
+        return message
+
+    def callback_update(self, message, user, data):
+        callback_id = str(next(self._callback_ids))
+        self.push_update({"callback_query": {"id": callback_id, "from": user, "chat_instance": "loadtest",
+                                             "data": data, "message": message}})
+        return callback_id
+
+    async def _get_updates(self, params):
+        self.ready.set()
+        offset = int(params.get("offset") or 0)
+        limit = int(params.get("limit") or 100)
+        timeout = float(params.get("timeout") or 0)
+        # Updates below the offset are confirmed
+        self._updates = [update for update in self._updates if update["update_id"] >= offset]
+        if not self._updates and timeout:
+            self._new_updates.clear()
+            try:
+                await asyncio.wait_for(self._new_updates.wait(), timeout)
+            except asyncio.TimeoutError:
+                pass
+        return self._updates[:limit]
+
+    async def _deliver(self):
+        # Webhook mode: one POST per update, in order, like Telegram with max_connections=1
+        while True:
+            update = await self._delivery.get()
+            headers = {"X-Telegram-Bot-Api-Secret-Token": self.webhook_secret or ""}
+            for attempt in range(5):
+                url = next(self.webhook_targets) if self.webhook_targets else self.webhook_url
+                try:
+                    async with self._session.post(url, json=update, headers=headers) as response:
+                        if response.status == 200:
+                            break
+                except Exception:
+                    pass
+                self.webhook_failures += 1
+                await asyncio.sleep(0.1 * 2 ** attempt)
+
+    # --- Bot API ---
+
+    def _message(self, chat_id, params, **content):
+        message = {"message_id": self.next_message_id(), "date": int(time.time()), "from": BOT_USER,
+                   "chat": self.chats.get(chat_id) or {"id": chat_id, "type": "supergroup", "title": str(chat_id)}}
+        message.update(content)
+        if params.get("reply_markup"):
+            message["reply_markup"] = params["reply_markup"]
+        self.messages[(chat_id, message["message_id"])] = message
+        return message
+
+    def _edit(self, params, **changes):
+        key = (int(params["chat_id"]), int(params["message_id"]))
+        message = self.messages.get(key)
+        if message is None:
+            raise web.HTTPBadRequest(text=json.dumps({"ok": False, "error_code": 400,
+                                                      "description": "Bad Request: message to edit not found"}),
+                                     content_type="application/json")
+        message.update(changes)
+        if "reply_markup" in params and params["reply_markup"]:
+            message["reply_markup"] = params["reply_markup"]
+        else:
+            message.pop("reply_markup", None)
+        return message
+
+    async def call(self, method, params):
+        if method == "getMe":
+            return BOT_USER
+        if method == "getUpdates":
+            return await self._get_updates(params)
+        if method == "setWebhook":
+            self.webhook_url = params["url"]
+            self.webhook_secret = params.get("secret_token")
+            self.ready.set()
+            return True
+        if method == "deleteWebhook":
+            self.webhook_url = None
+            return True
+        if method in SEND_METHODS:
+            chat_id = int(params["chat_id"])
+            media = SEND_METHODS[method]
+            if media is None:
+                return self._message(chat_id, params, text=params.get("text", ""))
+            return self._message(chat_id, params, caption=params.get("caption", ""),
+                                 **{media: media_object(media, params[media])})
+        if method == "editMessageText":
+            return self._edit(params, text=params.get("text", ""))
+        if method == "editMessageCaption":
+            return self._edit(params, caption=params.get("caption", ""))
+        if method == "editMessageReplyMarkup":
+            return self._edit(params)
+        if method == "deleteMessage":
+            self.messages.pop((int(params["chat_id"]), int(params["message_id"])), None)
+            return True
+        # answerCallbackQuery, setMyCommands, close, ...
+        return True
+
+    async def handle(self, request):
+        method = request.match_info["method"]
+        if request.content_type == "application/json":
+            params = await request.json()
+        else:
+            params = {}
+            for name, value in (await request.post()).items():
+                # PTB sends objects (reply_markup, allowed_updates, ...) JSON-encoded
+                if isinstance(value, str) and value[:1] in "[{":
+                    try:
+                        value = json.loads(value)
+                    except ValueError:
+                        pass
+                params[name] = value
+        if self.latency:
+            await asyncio.sleep(self.latency)
+        self.calls[method] = self.calls.get(method, 0) + 1
+        result = await self.call(method, params)
+        if self.observer is not None:
+            self.observer(method, params, result, time.monotonic())
+        return web.json_response({"ok": True, "result": result})
+
+    async def start(self):
+        app = web.Application(client_max_size=20 * 1024 * 1024)
+        app.router.add_route("*", "/bot{token}/{method}", self.handle)
+        self._runner = web.AppRunner(app, access_log=None)
+        await self._runner.setup()
+        await web.TCPSite(self._runner, self.host, self.port).start()
+        self.port = self._runner.addresses[0][1]
+        self._session = ClientSession(timeout=ClientTimeout(total=10))
+        self._delivery = asyncio.Queue()
+        self._delivery_task = asyncio.create_task(self._deliver())
+
+    async def stop(self):
+        self._delivery_task.cancel()
+        await self._session.close()
+        await self._runner.cleanup()
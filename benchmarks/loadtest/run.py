@@ -0,0 +1,438 @@
+"""End-to-end load test of the real bot against fake Telegram and appeals servers.
+
+    python benchmarks/loadtest/run.py --merchants 20 --traders 50 --appeal-rate 5 \\
+        --callback-rate 3 --notification-rate 1 --duration 120 [--mode webhook]
+
+Starts FakeTelegram and FakeAppealsAPI in this process, then runs `python -m
+src.bot` in a subprocess. The subprocess uses a scratch DATA_DIR/LOG_DIR and a
+groups.json with the generated merchant and trader groups. Appeal,
+notification and callback updates arrive as Poisson streams at the given
+rates. Every Bot API call the bot makes is timed against the update that
+caused it. At the end the bot's /metrics endpoint is scraped and the bot is
+stopped with SIGINT.
+
+With --replicas N (webhook mode) N bot processes share one DATA_DIR in
+MULTI_REPLICA mode and the fake server spreads updates over them like a load
+balancer. --kill-leader-at T SIGKILLs the replica holding the reminders lease
+T seconds in and reports how long the others took to take over. Metrics are
+summed over the replicas; reminders sent per replica show that exactly one
+replica owned them at a time.
+
+A JSON result is written to benchmarks/results/ (or --output), with the
+commit, config, latency percentiles, reminder sweep time and peak RSS. Pass
+--baseline to print the deltas against an earlier result. The run exits non-zero
+when appeals or callbacks were injected but nothing was forwarded or closed.
+Observed numbers are kept in benchmarks/loadtest/RESULTS.md.
+"""
+import argparse
+import asyncio
+import json
+import os
+import random
+import re
+import resource
+import secrets
+import shutil
+import signal
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+import uuid
+from datetime import datetime
+from aiohttp import ClientSession
+from fake_telegram import FakeTelegram, SEND_METHODS
+from fake_api import FakeAppealsAPI
+
+ROOT = os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+RESULTS_DIR = os.path.join(ROOT, "benchmarks", "results")
+APPEAL_ID_IN_TEXT = re.compile(r"`([0-9a-f-]{36})`")
+MERCHANT_USER = {"id": 2000000001, "is_bot": False, "first_name": "Merchant", "username": "loadtest_merchant"}
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+def percentiles(samples):
+    ordered = sorted(samples)
+    if not ordered:
+        return {"count": 0}
+
+    def at(q):
+        return round(ordered[min(len(ordered) - 1, int(len(ordered) * q))] * 1000, 2)
+    return {"count": len(ordered), "mean": round(sum(ordered) / len(ordered) * 1000, 2),
+            "p50": at(0.5), "p90": at(0.9), "p95": at(0.95), "p99": at(0.99), "max": round(ordered[-1] * 1000, 2)}
+
+def git_commit():
+    try:
+        commit = subprocess.check_output(["git", "rev-parse", "--short", "HEAD"], cwd=ROOT, text=True).strip()
+        dirty = bool(subprocess.check_output(["git", "status", "--porcelain", "--untracked-files=no"], cwd=ROOT, text=True).strip())
+        return commit, dirty
+    except (OSError, subprocess.CalledProcessError):
+        return "unknown", False
+
+class LoadGenerator:
+    # Injects updates into the fake Telegram server and matches the bot's Bot API
+    # calls back to them: forward (appeal -> send to the trader group), callback
+    # answer and close (button press -> answerCallbackQuery / edit), notification
+    def __init__(self, telegram, merchants, traders, rng, media_ratio):
+        self.telegram = telegram
+        self.merchants = merchants
+        self.traders = traders          # chat id -> (nickname, user)
+        self.rng = rng
+        self.media_ratio = media_ratio
+        self.injected = {"appeal": 0, "callback": 0, "notification": 0}
+        self.latency = {"forward": [], "callback_answer": [], "close": [], "notification": []}
+        self._forwards = {}
+        self._callbacks = {}
+        self._closes = {}
+        self._notifications = {}
+        self._open = {}                 # (trader chat, message id) -> forwarded message
+        self._forwarded_ids = []
+        telegram.observer = self.observe
+
+    def observe(self, method, params, result, now):
+        if method in SEND_METHODS:
+            chat_id = int(params["chat_id"])
+            if chat_id not in self.traders:
+                return
+            match = APPEAL_ID_IN_TEXT.search(params.get("text") or params.get("caption") or "")
+            if not match:
+                return
+            appeal_id = match.group(1)
+            if params.get("reply_markup") and appeal_id in self._forwards:
+                self.latency["forward"].append(now - self._forwards.pop(appeal_id))
+                self._open[(chat_id, result["message_id"])] = result
+                self._forwarded_ids.append(appeal_id)
+            elif appeal_id in self._notifications:
+                self.latency["notification"].append(now - self._notifications.pop(appeal_id))
+        elif method == "answerCallbackQuery":
+            started = self._callbacks.pop(params.get("callback_query_id"), None)
+            if started is not None:
+                self.latency["callback_answer"].append(now - started)
+        elif method in ("editMessageText", "editMessageCaption"):
+            started = self._closes.pop((int(params["chat_id"]), int(params["message_id"])), None)
+            if started is not None:
+                self.latency["close"].append(now - started)
+
+    def appeal(self):
+        merchant_id = self.rng.choice(self.merchants)
+        trader_id = self.rng.choice(list(self.traders))
+        appeal_id = str(uuid.UUID(int=self.rng.getrandbits(128)))
+        text = f"{appeal_id} {self.traders[trader_id][0]} client says paid, please check"
+        media = "photo" if self.rng.random() < self.media_ratio else None
+        self._forwards[appeal_id] = time.monotonic()
+        self.telegram.message_update(merchant_id, MERCHANT_USER, text, media=media, file_id=f"file-{appeal_id[:8]}")
+        self.injected["appeal"] += 1
+
+    def callback(self):
+        if not self._open:
+            return
+        key = self.rng.choice(list(self._open))
+        message = self._open.pop(key)
+        button = self.rng.choice(message["reply_markup"]["inline_keyboard"][0])
+        started = time.monotonic()
+        callback_id = self.telegram.callback_update(message, self.traders[key[0]][1], button["callback_data"])
+        self._callbacks[callback_id] = started
+        self._closes[key] = started
+        self.injected["callback"] += 1
+
+    def notification(self):
+        if not self._forwarded_ids:
+            return
+        appeal_id = self.rng.choice(self._forwarded_ids)
+        self._notifications[appeal_id] = time.monotonic()
+        self.telegram.message_update(self.rng.choice(self.merchants), MERCHANT_USER,
+                                     f"Уведомление: по апелляции {appeal_id} поступила оплата")
+        self.injected["notification"] += 1
+
+    async def stream(self, inject, rate, until):
+        while rate > 0 and time.monotonic() < until:
+            await asyncio.sleep(self.rng.expovariate(rate))
+            inject()
+
+    def outstanding(self):
+        return len(self._forwards) + len(self._callbacks) + len(self._closes) + len(self._notifications)
+
+def write_groups(data_dir, merchants, traders):
+    groups = {
+        "merchant": [{"id": chat_id, "title": f"Merchant {n}", "appeal_id_start_pos": 0, "appeal_id_length": 36}
+                     for n, chat_id in enumerate(merchants)],
+        "trader": [{"id": chat_id, "title": f"{nickname} | Trader"} for chat_id, (nickname, _) in traders.items()],
+        "trader_accounts": {str(chat_id): user["username"] for chat_id, (_, user) in traders.items()},
+    }
+    with open(os.path.join(data_dir, "groups.json"), "w") as f:
+        json.dump(groups, f)
+
+def parse_metrics(text):
+    # {name: {labels: value}} for the series the report needs
+    series = {}
+    for line in text.splitlines():
+        if not line or line.startswith("#"):
+            continue
+        name_labels, _, value = line.rpartition(" ")
+        name, _, labels = name_labels.partition("{")
+        series.setdefault(name, {})[labels.rstrip("}")] = float(value)
+    return series
+
+def merge_metrics(scrapes):
+    # Counters and histograms add up across replicas; gauges are not used from the merge
+    merged = {}
+    for series in scrapes:
+        for name, values in series.items():
+            for labels, value in values.items():
+                merged.setdefault(name, {})[labels] = merged.get(name, {}).get(labels, 0.0) + value
+    return merged
+
+async def scrape(session, port):
+    try:
+        async with session.get(f"http://127.0.0.1:{port}/metrics") as response:
+            return parse_metrics(await response.text())
+    except OSError:
+        return None
+
+def is_leader(series):
+    return bool(series and series.get("aisbot_leader", {}).get(""))
+
+async def kill_leader(session, replicas, at):
+    # SIGKILL whichever replica holds the lease, then time until another one reports it
+    await asyncio.sleep(at)
+    for replica in replicas:
+        if replica["process"].returncode is None and is_leader(await scrape(session, replica["metrics_port"])):
+            replica["process"].kill()
+            killed = time.monotonic()
+            print(f"Killed leader {replica['id']}")
+            break
+    else:
+        return None
+    while True:
+        await asyncio.sleep(0.1)
+        for other in replicas:
+            if other is not replica and other["process"].returncode is None \
+                    and is_leader(await scrape(session, other["metrics_port"])):
+                return {"killed": replica["id"], "new_leader": other["id"], "failover_s": round(time.monotonic() - killed, 2)}
+
+def histogram_summary(series, name):
+    counts = series.get(f"{name}_count", {})
+    sums = series.get(f"{name}_sum", {})
+    return {labels or "all": {"count": int(count), "mean_ms": round(sums.get(labels, 0.0) / count * 1000, 2) if count else 0.0}
+            for labels, count in counts.items()}
+
+async def run(args):
+    rng = random.Random(args.seed)
+    work_dir = tempfile.mkdtemp(prefix="aisbot-loadtest-")
+    data_dir, log_dir = os.path.join(work_dir, "data"), os.path.join(work_dir, "logs")
+    os.makedirs(data_dir)
+    os.makedirs(log_dir)
+
+    telegram = FakeTelegram(latency=args.telegram_latency)
+    api = FakeAppealsAPI(latency=args.api_latency, error_rate=args.api_error_rate,
+                         resolved_rate=args.api_resolved_rate, seed=args.seed)
+    await telegram.start()
+    await api.start()
+
+    merchants = [-1001000000000 - n for n in range(args.merchants)]
+    traders = {-1002000000000 - n: (f"t{n:05d}x", {"id": 3000000000 + n, "is_bot": False, "first_name": f"Trader {n}",
+                                                   "username": f"trader_{n}"})
+               for n in range(args.traders)}
+    for n, chat_id in enumerate(merchants):
+        telegram.add_chat(chat_id, f"Merchant {n}")
+    for chat_id, (nickname, _) in traders.items():
+        telegram.add_chat(chat_id, f"{nickname} | Trader")
+    write_groups(data_dir, merchants, traders)
+
+    env = dict(os.environ, BOT_TOKEN="123456:loadtest", API_KEY="loadtest", API_URL=api.base_url,
+               API_LOGIN="loadtest", API_PASSWORD="loadtest", BOT_API_BASE_URL=telegram.base_url,
+               DATA_DIR=data_dir, LOG_DIR=log_dir, BOT_MODE=args.mode)
+    if args.mode == "webhook":
+        # One secret for every replica, as behind a real load balancer
+        env["WEBHOOK_SECRET"] = secrets.token_urlsafe(32)
+    if args.replicas > 1:
+        env["MULTI_REPLICA"] = "true"
+    for item in args.bot_env:
+        name, _, value = item.partition("=")
+        env[name] = value
+
+    replicas = []
+    for n in range(args.replicas):
+        replica = {"id": f"replica-{n}", "metrics_port": free_port(),
+                   "console": open(os.path.join(work_dir, f"bot-{n}.out" if args.replicas > 1 else "bot.out"), "w")}
+        replica_env = dict(env, METRICS_PORT=str(replica["metrics_port"]), REPLICA_ID=replica["id"])
+        if args.mode == "webhook":
+            webhook_port = free_port()
+            replica["webhook_url"] = f"http://127.0.0.1:{webhook_port}/telegram"
+            replica_env.update(WEBHOOK_LISTEN="127.0.0.1", WEBHOOK_PORT=str(webhook_port),
+                               WEBHOOK_URL=replica["webhook_url"], WEBHOOK_PATH="/telegram")
+        replica["process"] = await asyncio.create_subprocess_exec(sys.executable, "-m", "src.bot", cwd=ROOT, env=replica_env,
+                                                                  stdout=replica["console"], stderr=subprocess.STDOUT)
+        replicas.append(replica)
+    if args.replicas > 1:
+        telegram.balance([replica["webhook_url"] for replica in replicas])
+    generator = LoadGenerator(telegram, merchants, traders, rng, args.media_ratio)
+    failover = None
+    try:
+        async with ClientSession() as session:
+            # Ready once every replica serves metrics and one has polled or set the webhook
+            deadline = time.monotonic() + args.startup_timeout
+            while not telegram.ready.is_set() or any([await scrape(session, replica["metrics_port"]) is None
+                                                      for replica in replicas]):
+                if time.monotonic() > deadline or any(replica["process"].returncode is not None for replica in replicas):
+                    raise RuntimeError(f"Bot did not start, see the *.out files in {work_dir}")
+                await asyncio.sleep(0.2)
+            print(f"Bot ready ({args.mode}, {args.replicas} replica(s)), generating load for {args.duration}s")
+
+            started = time.monotonic()
+            until = started + args.duration
+            killer = asyncio.create_task(kill_leader(session, replicas, args.kill_leader_at)) if args.kill_leader_at else None
+            await asyncio.gather(
+                generator.stream(generator.appeal, args.appeal_rate, until),
+                generator.stream(generator.callback, args.callback_rate, until),
+                generator.stream(generator.notification, args.notification_rate, until),
+            )
+            # Let in-flight work finish
+            drain_until = time.monotonic() + args.drain
+            while generator.outstanding() and time.monotonic() < drain_until:
+                await asyncio.sleep(0.1)
+            elapsed = time.monotonic() - started
+            if killer is not None:
+                if killer.done():
+                    failover = killer.result()
+                else:
+                    killer.cancel()
+
+            for replica in replicas:
+                replica["metrics"] = await scrape(session, replica["metrics_port"]) if replica["process"].returncode is None else None
+            metrics = merge_metrics(replica["metrics"] for replica in replicas if replica["metrics"])
+    finally:
+        for replica in replicas:
+            process = replica["process"]
+            if process.returncode is None:
+                process.send_signal(signal.SIGINT)
+        for replica in replicas:
+            process = replica["process"]
+            try:
+                await asyncio.wait_for(process.wait(), args.shutdown_timeout)
+            except asyncio.TimeoutError:
+                process.kill()
+                await process.wait()
+            replica["console"].close()
+        await telegram.stop()
+        await api.stop()
+
+    commit, dirty = git_commit()
+    completed = len(generator.latency["forward"])
+    result = {
+        "commit": commit,
+        "dirty": dirty,
+        "started_at": datetime.now().isoformat(timespec="seconds"),
+        "config": {name: value for name, value in vars(args).items() if name not in ("output", "baseline", "keep")},
+        "elapsed_s": round(elapsed, 2),
+        "injected": generator.injected,
+        "unmatched": {"forward": len(generator._forwards), "callback_answer": len(generator._callbacks),
+                      "close": len(generator._closes), "notification": len(generator._notifications)},
+        "throughput": {"forwards_per_s": round(completed / elapsed, 2) if elapsed else 0.0},
+        "latency_ms": {kind: percentiles(samples) for kind, samples in generator.latency.items()},
+        "reminder_sweep": histogram_summary(metrics, "aisbot_reminder_sweep_seconds").get("all", {}),
+        "handlers": histogram_summary(metrics, "aisbot_handler_seconds"),
+        "telegram_calls": telegram.calls,
+        "webhook_failures": telegram.webhook_failures,
+        "api_calls": api.calls,
+        "replicas": [{"id": replica["id"], "killed": replica["metrics"] is None,
+                      "leader": is_leader(replica["metrics"]),
+                      "reminders_sent": int(sum((replica["metrics"] or {}).get("aisbot_reminders_sent_total", {}).values()))}
+                     for replica in replicas],
+        "failover": failover,
+        # Linux reports ru_maxrss in KiB
+        "peak_rss_mb": round(resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss / 1024, 1),
+    }
+    if args.keep:
+        print(f"Bot data and logs kept in {work_dir}")
+    else:
+        shutil.rmtree(work_dir, ignore_errors=True)
+    return result
+
+def print_report(result, baseline=None):
+    print(f"commit {result['commit']}{' (dirty)' if result['dirty'] else ''}, {result['elapsed_s']}s, "
+          f"injected {result['injected']}, peak RSS {result['peak_rss_mb']} MB")
+    print(f"{'latency ms':<18}{'count':>7}{'p50':>9}{'p95':>9}{'p99':>9}{'max':>9}")
+    for kind, row in result["latency_ms"].items():
+        if not row["count"]:
+            continue
+        line = f"{kind:<18}{row['count']:>7}{row['p50']:>9}{row['p95']:>9}{row['p99']:>9}{row['max']:>9}"
+        old = (baseline or {}).get("latency_ms", {}).get(kind, {})
+        if old.get("count"):
+            line += f"   p95 {row['p95'] - old['p95']:+.2f} vs {baseline['commit']}"
+        print(line)
+    sweep = result["reminder_sweep"]
+    if sweep:
+        print(f"reminder sweeps: {sweep['count']}, mean {sweep['mean_ms']} ms")
+    print(f"forwards/s: {result['throughput']['forwards_per_s']}, unmatched: {result['unmatched']}")
+    if result.get("webhook_failures"):
+        print(f"webhook deliveries refused or unanswered: {result['webhook_failures']}")
+    if len(result["replicas"]) > 1:
+        print("replicas: " + ", ".join(f"{replica['id']}{' (leader)' if replica['leader'] else ''}"
+                                       f"{' (killed)' if replica['killed'] else ''} {replica['reminders_sent']} reminders"
+                                       for replica in result["replicas"]))
+    if result.get("failover"):
+        print(f"failover: {result['failover']['killed']} -> {result['failover']['new_leader']} "
+              f"in {result['failover']['failover_s']}s")
+
+def failures(result):
+    # A run where nothing got through measured nothing: fail it instead of reporting empty latencies
+    problems = []
+    if result["injected"]["appeal"] and not result["latency_ms"]["forward"]["count"]:
+        problems.append(f"{result['injected']['appeal']} appeals injected, none forwarded")
+    if result["injected"]["callback"] and not result["latency_ms"]["close"]["count"]:
+        problems.append(f"{result['injected']['callback']} callbacks injected, no appeal closed")
+    return problems
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--mode", choices=("polling", "webhook"), default="polling")
+    parser.add_argument("--merchants", type=int, default=10)
+    parser.add_argument("--traders", type=int, default=30)
+    parser.add_argument("--appeal-rate", type=float, default=5.0, help="appeal messages per second")
+    parser.add_argument("--callback-rate", type=float, default=3.0, help="trader button presses per second")
+    parser.add_argument("--notification-rate", type=float, default=1.0, help="notification messages per second")
+    parser.add_argument("--media-ratio", type=float, default=0.3, help="share of appeals sent with a photo")
+    parser.add_argument("--duration", type=float, default=120.0)
+    parser.add_argument("--drain", type=float, default=30.0, help="seconds to wait for in-flight work after the load stops")
+    parser.add_argument("--telegram-latency", type=float, default=0.0, help="seconds added to every Bot API call")
+    parser.add_argument("--api-latency", type=float, default=0.05, help="mean appeals API latency in seconds")
+    parser.add_argument("--api-error-rate", type=float, default=0.0)
+    parser.add_argument("--api-resolved-rate", type=float, default=0.0, help="share of status lookups that report a closed appeal")
+    parser.add_argument("--replicas", type=int, default=1, help="bot processes sharing one DATA_DIR (webhook mode)")
+    parser.add_argument("--kill-leader-at", type=float, help="SIGKILL the reminders leader this many seconds into the run")
+    parser.add_argument("--bot-env", action="append", default=[], metavar="NAME=VALUE", help="extra environment for the bot")
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--startup-timeout", type=float, default=30.0)
+    parser.add_argument("--shutdown-timeout", type=float, default=30.0)
+    parser.add_argument("--output", help="result file (default: benchmarks/results/loadtest-<commit>-<time>.json)")
+    parser.add_argument("--baseline", help="earlier result file to compare against")
+    parser.add_argument("--keep", action="store_true", help="keep the bot's scratch data and logs")
+    args = parser.parse_args()
+    if args.replicas > 1 and args.mode != "webhook":
+        parser.error("--replicas needs --mode webhook")
+
+    result = asyncio.run(run(args))
+    baseline = None
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+    print_report(result, baseline)
+
+    output = args.output
+    if not output:
+        os.makedirs(RESULTS_DIR, exist_ok=True)
+        output = os.path.join(RESULTS_DIR, f"loadtest-{result['commit']}-{datetime.now():%Y%m%d-%H%M%S}.json")
+    with open(output, "w") as f:
+        json.dump(result, f, indent=2)
+    print(f"Results written to {output}")
+    problems = failures(result)
+    if problems:
+        sys.exit("Load test failed: " + "; ".join(problems))
+
+if __name__ == "__main__":
+    main()
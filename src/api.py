@@ -1,72 +1,316 @@
-import requests
+import asyncio
+import base64
+import json
 import time
+import httpx
+from collections import OrderedDict
 from datetime import datetime, timedelta
-from .config import API_URL, API_LOGIN, API_PASSWORD
+from .config import (API_URL, API_LOGIN, API_PASSWORD, API_TIMEOUT, API_CONNECT_TIMEOUT,
+                     API_MAX_CONNECTIONS, API_MAX_KEEPALIVE, API_KEEPALIVE_EXPIRY,
+                     API_RETRIES, API_RETRY_DELAY, API_STATUS_CONCURRENCY,
+                     STATUS_CACHE_SIZE, STATUS_TTL_PENDING, STATUS_TTL_TERMINAL,
+                     API_ACCESS_TTL, API_REFRESH_TTL, API_TOKEN_REFRESH_MARGIN)
 from .utils import logger
+from .metrics import api_request_seconds, api_retries, api_auth, api_unauthorized
+from .breaker import CircuitBreaker, backoff
+
+def jwt_expiry(token):
+    # The exp claim of an unverified JWT payload; None for opaque tokens
+    try:
+        payload = token.split(".")[1]
+        claims = json.loads(base64.urlsafe_b64decode(payload + "=" * (-len(payload) % 4)))
+        return datetime.fromtimestamp(float(claims["exp"]))
+    except (IndexError, KeyError, TypeError, ValueError, OverflowError, AttributeError):
+        return None
+
+def is_outage(error):
+    # 4xx answers mean the API is up and said no; only transport errors, 5xx and
+    # unparseable bodies count against the circuit breaker
+    return not (isinstance(error, httpx.HTTPStatusError) and error.response.status_code < 500)
+
+def token_expiry(data, token, lifetime_key, default_seconds):
+    # Server-reported lifetime first, then the JWT exp claim, then the configured default
+    lifetime = data.get(lifetime_key)
+    if lifetime:
+        return datetime.now() + timedelta(seconds=float(lifetime))
+    return jwt_expiry(token) or datetime.now() + timedelta(seconds=default_seconds)
+
+class StatusCache:
+    # LRU of appeal statuses; "pending" expires quickly, terminal states are kept long
+    def __init__(self, max_size=STATUS_CACHE_SIZE, pending_ttl=STATUS_TTL_PENDING, terminal_ttl=STATUS_TTL_TERMINAL):
+        self.max_size = max_size
+        self.pending_ttl = pending_ttl
+        self.terminal_ttl = terminal_ttl
+        self._entries = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self.coalesced = 0
+        self.evictions = 0
+
+    def __len__(self):
+        return len(self._entries)
+
+    def get(self, appeal_id):
+        entry = self._entries.get(appeal_id)
+        if entry is None:
+            self.misses += 1
+            return None
+        status, expires_at = entry
+        if expires_at <= time.monotonic():
+            del self._entries[appeal_id]
+            self.misses += 1
+            return None
+        self._entries.move_to_end(appeal_id)
+        self.hits += 1
+        return status
+
+    def put(self, appeal_id, status):
+        ttl = self.pending_ttl if status.get("status") == "pending" else self.terminal_ttl
+        self._entries[appeal_id] = (status, time.monotonic() + ttl)
+        self._entries.move_to_end(appeal_id)
+        while len(self._entries) > self.max_size:
+            self._entries.popitem(last=False)
+            self.evictions += 1
+
+    def invalidate(self, appeal_id):
+        self._entries.pop(appeal_id, None)
+
+    def stats(self):
+        lookups = self.hits + self.misses
+        return {
+            "size": len(self._entries),
+            "hits": self.hits,
+            "misses": self.misses,
+            "coalesced": self.coalesced,
+            "evictions": self.evictions,
+            "hit_ratio": self.hits / lookups if lookups else 0.0,
+        }
 
 class APIManager:
-    def __init__(self):
+    def __init__(self, base_url=API_URL, timeout=API_TIMEOUT, connect_timeout=API_CONNECT_TIMEOUT,
+                 max_connections=API_MAX_CONNECTIONS, max_keepalive=API_MAX_KEEPALIVE,
+                 keepalive_expiry=API_KEEPALIVE_EXPIRY, retries=API_RETRIES, retry_delay=API_RETRY_DELAY,
+                 status_concurrency=API_STATUS_CONCURRENCY, refresh_margin=API_TOKEN_REFRESH_MARGIN):
+        self.base_url = base_url
+        self.timeout = httpx.Timeout(timeout, connect=connect_timeout)
+        self.limits = httpx.Limits(max_connections=max_connections,
+                                   max_keepalive_connections=max_keepalive,
+                                   keepalive_expiry=keepalive_expiry)
+        self.retries = retries
+        self.retry_delay = retry_delay
+        self.status_concurrency = status_concurrency
+        self.status_cache = StatusCache()
+        self._inflight = {}
+        self._client = None
         self.access_token = None
         self.refresh_token = None
         self.access_expiry = None
         self.refresh_expiry = None
+        self.access_lifetime = API_ACCESS_TTL
+        self.refresh_margin = refresh_margin
+        self._auth_lock = asyncio.Lock()
+        self.breaker = CircuitBreaker("appeals_api")
+        self._refresher = None
+
+    def _record_error(self, error):
+        if is_outage(error):
+            self.breaker.record_failure()
+        else:
+            # The API answered: it is up, and a half-open probe must not stay in use
+            self.breaker.record_success()
+
+    @property
+    def degraded(self):
+        # Breaker open: callers skip status checks instead of waiting on a dead API
+        return self.breaker.is_open
+
+    @property
+    def client(self):
+        # One keep-alive client shared by every call, created lazily inside the running loop
+        if self._client is None or self._client.is_closed:
+            self._client = httpx.AsyncClient(base_url=self.base_url, timeout=self.timeout, limits=self.limits)
+        return self._client
+
+    def start(self):
+        # Refresh ahead of expiry in the background so lookups never wait on auth
+        if self._refresher is None:
+            self._refresher = asyncio.create_task(self._refresh_ahead())
+
+    async def close(self):
+        if self._refresher is not None:
+            self._refresher.cancel()
+            try:
+                await self._refresher
+            except asyncio.CancelledError:
+                pass
+            self._refresher = None
+        if self._client is not None and not self._client.is_closed:
+            await self._client.aclose()
+            logger.info("Closed API HTTP client")
+        self._client = None
+
+    def _store_tokens(self, data, refresh=False):
+        self.access_token = data["access_token"]
+        self.access_expiry = token_expiry(data, self.access_token, "expires_in", API_ACCESS_TTL)
+        self.access_lifetime = (self.access_expiry - datetime.now()).total_seconds()
+        # Refresh responses may or may not rotate the refresh token
+        if not refresh or data.get("refresh_token"):
+            self.refresh_token = data["refresh_token"]
+            self.refresh_expiry = token_expiry(data, self.refresh_token, "refresh_expires_in", API_REFRESH_TTL)
 
-    def authenticate(self):
-        url = f"{API_URL}/api/auth/login"  # Still guessing, docs don’t confirm
+    async def authenticate(self):
+        url = "/api/auth/login"  # Still guessing, docs don’t confirm
         payload = {"login": API_LOGIN, "password": API_PASSWORD}
+        if self.breaker.is_open:
+            return False
+        started = time.perf_counter()
         try:
-            response = requests.post(url, json=payload, timeout=10)
+            response = await self.client.post(url, json=payload)
             response.raise_for_status()
-            data = response.json()
-            self.access_token = data["access_token"]
-            self.refresh_token = data["refresh_token"]
-            self.access_expiry = datetime.now() + timedelta(minutes=5)
-            self.refresh_expiry = datetime.now() + timedelta(minutes=30)
-            logger.info("Successfully authenticated with API")
+            self._store_tokens(response.json())
+            logger.info(f"Successfully authenticated with API, access token valid until {self.access_expiry:%H:%M:%S}")
+            self.breaker.record_success()
+            api_auth.labels("login", "ok").inc()
+            api_request_seconds.labels("login", "ok").observe(time.perf_counter() - started)
             return True
-        except requests.RequestException as e:
+        except (httpx.HTTPError, KeyError, ValueError, TypeError) as e:
             logger.error(f"Authentication failed: {e}")
+            self._record_error(e)
+            api_auth.labels("login", "error").inc()
+            api_request_seconds.labels("login", "error").observe(time.perf_counter() - started)
             return False
 
-    def refresh_access_token(self):
-        url = f"{API_URL}/api/auth/refresh"  # Still guessing
+    async def refresh_access_token(self):
+        url = "/api/auth/refresh"  # Still guessing
         payload = {"refresh_token": self.refresh_token}
+        if self.breaker.is_open:
+            return False
+        started = time.perf_counter()
         try:
-            response = requests.post(url, json=payload, timeout=10)
+            response = await self.client.post(url, json=payload)
             response.raise_for_status()
-            data = response.json()
-            self.access_token = data["access_token"]
-            self.access_expiry = datetime.now() + timedelta(minutes=5)
-            logger.info("Access token refreshed")
+            self._store_tokens(response.json(), refresh=True)
+            logger.info(f"Access token refreshed, valid until {self.access_expiry:%H:%M:%S}")
+            self.breaker.record_success()
+            api_auth.labels("refresh", "ok").inc()
+            api_request_seconds.labels("refresh", "ok").observe(time.perf_counter() - started)
             return True
-        except requests.RequestException as e:
+        except (httpx.HTTPError, KeyError, ValueError, TypeError) as e:
             logger.error(f"Token refresh failed: {e}")
+            self._record_error(e)
+            api_auth.labels("refresh", "error").inc()
+            api_request_seconds.labels("refresh", "error").observe(time.perf_counter() - started)
             return False
 
-    def ensure_valid_token(self):
-        now = datetime.now()
-        if not self.access_token or now >= self.refresh_expiry:
+    def token_ttl(self):
+        if self.access_token is None:
+            return 0.0
+        return max((self.access_expiry - datetime.now()).total_seconds(), 0.0)
+
+    def _token_usable(self, rejected=None):
+        return (self.access_token is not None and self.access_token != rejected
+                and datetime.now() < self.access_expiry)
+
+    async def _renew(self, margin=0.0):
+        # Caller holds _auth_lock
+        if self.refresh_token and datetime.now() + timedelta(seconds=margin) < self.refresh_expiry:
+            if await self.refresh_access_token():
+                return True
+        else:
             logger.info("Refresh token expired or no tokens, re-authenticating")
-            return self.authenticate()
-        elif now >= self.access_expiry:
-            logger.info("Access token expired, refreshing")
-            if not self.refresh_access_token():
-                return self.authenticate()
-        return True
-
-    def get_appeal_status(self, appeal_id):
-        if not self.ensure_valid_token():
+        return await self.authenticate()
+
+    async def ensure_valid_token(self, rejected=None):
+        # `rejected` is the token a request just got a 401 with: renew even if it
+        # has not expired yet, unless another caller already replaced it
+        if self._token_usable(rejected):
+            return True
+        # Single-flight: whoever takes the lock renews, everyone queued behind it
+        # finds a fresh token on the re-check
+        async with self._auth_lock:
+            if self._token_usable(rejected):
+                return True
+            logger.info("Access token rejected, renewing" if rejected else "Access token expired, renewing")
+            return await self._renew()
+
+    def _refresh_margin(self):
+        # Short-lived tokens get half their lifetime rather than a fixed margin
+        return min(self.refresh_margin, self.access_lifetime / 2)
+
+    async def _refresh_ahead(self):
+        failures = 0
+        while True:
+            if failures:
+                delay = max(backoff(self.retry_delay, failures, 60), self.breaker.stats()["retry_in"])
+            elif self.access_token is None:
+                delay = 0
+            else:
+                margin = self._refresh_margin()
+                now = datetime.now()
+                delay = min((self.access_expiry - now).total_seconds(),
+                            (self.refresh_expiry - now).total_seconds()) - margin
+            await asyncio.sleep(max(delay, 0))
+            async with self._auth_lock:
+                margin = self._refresh_margin() if self.access_token else 0.0
+                horizon = datetime.now() + timedelta(seconds=margin)
+                # A request-path renewal may have beaten us to it
+                if self.access_token and horizon < self.access_expiry and horizon < self.refresh_expiry:
+                    failures = 0
+                    continue
+                renewed = await self._renew(margin)
+            failures = 0 if renewed else failures + 1
+            if not renewed:
+                logger.warning(f"Background token renewal failed ({failures} in a row)")
+
+    async def get_appeal_status(self, appeal_id):
+        status = self.status_cache.get(appeal_id)
+        if status is not None or self.degraded:
+            return status
+        # Single-flight: concurrent lookups of one id share the same HTTP call
+        task = self._inflight.get(appeal_id)
+        if task is None:
+            task = asyncio.ensure_future(self._load_appeal_status(appeal_id))
+            self._inflight[appeal_id] = task
+            task.add_done_callback(lambda _: self._inflight.pop(appeal_id, None))
+        else:
+            self.status_cache.coalesced += 1
+        return await asyncio.shield(task)
+
+    async def _load_appeal_status(self, appeal_id):
+        if not await self.ensure_valid_token():
             logger.error("Failed to get valid token, cannot fetch appeal status")
             return None
-        
-        url = f"{API_URL}/api/requests/?page=1&page_size=1&ordering=-id&search={appeal_id}"
-        headers = {"Authorization": f"Bearer {self.access_token}"}
-        for attempt in range(3):
+        status = await self._fetch_appeal_status(appeal_id)
+        if status is not None:
+            self.status_cache.put(appeal_id, status)
+        return status
+
+    async def _authorized_get(self, url, params):
+        # A 401 means the token died early (revoked, clock skew): renew once and
+        # repeat the call without spending one of the retries
+        token = self.access_token
+        response = await self.client.get(url, params=params, headers={"Authorization": f"Bearer {token}"})
+        if response.status_code == 401:
+            api_unauthorized.inc()
+            logger.warning("API rejected the access token, renewing and retrying")
+            if await self.ensure_valid_token(rejected=token):
+                response = await self.client.get(url, params=params, headers={"Authorization": f"Bearer {self.access_token}"})
+        return response
+
+    async def _fetch_appeal_status(self, appeal_id):
+        params = {"page": 1, "page_size": 1, "ordering": "-id", "search": appeal_id}
+        for attempt in range(self.retries):
+            if not self.breaker.allow():
+                logger.debug(f"Appeals API circuit open, not looking up {appeal_id}")
+                return None
+            started = time.perf_counter()
             try:
-                response = requests.get(url, headers=headers, timeout=10)
+                response = await self._authorized_get("/api/requests/", params)
                 response.raise_for_status()
                 data = response.json()
-                logger.info(f"API response for {appeal_id}: {data}")
+                self.breaker.record_success()
+                api_request_seconds.labels("requests", "ok").observe(time.perf_counter() - started)
+                logger.debug("API response for %s: %s", appeal_id, data)
                 # Flexible parsing based on docs’ POST response style
                 if isinstance(data, list) and len(data) > 0:
                     # No explicit "status" in docs; guess it’s there or infer
@@ -74,12 +318,49 @@ class APIManager:
                 elif isinstance(data, dict):
                     return {"status": data.get("status", "unknown")}
                 return None
-            except requests.RequestException as e:
-                logger.error(f"Attempt {attempt + 1}/3 failed for {appeal_id}: {e}")
-                if attempt < 2:
-                    time.sleep(5)
+            except asyncio.CancelledError:
+                self.breaker.release()
+                raise
+            except (httpx.HTTPError, ValueError) as e:
+                api_request_seconds.labels("requests", "error").observe(time.perf_counter() - started)
+                self._record_error(e)
+                logger.error(f"Attempt {attempt + 1}/{self.retries} failed for {appeal_id}: {e}")
+                if attempt < self.retries - 1:
+                    api_retries.inc()
+                    await asyncio.sleep(backoff(self.retry_delay, attempt, self.retry_delay * 2 ** self.retries))
                 else:
                     logger.error("All retries failed")
                     return None
 
-api_manager = APIManager()
\ No newline at end of file
+    async def get_appeal_statuses(self, appeal_ids, concurrency=None):
+        # The search endpoint matches one appeal per query, so resolve a batch as a
+        # bounded fan-out over the pooled client instead of one call after another
+        unique_ids = list(dict.fromkeys(appeal_ids))
+        if not unique_ids:
+            return {}
+        if self.degraded:
+            logger.warning(f"Appeals API circuit open, skipping {len(unique_ids)} status lookups")
+            return dict.fromkeys(unique_ids)
+        # Authenticate once up front rather than from every concurrent lookup
+        await self.ensure_valid_token()
+
+        semaphore = asyncio.Semaphore(concurrency or self.status_concurrency)
+
+        async def fetch(appeal_id):
+            async with semaphore:
+                return await self.get_appeal_status(appeal_id)
+
+        results = await asyncio.gather(*(fetch(appeal_id) for appeal_id in unique_ids), return_exceptions=True)
+        statuses = {}
+        for appeal_id, result in zip(unique_ids, results):
+            if isinstance(result, Exception):
+                logger.error(f"Status lookup for {appeal_id} failed: {result}")
+                result = None
+            statuses[appeal_id] = result
+        logger.info(f"Resolved {len(unique_ids)} appeal statuses, cache: {self.status_cache.stats()}")
+        return statuses
+
+    def cache_stats(self):
+        return self.status_cache.stats()
+
+api_manager = APIManager()
@@ -1,21 +1,115 @@
 import signal
 import asyncio  # Added this
 from telegram.ext import Application, CommandHandler, MessageHandler, CallbackQueryHandler, ContextTypes, filters
-from .config import BOT_TOKEN
-from .utils import logger, load_groups, load_appeals_cache
-from .handlers import start, register_merchant, register_trader_group, register_trader_username, list_groups, handle_message, handle_callback, remind_traders, debug_update
+from .config import BOT_TOKEN, BOT_MODE, BOT_API_BASE_URL, GROUP_FILE, MULTI_REPLICA, REPLICA_ID, RETENTION_SWEEP_INTERVAL
+from .utils import logger, load_groups
+from .storage import load_appeals_cache, load_pending_appeals, save_appeals_cache, close_appeals_cache
+from .persistence import persister
+from .outbound import outbound
+from .routing import TraderRouter
+from .reminders import reminder_scheduler
+from .handlers import start, register_merchant, register_trader_group, register_trader_username, list_groups, stats, profile, archived, handle_message, handle_callback, remind_traders, expire_appeals, debug_update, update_latency_stats
+from .api import api_manager
+from .webhook import WebhookServer, run_webhook
+from .lanes import ChatLaneUpdateProcessor, AdmissionQueue
+from .metrics import registry, metrics_server
+from .profiling import loop_lag_monitor, profiler
+from .coordination import leader_lease, state_sync
 
 def shutdown(signum, frame, application):
     logger.info("Shutting down bot...")
     application.stop()
     logger.info("Bot stopped.")
 
+def register_gauges(application):
+    # Sizes are read when scraped, nothing is updated on the hot paths
+    bot_data = application.bot_data
+    gauges = {
+        "appeals_cache_size": ("Open appeals in the appeals cache", lambda: len(bot_data["appeals_cache"])),
+        "pending_appeals_size": ("Merchant messages awaiting a trader callback", lambda: len(load_pending_appeals())),
+        "status_cache_size": ("Cached appeals API statuses", lambda: len(api_manager.status_cache)),
+        "api_token_ttl_seconds": ("Seconds until the appeals API access token expires", api_manager.token_ttl),
+        "reminders_pending": ("Reminders scheduled and not sent yet", lambda: len(reminder_scheduler)),
+        "outbound_queue_depth": ("Telegram sends queued or parked", lambda: outbound.depth),
+        "updates_pending": ("Updates admitted and not processed yet", lambda: application.update_processor.stats()["pending"]),
+        "persist_dirty_targets": ("State waiting for the next write-behind flush", lambda: persister.pending),
+    }
+    for name, (documentation, function) in gauges.items():
+        registry.gauge(name, documentation).set_function(function)
+    lookups = registry.gauge("status_cache_lookups", "Appeals API status cache lookups by result", ("result",))
+    for result in ("hits", "misses", "coalesced", "evictions"):
+        lookups.labels(result).set_function(lambda result=result: api_manager.status_cache.stats()[result])
+    groups = registry.gauge("groups", "Registered groups", ("kind",))
+    groups.labels("merchant").set_function(lambda: len(bot_data["groups"]["merchant"]))
+    groups.labels("trader").set_function(lambda: len(bot_data["groups"]["trader"]))
+    groups.labels("trader_account").set_function(lambda: len(bot_data["groups"]["trader_accounts"]))
+
+def on_leadership(application, leading):
+    # Only the lease holder runs reminders; a new holder starts from the shared store
+    if leading:
+        state_sync.sync()
+        reminder_scheduler.activate(application.bot_data["appeals_cache"])
+    else:
+        reminder_scheduler.deactivate()
+
+async def flush_appeals(appeals):
+    # Shared-mode writes that outwaited the busy timeout are retried on the loop like
+    # every other row write; the commit (and a WAL checkpoint it may trigger) runs in
+    # a worker thread
+    appeals.flush_unsaved()
+    await asyncio.to_thread(save_appeals_cache, appeals)
+
+async def on_startup(application):
+    if MULTI_REPLICA:
+        persister.register_callback("groups", lambda: state_sync.save_groups(application.bot_data["groups"]))
+    else:
+        persister.register_json("groups", GROUP_FILE, lambda: application.bot_data["groups"])
+    persister.register_callback("appeals", lambda: flush_appeals(application.bot_data["appeals_cache"]))
+    persister.start()
+    outbound.start()
+    api_manager.start()
+    register_gauges(application)
+    await metrics_server.start()
+    loop_lag_monitor.start()
+    profiler.install_signal(application)
+    if MULTI_REPLICA:
+        state_sync.start(application.bot_data)
+        leader_lease.on_change(lambda leading: on_leadership(application, leading))
+        await leader_lease.start()
+
+async def on_shutdown(application):
+    await leader_lease.stop()
+    await state_sync.stop()
+    await metrics_server.stop()
+    await loop_lag_monitor.stop()
+    # Drain queued sends first (they can still mark state dirty), then flush the write-behind persister
+    await outbound.stop()
+    await persister.stop()
+    await api_manager.close()
+    close_appeals_cache()
+    state_sync.close()
+    logger.info(f"Update latency ({BOT_MODE}): {update_latency_stats()['update_latency']}")
+    logger.info(f"Update lanes: {application.update_processor.stats()}")
+
 def main():
-    application = Application.builder().token(BOT_TOKEN).build()
+    # Chats are processed in parallel, each chat's updates in order (see lanes.py)
+    update_processor = ChatLaneUpdateProcessor()
+    application = (
+        Application.builder()
+        .token(BOT_TOKEN)
+        .concurrent_updates(update_processor)
+        .update_queue(AdmissionQueue(update_processor))
+        .base_url(f"{BOT_API_BASE_URL}/bot")
+        .base_file_url(f"{BOT_API_BASE_URL}/file/bot")
+        .post_init(on_startup)
+        .post_shutdown(on_shutdown)
+        .build()
+    )
 
     # Load initial data
-    application.bot_data["groups"] = load_groups()
+    application.bot_data["groups"] = state_sync.load_groups(load_groups()) if MULTI_REPLICA else load_groups()
     application.bot_data["appeals_cache"] = load_appeals_cache()
+    application.bot_data["router"] = TraderRouter(application.bot_data["groups"])
     logger.info(f"Loaded groups: {len(application.bot_data['groups']['merchant'])} merchants, {len(application.bot_data['groups']['trader'])} traders")
     logger.info(f"Loaded appeals cache: {len(application.bot_data['appeals_cache'])}")
 
@@ -26,18 +120,37 @@ def main():
     application.add_handler(CommandHandler("register_trader_group", register_trader_group))
     application.add_handler(CommandHandler("register_trader_username", register_trader_username))
     application.add_handler(CommandHandler("listgroups", list_groups))
+    application.add_handler(CommandHandler("stats", stats))
+    application.add_handler(CommandHandler("profile", profile))
+    application.add_handler(CommandHandler("archived", archived))
     application.add_handler(CallbackQueryHandler(handle_callback))
     application.add_handler(MessageHandler((filters.TEXT | filters.CAPTION) & ~filters.COMMAND, handle_message))
 
-    # Schedule reminder task
-    application.job_queue.run_once(lambda ctx: asyncio.create_task(remind_traders(ctx)), 0)
+    # Schedule reminders per appeal deadline, restoring the ones still pending in the store.
+    # Replicas wait until they win the lease (on_leadership).
+    reminder_scheduler.attach(application.job_queue, remind_traders)
+    if MULTI_REPLICA:
+        reminder_scheduler.deactivate()
+        logger.info(f"Replica {REPLICA_ID}: reminders wait for the lease")
+    else:
+        reminder_scheduler.restore(application.bot_data["appeals_cache"])
+
+    # Move appeals past the retention limits out of the working set
+    application.job_queue.run_repeating(expire_appeals, interval=RETENTION_SWEEP_INTERVAL, first=60, name="expire_appeals")
 
     # Handle shutdown
     signal.signal(signal.SIGINT, lambda s, f: shutdown(s, f, application))
     signal.signal(signal.SIGTERM, lambda s, f: shutdown(s, f, application))
 
-    logger.info("Starting polling...")
-    application.run_polling(timeout=60)
+    if BOT_MODE == "webhook":
+        logger.info("Starting webhook...")
+        health_info = lambda: {**update_latency_stats(), "update_lanes": update_processor.stats(),
+                               "appeals_api": api_manager.breaker.stats(),
+                               "replica": {"id": REPLICA_ID, "leader": leader_lease.is_leader} if MULTI_REPLICA else None}
+        asyncio.run(run_webhook(application, WebhookServer(application, health_info=health_info)))
+    else:
+        logger.info("Starting polling...")
+        application.run_polling(timeout=60)
 
 if __name__ == "__main__":
     main()
\ No newline at end of file
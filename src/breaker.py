@@ -0,0 +1,92 @@
+import random
+import time
+from .config import (BREAKER_FAILURE_THRESHOLD, BREAKER_RESET_TIMEOUT, BREAKER_MAX_RESET_TIMEOUT,
+                     BREAKER_HALF_OPEN_CALLS, BREAKER_JITTER)
+from .metrics import registry
+from .utils import logger
+
+CLOSED = "closed"
+HALF_OPEN = "half_open"
+OPEN = "open"
+STATES = (CLOSED, HALF_OPEN, OPEN)
+
+breaker_state = registry.gauge("breaker_state", "Circuit breaker state: 0 closed, 1 half-open, 2 open", ("breaker",))
+breaker_transitions = registry.counter("breaker_transitions_total", "Circuit breaker state changes", ("breaker", "state"))
+breaker_rejected = registry.counter("breaker_rejected_total", "Calls short-circuited by a circuit breaker", ("breaker",))
+
+def backoff(base, attempt, cap, jitter=BREAKER_JITTER):
+    # base * 2**attempt, capped, spread by +/- jitter so callers don't retry in lockstep
+    delay = min(base * 2 ** attempt, cap)
+    return delay * random.uniform(1 - jitter, 1 + jitter)
+
+class CircuitBreaker:
+    # closed: calls go through, consecutive failures are counted
+    # open: calls fail fast until retry_at
+    # half-open: a few probe calls go through; one success closes, one failure reopens
+    def __init__(self, name, failure_threshold=BREAKER_FAILURE_THRESHOLD, reset_timeout=BREAKER_RESET_TIMEOUT,
+                 max_reset_timeout=BREAKER_MAX_RESET_TIMEOUT, half_open_calls=BREAKER_HALF_OPEN_CALLS,
+                 jitter=BREAKER_JITTER):
+        self.name = name
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.max_reset_timeout = max_reset_timeout
+        self.half_open_calls = half_open_calls
+        self.jitter = jitter
+        self.state = CLOSED
+        self.failures = 0
+        self.trips = 0          # consecutive openings, drives the backoff
+        self.retry_at = 0.0
+        self._probes = 0
+        self._rejected = breaker_rejected.labels(name)
+        breaker_state.labels(name).set_function(lambda: STATES.index(self.state))
+
+    @property
+    def is_open(self):
+        # True while calls are being short-circuited
+        return self.state == OPEN and time.monotonic() < self.retry_at
+
+    def allow(self):
+        if self.state == OPEN:
+            if time.monotonic() < self.retry_at:
+                self._rejected.inc()
+                return False
+            self._transition(HALF_OPEN)
+        if self.state == HALF_OPEN:
+            if self._probes >= self.half_open_calls:
+                self._rejected.inc()
+                return False
+            self._probes += 1
+        return True
+
+    def release(self):
+        # A call that ended without an outcome (cancelled) gives its probe slot back
+        if self.state == HALF_OPEN and self._probes:
+            self._probes -= 1
+
+    def record_success(self):
+        self.failures = 0
+        if self.state != CLOSED:
+            self.trips = 0
+            self._transition(CLOSED)
+
+    def record_failure(self):
+        self.failures += 1
+        if self.state != CLOSED or self.failures >= self.failure_threshold:
+            self._trip()
+
+    def _trip(self):
+        delay = backoff(self.reset_timeout, self.trips, self.max_reset_timeout, self.jitter)
+        self.trips += 1
+        self.retry_at = time.monotonic() + delay
+        self._transition(OPEN, f" after {self.failures} consecutive failures, next probe in {delay:.1f}s")
+
+    def _transition(self, state, detail=""):
+        log = logger.info if state == CLOSED else logger.warning
+        log(f"Circuit breaker '{self.name}': {self.state} -> {state}{detail}")
+        self.state = state
+        self._probes = 0
+        breaker_transitions.labels(self.name, state).inc()
+
+    def stats(self):
+        return {"state": self.state, "failures": self.failures, "trips": self.trips,
+                "retry_in": max(self.retry_at - time.monotonic(), 0.0) if self.state == OPEN else 0.0}
@@ -1,16 +1,122 @@
 import os
+import socket
 from dotenv import load_dotenv
 
 load_dotenv()
 
 BOT_TOKEN = os.getenv("BOT_TOKEN")
+BOT_MODE = os.getenv("BOT_MODE", "polling").lower()  # polling | webhook
+BOT_API_BASE_URL = os.getenv("BOT_API_BASE_URL", "https://api.telegram.org").rstrip("/")
 API_KEY = os.getenv("API_KEY")
 API_URL = os.getenv("API_URL")
-DATA_DIR = os.path.join(os.path.dirname(os.path.dirname(__file__)), "data")
-LOG_DIR = os.path.join(os.path.dirname(os.path.dirname(__file__)), "logs")
+API_LOGIN = os.getenv("API_LOGIN")
+API_PASSWORD = os.getenv("API_PASSWORD")
+DATA_DIR = os.getenv("DATA_DIR", os.path.join(os.path.dirname(os.path.dirname(__file__)), "data"))
+LOG_DIR = os.getenv("LOG_DIR", os.path.join(os.path.dirname(os.path.dirname(__file__)), "logs"))
 GROUP_FILE = os.path.join(DATA_DIR, "groups.json")
 APPEALS_FILE = os.path.join(DATA_DIR, "appeals.json")
+APPEALS_DB = os.getenv("APPEALS_DB", os.path.join(DATA_DIR, "appeals.db"))
 LOG_FILE = os.path.join(LOG_DIR, "bot.log")
+LOG_LEVEL = os.getenv("LOG_LEVEL", "INFO").upper()
+LOG_MAX_BYTES = int(os.getenv("LOG_MAX_BYTES", str(10 * 1024 * 1024)))
+LOG_BACKUP_COUNT = int(os.getenv("LOG_BACKUP_COUNT", "5"))
+LOG_SAMPLING = os.getenv("LOG_SAMPLING", "update=0.1")  # category=rate,... for high-volume messages
+LOG_HTTPX_LEVEL = os.getenv("LOG_HTTPX_LEVEL", "WARNING").upper()
+PENDING_APPEALS_MAX = int(os.getenv("PENDING_APPEALS_MAX", "10000"))
+PENDING_APPEALS_TTL = float(os.getenv("PENDING_APPEALS_TTL", str(7 * 24 * 3600)))
+PERSIST_INTERVAL = float(os.getenv("PERSIST_INTERVAL", "2"))
+REMINDER_WINDOW = float(os.getenv("REMINDER_WINDOW", "5"))
+REMINDER_DIGEST = os.getenv("REMINDER_DIGEST", "true").lower() in ("1", "true", "yes")
+
+# Appeals API HTTP client
+API_TIMEOUT = float(os.getenv("API_TIMEOUT", "10"))
+API_CONNECT_TIMEOUT = float(os.getenv("API_CONNECT_TIMEOUT", "5"))
+API_MAX_CONNECTIONS = int(os.getenv("API_MAX_CONNECTIONS", "20"))
+API_MAX_KEEPALIVE = int(os.getenv("API_MAX_KEEPALIVE", "10"))
+API_KEEPALIVE_EXPIRY = float(os.getenv("API_KEEPALIVE_EXPIRY", "30"))
+API_RETRIES = int(os.getenv("API_RETRIES", "3"))
+API_RETRY_DELAY = float(os.getenv("API_RETRY_DELAY", "1"))
+API_STATUS_CONCURRENCY = int(os.getenv("API_STATUS_CONCURRENCY", "10"))
+# Token lifetimes when the login/refresh response carries neither expires_in nor a JWT exp claim
+API_ACCESS_TTL = float(os.getenv("API_ACCESS_TTL", "300"))
+API_REFRESH_TTL = float(os.getenv("API_REFRESH_TTL", "1800"))
+API_TOKEN_REFRESH_MARGIN = float(os.getenv("API_TOKEN_REFRESH_MARGIN", "60"))
+STATUS_CACHE_SIZE = int(os.getenv("STATUS_CACHE_SIZE", "5000"))
+STATUS_TTL_PENDING = float(os.getenv("STATUS_TTL_PENDING", "20"))
+STATUS_TTL_TERMINAL = float(os.getenv("STATUS_TTL_TERMINAL", "3600"))
+
+# Appeals API circuit breaker: open after N consecutive failures, probe again after a
+# jittered, doubling delay
+BREAKER_FAILURE_THRESHOLD = int(os.getenv("BREAKER_FAILURE_THRESHOLD", "5"))
+BREAKER_RESET_TIMEOUT = float(os.getenv("BREAKER_RESET_TIMEOUT", "10"))
+BREAKER_MAX_RESET_TIMEOUT = float(os.getenv("BREAKER_MAX_RESET_TIMEOUT", "300"))
+BREAKER_HALF_OPEN_CALLS = int(os.getenv("BREAKER_HALF_OPEN_CALLS", "1"))
+BREAKER_JITTER = float(os.getenv("BREAKER_JITTER", "0.2"))
+
+# Retention: open appeals past either limit move from the appeals table to gzip JSONL
+# files under ARCHIVE_DIR/YYYY/MM/ (0 turns a limit off)
+APPEAL_MAX_AGE = float(os.getenv("APPEAL_MAX_AGE", str(7 * 24 * 3600)))
+APPEAL_FINAL_REMINDER_GRACE = float(os.getenv("APPEAL_FINAL_REMINDER_GRACE", str(24 * 3600)))
+ARCHIVE_DIR = os.getenv("ARCHIVE_DIR", os.path.join(DATA_DIR, "archive"))
+RETENTION_SWEEP_INTERVAL = float(os.getenv("RETENTION_SWEEP_INTERVAL", "3600"))
+
+# Outbound Telegram sends
+OUTBOUND_WORKERS = int(os.getenv("OUTBOUND_WORKERS", "4"))
+OUTBOUND_GLOBAL_RATE = float(os.getenv("OUTBOUND_GLOBAL_RATE", "30"))
+OUTBOUND_CHAT_RATE = float(os.getenv("OUTBOUND_CHAT_RATE", "1"))
+OUTBOUND_GROUP_RATE = float(os.getenv("OUTBOUND_GROUP_RATE", "20")) / 60
+OUTBOUND_GROUP_BURST = float(os.getenv("OUTBOUND_GROUP_BURST", "5"))
+OUTBOUND_MAX_RETRIES = int(os.getenv("OUTBOUND_MAX_RETRIES", "5"))
+FORWARD_CONCURRENCY = int(os.getenv("FORWARD_CONCURRENCY", "10"))
+
+# Incoming update processing: chats run in parallel, updates of one chat in order
+UPDATE_WORKERS = int(os.getenv("UPDATE_WORKERS", "8"))
+UPDATE_LANE_SIZE = int(os.getenv("UPDATE_LANE_SIZE", "100"))
+UPDATE_MAX_PENDING = int(os.getenv("UPDATE_MAX_PENDING", "1000"))
+
+# Metrics and admin commands
+METRICS_LISTEN = os.getenv("METRICS_LISTEN", "127.0.0.1")
+METRICS_PORT = int(os.getenv("METRICS_PORT", "9108"))  # 0 turns the endpoint off
+ADMIN_IDS = {int(user_id) for user_id in os.getenv("ADMIN_IDS", "").replace(" ", "").split(",") if user_id}
+
+# Profiling (/profile, SIGUSR2) and the event loop lag monitor
+PROFILE_SAMPLE_INTERVAL = float(os.getenv("PROFILE_SAMPLE_INTERVAL", "0.005"))
+PROFILE_SIGNAL_SECONDS = float(os.getenv("PROFILE_SIGNAL_SECONDS", "30"))
+PROFILE_MAX_SECONDS = float(os.getenv("PROFILE_MAX_SECONDS", "300"))
+LOOP_LAG_INTERVAL = float(os.getenv("LOOP_LAG_INTERVAL", "0.5"))  # 0 turns the monitor off
+LOOP_LAG_WARN = float(os.getenv("LOOP_LAG_WARN", "0.25"))
+
+# Several replicas on one host sharing DATA_DIR, webhook mode behind a load balancer.
+# One replica holds the lease and runs reminders; appeals and groups live in APPEALS_DB.
+MULTI_REPLICA = os.getenv("MULTI_REPLICA", "false").lower() in ("1", "true", "yes")
+REPLICA_ID = os.getenv("REPLICA_ID", f"{socket.gethostname()}-{os.getpid()}")
+LEASE_DB = os.getenv("LEASE_DB", os.path.join(DATA_DIR, "coordination.db"))
+LEASE_TTL = float(os.getenv("LEASE_TTL", "10"))
+LEASE_RENEW_INTERVAL = float(os.getenv("LEASE_RENEW_INTERVAL", "2"))
+STATE_SYNC_INTERVAL = float(os.getenv("STATE_SYNC_INTERVAL", "1"))
+CHANGE_LOG_TTL = float(os.getenv("CHANGE_LOG_TTL", "3600"))  # a replica further behind reloads all appeals
+# How long an APPEALS_DB write waits for another replica's write lock; handlers write on the loop
+SHARED_DB_BUSY_TIMEOUT = float(os.getenv("SHARED_DB_BUSY_TIMEOUT", "0.25"))
+
+# Webhook ingress (BOT_MODE=webhook)
+WEBHOOK_URL = os.getenv("WEBHOOK_URL")  # public https URL Telegram posts to, path included
+WEBHOOK_LISTEN = os.getenv("WEBHOOK_LISTEN", "0.0.0.0")
+WEBHOOK_PORT = int(os.getenv("WEBHOOK_PORT", "8443"))
+WEBHOOK_PATH = os.getenv("WEBHOOK_PATH", "/telegram")
+WEBHOOK_SECRET = os.getenv("WEBHOOK_SECRET")
+WEBHOOK_MAX_CONNECTIONS = int(os.getenv("WEBHOOK_MAX_CONNECTIONS", "40"))
+HEALTH_PATH = os.getenv("HEALTH_PATH", "/healthz")
 
 if not all([BOT_TOKEN, API_KEY, API_URL]):
-    raise ValueError("Missing BOT_TOKEN, API_KEY, or API_URL in .env")
\ No newline at end of file
+    raise ValueError("Missing BOT_TOKEN, API_KEY, or API_URL in .env")
+if BOT_MODE not in ("polling", "webhook"):
+    raise ValueError(f"Unknown BOT_MODE {BOT_MODE!r}, expected polling or webhook")
+if BOT_MODE == "webhook" and not WEBHOOK_URL:
+    raise ValueError("Missing WEBHOOK_URL in .env for BOT_MODE=webhook")
+if MULTI_REPLICA and BOT_MODE != "webhook":
+    raise ValueError("MULTI_REPLICA needs BOT_MODE=webhook, getUpdates serves only one consumer")
+if MULTI_REPLICA and not WEBHOOK_SECRET:
+    # Each replica would make up its own secret and only the last one to call setWebhook would accept updates
+    raise ValueError("Missing WEBHOOK_SECRET in .env, MULTI_REPLICA needs one secret shared by all replicas")
+if LEASE_RENEW_INTERVAL * 2 > LEASE_TTL:
+    raise ValueError("LEASE_RENEW_INTERVAL must be at most half of LEASE_TTL")
@@ -0,0 +1,215 @@
+import asyncio
+import copy
+import sqlite3
+import time
+from .config import (MULTI_REPLICA, REPLICA_ID, LEASE_DB, LEASE_TTL, LEASE_RENEW_INTERVAL, STATE_SYNC_INTERVAL,
+                     CHANGE_LOG_TTL)
+from .metrics import registry
+from .storage import SharedGroups, connect
+from .reminders import reminder_scheduler
+from .utils import logger
+
+LEASE_SCHEMA = """
+CREATE TABLE IF NOT EXISTS leases (
+    name TEXT PRIMARY KEY,
+    holder TEXT NOT NULL,
+    expires REAL NOT NULL,
+    term INTEGER NOT NULL
+);
+"""
+
+leader_changes = registry.counter("leader_changes_total", "Times this replica gained or lost the reminders lease", ("change",))
+state_reloads = registry.counter("state_reloads_total", "Shared state reloaded after another replica wrote it", ("kind",))
+
+class Lease:
+    # Leader election over one SQLite row. The holder renews it every
+    # renew_interval; any replica may take it over once `expires` has passed
+    # (wall clock, so all replicas must share the host). term goes up with
+    # every new holder. The lease lives in its own database so renewals do not
+    # bump the appeals database's data_version.
+    def __init__(self, name, replica_id=REPLICA_ID, path=LEASE_DB, ttl=LEASE_TTL, renew_interval=LEASE_RENEW_INTERVAL):
+        self.name = name
+        self.replica_id = replica_id
+        self.path = path
+        self.ttl = ttl
+        self.renew_interval = renew_interval
+        self.holder = None
+        self.term = 0
+        self.held_until = 0.0
+        self.leading = False
+        self._callbacks = []
+        self._conn = None
+        self._task = None
+
+    @property
+    def is_leader(self):
+        # Pessimistic local view: a renewal running late counts as lost before
+        # anyone else can take the lease over
+        return time.time() < self.held_until
+
+    def on_change(self, callback):
+        self._callbacks.append(callback)
+
+    def _acquire(self):
+        # Runs in a worker thread; a busy database must not stall the loop
+        now = time.time()
+        self._conn.execute("BEGIN IMMEDIATE")
+        try:
+            row = self._conn.execute("SELECT holder, expires, term FROM leases WHERE name = ?", (self.name,)).fetchone()
+            if row is not None and row[0] != self.replica_id and row[1] > now:
+                self._conn.execute("COMMIT")
+                return 0.0, row[0], row[2]
+            term = row[2] if row is not None and row[0] == self.replica_id else (row[2] + 1 if row else 1)
+            self._conn.execute("INSERT OR REPLACE INTO leases (name, holder, expires, term) VALUES (?, ?, ?, ?)",
+                               (self.name, self.replica_id, now + self.ttl, term))
+            self._conn.execute("COMMIT")
+            return now + self.ttl - self.renew_interval, self.replica_id, term
+        except BaseException:
+            self._conn.execute("ROLLBACK")
+            raise
+
+    def _release(self):
+        self._conn.execute("UPDATE leases SET expires = 0 WHERE name = ? AND holder = ?", (self.name, self.replica_id))
+
+    async def start(self):
+        self._conn = sqlite3.connect(self.path, timeout=self.renew_interval, isolation_level=None, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.executescript(LEASE_SCHEMA)
+        registry.gauge("leader", "1 while this replica holds the reminders lease").set_function(lambda: int(self.is_leader))
+        # First round before returning, so a lone replica leads from the start
+        await self._renew()
+        self._task = asyncio.create_task(self._run())
+
+    async def _renew(self):
+        try:
+            held_until, holder, term = await asyncio.to_thread(self._acquire)
+        except sqlite3.Error as e:
+            # Keep the old expiry: is_leader runs out on its own if this persists
+            logger.error(f"Lease {self.name}: renewal failed: {e}")
+        else:
+            if holder != self.holder:
+                logger.info(f"Lease {self.name}: held by {holder} (term {term})")
+            self.held_until, self.holder, self.term = held_until, holder, term
+        leading = self.is_leader
+        if leading != self.leading:
+            self.leading = leading
+            leader_changes.labels("gained" if leading else "lost").inc()
+            logger.warning(f"Replica {self.replica_id} {'is now' if leading else 'is no longer'} the {self.name} leader")
+            for callback in self._callbacks:
+                callback(leading)
+
+    async def _run(self):
+        while True:
+            await asyncio.sleep(self.renew_interval)
+            await self._renew()
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        if self._conn is not None:
+            # Hand over now instead of making the others wait out the TTL
+            if self.leading:
+                await asyncio.to_thread(self._release)
+                logger.info(f"Lease {self.name}: released")
+            self._conn.close()
+            self._conn = None
+        self.held_until = 0.0
+        self.leading = False
+
+class StateSync:
+    # Folds writes made by other replicas into this process: polls the appeals
+    # database's data_version, reloads the appeals mirror and group registrations
+    # when it moves, and keeps the reminder heap in step on the lease holder.
+    # Group registrations use their own connection from worker threads: saving
+    # them takes the write lock and may wait for another replica.
+    def __init__(self, interval=STATE_SYNC_INTERVAL, change_log_ttl=CHANGE_LOG_TTL):
+        self.interval = interval
+        self.change_log_ttl = change_log_ttl
+        self._pruned_at = 0.0
+        self.bot_data = None
+        self.groups = None
+        self._task = None
+
+    def load_groups(self, seed):
+        self.groups = SharedGroups(connect())
+        return self.groups.load(seed)
+
+    async def save_groups(self, groups):
+        # Snapshot on the loop, handlers keep mutating the live dict
+        await asyncio.to_thread(self.groups.save, copy.deepcopy(groups))
+
+    def start(self, bot_data):
+        self.bot_data = bot_data
+        self._task = asyncio.create_task(self._run())
+
+    def sync(self):
+        if self.bot_data is None:
+            return
+        appeals_cache = self.bot_data["appeals_cache"]
+        changes = appeals_cache.refresh()
+        if changes is not None:
+            added, removed = changes
+            state_reloads.labels("appeals").inc()
+            for appeal_key in removed:
+                reminder_scheduler.cancel(appeal_key)
+            for appeal_key in added:
+                reminder_scheduler.schedule(appeal_key, appeals_cache[appeal_key], arm=False)
+            reminder_scheduler.arm()
+            if added or removed:
+                logger.info(f"Appeals changed by other replicas: +{len(added)} -{len(removed)}")
+
+    def prune(self):
+        # The lease holder trims the appeals change log now and then
+        if not leader_lease.is_leader or time.monotonic() - self._pruned_at < 60:
+            return
+        self._pruned_at = time.monotonic()
+        removed = self.bot_data["appeals_cache"].prune_changes(self.change_log_ttl)
+        if removed:
+            logger.info(f"Pruned {removed} appeal change log entries")
+
+    async def sync_groups(self):
+        if self.bot_data is None or self.groups is None:
+            return
+        groups = await asyncio.to_thread(self.groups.refresh)
+        if groups is not None:
+            # Same dict object: handlers and the gauges hold references to it
+            current = self.bot_data["groups"]
+            current.clear()
+            current.update(groups)
+            self.bot_data["router"].rebuild(current)
+            state_reloads.labels("groups").inc()
+
+    async def _run(self):
+        while True:
+            await asyncio.sleep(self.interval)
+            try:
+                self.sync()
+                await self.sync_groups()
+                self.prune()
+            except sqlite3.Error as e:
+                logger.error(f"Shared state sync failed: {e}")
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    def close(self):
+        if self.groups is not None:
+            self.groups.conn.close()
+            self.groups = None
+
+def owns_reminders():
+    return not MULTI_REPLICA or leader_lease.is_leader
+
+leader_lease = Lease("reminders")
+state_sync = StateSync()
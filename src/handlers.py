@@ -1,103 +1,200 @@
 from telegram import Update, InlineKeyboardButton, InlineKeyboardMarkup
 from telegram.ext import ContextTypes, ConversationHandler, CommandHandler, MessageHandler, filters
-from .utils import logger, escape_markdown_v2, load_groups, save_groups, load_appeals_cache, save_appeals_cache, set_chat_context
+from .utils import logger, escape_markdown_v2, load_groups, set_chat_context, lazy, percentiles
+from .storage import load_appeals_cache, load_pending_appeals
+from .persistence import persister
+from .outbound import outbound, reply, reply_later, PRIORITY_RELAY, PRIORITY_FORWARD, PRIORITY_REMINDER
+from .media import appeal_media, message_media, send_media, edit_media_text
 from .api import api_manager
-from datetime import datetime, timedelta
+from .routing import router_for
+from .parser import parse_message, positional_appeal_id, KIND_NOTIFICATION, KIND_APPEALS
+from .reminders import reminder_scheduler, reminder_flag, reminder_text, reminder_digest
+from .coordination import owns_reminders, state_sync
+from .retention import retention
+from .metrics import track_handler, reminder_sweep_seconds, reminders_sent, summary as metrics_summary
+from .profiling import profiler, MODES as PROFILE_MODES
+from .config import REMINDER_DIGEST, FORWARD_CONCURRENCY, ADMIN_IDS, PROFILE_SIGNAL_SECONDS
+from collections import OrderedDict, deque
+from datetime import datetime, timezone
 import asyncio
-import re
+import time
 
 # Define states for the conversation
 WAITING_FOR_MESSAGE, WAITING_FOR_APPEAL_ID = range(2)
 
+# (trader chat, trader message) of callbacks already taken, oldest first; Approve and
+# Decline on one message share a key
+handled_callbacks = OrderedDict()
+HANDLED_CALLBACKS_MAX = 10000
+
+# Seconds from the message date Telegram stamped to the first handler, to compare
+# polling and webhook ingress (a fake Telegram server can send fractional dates)
+update_latency = deque(maxlen=1024)
+
+@track_handler
 async def start(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    logger.chat_info = set_chat_context(update.message.chat)
-    await update.message.reply_text("Bot is running! Use /register_merchant, /register_trader_group, or /register_trader_username <username> to set up.")
+    set_chat_context(update.message.chat)
+    await reply(update.message, "Bot is running! Use /register_merchant, /register_trader_group, or /register_trader_username <username> to set up.")
 
+@track_handler
 async def register_merchant(update: Update, context: ContextTypes.DEFAULT_TYPE):
     chat = update.message.chat
-    logger.chat_info = set_chat_context(chat)
+    set_chat_context(chat)
     groups = context.bot_data.get("groups", load_groups())
-    if any(g["id"] == chat.id for g in groups["merchant"]):
-        await update.message.reply_text("This group is already registered as a merchant group!")
+    router = router_for(context.bot_data)
+    if router.merchant(chat.id):
+        await reply(update.message, "This group is already registered as a merchant group!")
         return
-    groups["merchant"].append({"id": chat.id, "title": chat.title, "appeal_id_start_pos": 0, "appeal_id_length": 0})  # Default
+    merchant_group = {"id": chat.id, "title": chat.title, "appeal_id_start_pos": 0, "appeal_id_length": 0}  # Default
+    groups["merchant"].append(merchant_group)
+    router.add_merchant(merchant_group)
     context.bot_data["groups"] = groups
-    save_groups(groups)
+    persister.mark_dirty("groups")
     logger.info("Registered %s as merchant", chat.title)
-    await update.message.reply_text(f"Registered {chat.title} as a merchant group.")
+    await reply(update.message, f"Registered {chat.title} as a merchant group.")
 
+@track_handler
 async def register_trader_group(update: Update, context: ContextTypes.DEFAULT_TYPE):
     chat = update.message.chat
-    logger.chat_info = set_chat_context(chat)
+    set_chat_context(chat)
     groups = context.bot_data.get("groups", load_groups())
-    if any(g["id"] == chat.id for g in groups["trader"]):
-        await update.message.reply_text("This group is already registered as a trader group!")
+    router = router_for(context.bot_data)
+    if router.trader(chat.id):
+        await reply(update.message, "This group is already registered as a trader group!")
         return
-    groups["trader"].append({"id": chat.id, "title": chat.title})
+    trader_group = {"id": chat.id, "title": chat.title}
+    groups["trader"].append(trader_group)
+    router.add_trader(trader_group)
     context.bot_data["groups"] = groups
-    save_groups(groups)
+    persister.mark_dirty("groups")
     logger.info("Registered %s as trader group", chat.title)
-    await update.message.reply_text(f"Registered {chat.title} as a trader group. Now register a trader username with /register_trader_username <username>.")
+    await reply(update.message, f"Registered {chat.title} as a trader group. Now register a trader username with /register_trader_username <username>.")
 
+@track_handler
 async def register_trader_username(update: Update, context: ContextTypes.DEFAULT_TYPE):
     chat = update.message.chat
-    logger.chat_info = set_chat_context(chat)
+    set_chat_context(chat)
     if not context.args:
-        await update.message.reply_text("Usage: /register_trader_username <username>")
+        await reply(update.message, "Usage: /register_trader_username <username>")
         return
     trader_username = context.args[0].lstrip('@')
     groups = context.bot_data.get("groups", load_groups())
-    if chat.id not in [g["id"] for g in groups["trader"]]:
+    if not router_for(context.bot_data).trader(chat.id):
         logger.info("Failed to register trader username @%s: not a trader group", trader_username)
-        await update.message.reply_text("This group must be registered as a trader group first with /register_trader_group!")
+        await reply(update.message, "This group must be registered as a trader group first with /register_trader_group!")
         return
     groups["trader_accounts"][str(chat.id)] = trader_username
     context.bot_data["groups"] = groups
-    save_groups(groups)
+    persister.mark_dirty("groups")
     logger.info("Registered trader username @%s for group %s", trader_username, chat.title)
-    await update.message.reply_text(f"Registered @{trader_username} as the trader for {chat.title}.")
+    await reply(update.message, f"Registered @{trader_username} as the trader for {chat.title}.")
 
+@track_handler
 async def list_groups(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    logger.chat_info = set_chat_context(update.message.chat)
+    set_chat_context(update.message.chat)
     groups = context.bot_data.get("groups", load_groups())
     merchant_list = "\n".join(f"- {g['title']} (ID: {g['id']}, Appeal ID Start: {g.get('appeal_id_start_pos', 0)}, Length: {g.get('appeal_id_length', 0)})" for g in groups["merchant"]) or "None"
     trader_list = "\n".join(f"- {g['title']} (ID: {g['id']}) @{groups['trader_accounts'].get(str(g['id']), 'No username')}" for g in groups["trader"]) or "None"
     response = f"Merchant Groups:\n{merchant_list}\n\nTrader Groups:\n{trader_list}"
-    await update.message.reply_text(response)
+    await reply(update.message, response)
     logger.info("Listed groups: Merchant=%s, Trader=%s", len(groups["merchant"]), len(groups["trader"]))
 
+def appeal_key(merchant_chat_id, message_id, index):
+    # One cache row per appeal: a merchant message can carry several, even for the same trader
+    return f"{merchant_chat_id}_{message_id}_{index}"
+
+def appeal_keyboard(merchant_chat_id, message_id, index):
+    # callback_data is capped at 64 bytes, so the appeal travels as its index in the message
+    return InlineKeyboardMarkup([[
+        InlineKeyboardButton("Approve", callback_data=f"approve_{merchant_chat_id}_{message_id}_{index}"),
+        InlineKeyboardButton("Decline", callback_data=f"decline_{merchant_chat_id}_{message_id}_{index}")]])
+
+async def admin_only(update):
+    if update.effective_user.id in ADMIN_IDS:
+        return True
+    logger.warning("Refused %s for user %s", update.message.text.split()[0], update.effective_user.id)
+    await reply(update.message, "This command is for bot admins only.")
+    return False
+
+async def reply_long(message, text):
+    # Telegram caps a message at 4096 characters
+    while text:
+        chunk, text = text[:4096], text[4096:]
+        if text:
+            cut = chunk.rfind("\n") + 1 or len(chunk)
+            chunk, text = chunk[:cut], chunk[cut:] + text
+        await reply(message, chunk)
+
+@track_handler
+async def stats(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    set_chat_context(update.message.chat)
+    if not await admin_only(update):
+        return
+    await reply_long(update.message, metrics_summary() or "No metrics recorded yet.")
+
+@track_handler
+async def profile(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    set_chat_context(update.message.chat)
+    if not await admin_only(update):
+        return
+    try:
+        seconds = float(context.args[0]) if context.args else PROFILE_SIGNAL_SECONDS
+    except ValueError:
+        await reply(update.message, "Usage: /profile <seconds> [sample|cprofile]")
+        return
+    mode = context.args[1] if len(context.args) > 1 else "sample"
+    if mode not in PROFILE_MODES:
+        await reply(update.message, "Usage: /profile <seconds> [sample|cprofile]")
+        return
+    if profiler.active is not None:
+        await reply(update.message, "A profiling session is already running.")
+        return
+    await reply(update.message, f"Profiling ({mode}) for {seconds:g}s...")
+    # Runs in the background so this chat's lane is not held for the whole session
+    context.application.create_task(report_profile(update.message, seconds, mode), update=update)
+
+async def report_profile(message, seconds, mode):
+    try:
+        paths, summary = await profiler.run(seconds, mode)
+    except (RuntimeError, ValueError) as e:
+        await reply(message, str(e))
+        return
+    await reply_long(message, f"Profile written to {', '.join(paths)}\n\n{summary}")
+
+@track_handler
 async def define_appeal_id_start(update: Update, context: ContextTypes.DEFAULT_TYPE):
     chat = update.message.chat
-    logger.chat_info = set_chat_context(chat)
+    set_chat_context(chat)
     logger.info("Started /define_appeal_id")
-    groups = context.bot_data.get("groups", load_groups())
-    if not any(g["id"] == chat.id for g in groups["merchant"]):
-        await update.message.reply_text("This group must be registered as a merchant group first with /register_merchant!")
+    if not router_for(context.bot_data).merchant(chat.id):
+        await reply(update.message, "This group must be registered as a merchant group first with /register_merchant!")
         return ConversationHandler.END
     
-    await update.message.reply_text("Please send a sample appeal message from this group.")
+    await reply(update.message, "Please send a sample appeal message from this group.")
     return WAITING_FOR_MESSAGE
 
+@track_handler
 async def receive_appeal_message(update: Update, context: ContextTypes.DEFAULT_TYPE):
     chat = update.message.chat
-    logger.chat_info = set_chat_context(chat)
+    set_chat_context(chat)
     message_text = update.message.text or update.message.caption or ""
     if not message_text.strip():
-        await update.message.reply_text("Please send a message with text!")
+        await reply(update.message, "Please send a message with text!")
         return WAITING_FOR_MESSAGE
     
     context.user_data["appeal_message"] = message_text
     logger.info("Received sample appeal message: '%s'", message_text)
-    await update.message.reply_text("What’s the appeal_id in this message? Reply with the exact appeal_id.")
+    await reply(update.message, "What’s the appeal_id in this message? Reply with the exact appeal_id.")
     return WAITING_FOR_APPEAL_ID
 
+@track_handler
 async def receive_appeal_id(update: Update, context: ContextTypes.DEFAULT_TYPE):
     chat = update.message.chat
-    logger.chat_info = set_chat_context(chat)
+    set_chat_context(chat)
     appeal_id = update.message.text.strip()
     sample_message = context.user_data.get("appeal_message", "")
     if not appeal_id or appeal_id not in sample_message:
-        await update.message.reply_text("That doesn’t seem to be in the message! Please provide the exact appeal_id from the sample.")
+        await reply(update.message, "That doesn’t seem to be in the message! Please provide the exact appeal_id from the sample.")
         return WAITING_FOR_APPEAL_ID
 
     # Calculate character position
@@ -105,20 +202,20 @@ async def receive_appeal_id(update: Update, context: ContextTypes.DEFAULT_TYPE):
     appeal_length = len(appeal_id)
 
     groups = context.bot_data.get("groups", load_groups())
-    for group in groups["merchant"]:
-        if group["id"] == chat.id:
-            group["appeal_id_start_pos"] = start_pos
-            group["appeal_id_length"] = appeal_length
-            break
+    group = router_for(context.bot_data).merchant(chat.id)
+    if group:
+        group["appeal_id_start_pos"] = start_pos
+        group["appeal_id_length"] = appeal_length
     context.bot_data["groups"] = groups
-    save_groups(groups)
+    persister.mark_dirty("groups")
     logger.info("Defined appeal_id position: start=%s, length=%s based on '%s'", start_pos, appeal_length, appeal_id)
-    await update.message.reply_text(f"Set appeal_id position: starts at character {start_pos}, length {appeal_length}")
+    await reply(update.message, f"Set appeal_id position: starts at character {start_pos}, length {appeal_length}")
     return ConversationHandler.END
 
+@track_handler
 async def cancel(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    logger.chat_info = set_chat_context(update.message.chat)
-    await update.message.reply_text("Cancelled appeal_id definition.")
+    set_chat_context(update.message.chat)
+    await reply(update.message, "Cancelled appeal_id definition.")
     return ConversationHandler.END
 
 define_appeal_id_handler = ConversationHandler(
@@ -130,344 +227,291 @@ define_appeal_id_handler = ConversationHandler(
     fallbacks=[CommandHandler("cancel", cancel)]
 )
 
+@track_handler
 async def handle_message(update: Update, context: ContextTypes.DEFAULT_TYPE):
     if not update.message:
         logger.info("No message in update, skipping")
         return
 
     chat = update.message.chat
-    logger.chat_info = set_chat_context(chat)
+    set_chat_context(chat)
     original_message = update.message.text or update.message.caption or ""
-    message_text = original_message.lower()
     message_id = update.message.message_id
 
-    logger.info("Received message: '%s'", message_text)
-    logger.debug("Full update: %s", update.to_dict())
+    logger.info("Received message: '%s'", original_message, extra={"category": "message"})
+    logger.debug("Full update: %s", lazy(update.to_dict))
     logger.info("Message details - Photo: %s, Document: %s, Video: %s, Animation: %s",
                 bool(update.message.photo), bool(update.message.document),
-                bool(update.message.video), bool(update.message.animation))
+                bool(update.message.video), bool(update.message.animation), extra={"category": "message"})
 
-    if message_text.startswith('/'):
-        logger.info("Skipping message because it's a command: '%s'", message_text)
+    if original_message.startswith('/'):
+        logger.info("Skipping message because it's a command: '%s'", original_message)
         return
 
     groups = context.bot_data.get("groups", load_groups())
-    merchant_group = next((g for g in groups["merchant"] if g["id"] == chat.id), None)
+    router = router_for(context.bot_data)
+    merchant_group = router.merchant(chat.id)
     if not merchant_group:
         logger.info("Skipping message because this is not a merchant group")
         return
 
-    if not message_text.strip():
+    if not original_message.strip():
         logger.info("Message text or caption is empty; prompting user")
-        await update.message.reply_text("Please include text (e.g., trader name) with your appeal.")
+        reply_later(update.message, "Please include text (e.g., trader name) with your appeal.")
         return
 
-    # Check for Russian text first (notifications take priority)
-    has_russian = any(1040 <= ord(char) <= 1103 for char in original_message)  # Cyrillic range
-    appeal_ids = re.findall(r"[0-9a-f]{8}-[0-9a-f]{4}-[0-9a-f]{4}-[0-9a-f]{4}-[0-9a-f]{12}", original_message)
-    if has_russian and appeal_ids:
+    # Notifications (Russian text) take priority over appeal lines, see parser.py
+    parsed = parse_message(original_message)
+    if parsed.kind == KIND_NOTIFICATION:
+        appeal_ids = parsed.appeal_ids
         logger.info("Detected notification message with appeal_ids: %s", appeal_ids)
         appeals_cache = context.bot_data.get("appeals_cache", load_appeals_cache())
+        file_type, file_id = message_media(update.message)
         for appeal_id in appeal_ids:
-            # Find trader group from cache (if previously forwarded as an appeal)
-            trader_group_id = next((key.split('_')[0] for key, value in appeals_cache.items() if value["appeal_id"] == appeal_id), None)
-            trader_group = next((g for g in groups["trader"] if str(g["id"]) == trader_group_id), None) if trader_group_id else None
-            if trader_group:
+            # Notify every trader group the appeal was previously forwarded to
+            trader_chat_ids = appeals_cache.trader_chats_for(appeal_id)
+            for trader_group in filter(None, (router.trader(chat_id) for chat_id in sorted(trader_chat_ids))):
                 forward_text = f"Payment appeal `{appeal_id}`"  # No buttons for notification
                 try:
-                    if update.message.photo:
-                        await context.bot.send_photo(
-                            chat_id=trader_group["id"],
-                            photo=update.message.photo[-1].file_id,
-                            caption=forward_text,
-                            parse_mode="MarkdownV2"
-                        )
-                    elif update.message.document:
-                        await context.bot.send_document(
-                            chat_id=trader_group["id"],
-                            document=update.message.document.file_id,
-                            caption=forward_text,
-                            parse_mode="MarkdownV2"
-                        )
-                    elif update.message.video:
-                        await context.bot.send_video(
-                            chat_id=trader_group["id"],
-                            video=update.message.video.file_id,
-                            caption=forward_text,
-                            parse_mode="MarkdownV2"
-                        )
-                    elif update.message.animation:
-                        await context.bot.send_animation(
-                            chat_id=trader_group["id"],
-                            animation=update.message.animation.file_id,
-                            caption=forward_text,
-                            parse_mode="MarkdownV2"
-                        )
-                    else:
-                        await context.bot.send_message(
-                            chat_id=trader_group["id"],
-                            text=forward_text,
-                            parse_mode="MarkdownV2"
-                        )
+                    await send_media(context.bot, PRIORITY_FORWARD, trader_group["id"], forward_text, file_type, file_id, parse_mode="MarkdownV2")
                     logger.info("Sent notification to %s (ID: %s) for appeal %s", trader_group["title"], trader_group["id"], appeal_id)
                 except Exception as e:
                     logger.error("Failed to send notification to %s (ID: %s): %s", trader_group["title"], trader_group["id"], e)
-                    await update.message.reply_text(f"Failed to send notification for appeal '{appeal_id}': {e}")
-        await update.message.reply_text(f"Test: Sent notification for appeal{'s' if len(appeal_ids) > 1 else ''} '{', '.join(appeal_ids)}'")
+                    reply_later(update.message, f"Failed to send notification for appeal '{appeal_id}': {e}")
+        reply_later(update.message, f"Test: Sent notification for appeal{'s' if len(appeal_ids) > 1 else ''} '{', '.join(appeal_ids)}'")
         return  # Exit after handling as notification
 
-    # Process as appeals if no Russian text
-    appeals = []
-    lines = original_message.split('\n')
-    for line in lines:
-        uuid_match = re.match(r"([0-9a-f]{8}-[0-9a-f]{4}-[0-9a-f]{4}-[0-9a-f]{4}-[0-9a-f]{12})\s+(.+)", line.strip())
-        if uuid_match:
-            appeal_id = uuid_match.group(1)
-            rest_of_line = uuid_match.group(2).strip()
-            message_parts = rest_of_line.split()
-            trader_nickname = message_parts[0].lower()  # Take first word as nickname
-            if len(message_parts) > 1 and message_parts[1].lower() in ["niro", "eastwood", "gosling"]:  # Handle multi-word nicknames
-                trader_nickname += " " + message_parts[1].lower()
-            appeals.append((appeal_id, trader_nickname))
-            logger.info("Test: Detected appeal_id '%s' with trader nickname '%s'", appeal_id, trader_nickname)
-
-    if appeals:
+    if parsed.kind == KIND_APPEALS:
+        appeals = parsed.appeals
+        logger.info("Test: Detected appeals (appeal_id, trader nickname): %s", appeals)
         appeals_cache = context.bot_data.get("appeals_cache", load_appeals_cache())
-        for appeal_id, trader_nickname in appeals:
-            matched = False
-            for trader_group in groups["trader"]:
-                trader_title_lower = trader_group["title"].lower()
-                if trader_nickname in trader_title_lower:
-                    matched = True
-                    logger.info("Matched trader group '%s' for nickname '%s'", trader_group["title"], trader_nickname)
-                    keyboard = [[InlineKeyboardButton("Approve", callback_data=f"approve_{chat.id}_{message_id}"),
-                                InlineKeyboardButton("Decline", callback_data=f"decline_{chat.id}_{message_id}")]]
-                    reply_markup = InlineKeyboardMarkup(keyboard)
-
-                    forward_text = f"Payment appeal `{appeal_id}`"
-
-                    # Store the original appeal_id in context.user_data
-                    context.user_data[f"appeal_id_{message_id}"] = appeal_id  # Overwrites for multiple appeals; see notes
-
-                    if update.message.photo:
-                        context.user_data[f"file_type_{message_id}"] = "photo"
-                        context.user_data[f"file_id_{message_id}"] = update.message.photo[-1].file_id
-                    elif update.message.document and update.message.document.mime_type in ["image/jpeg", "image/png", "application/pdf"]:
-                        context.user_data[f"file_type_{message_id}"] = "document"
-                        context.user_data[f"file_id_{message_id}"] = update.message.document.file_id
-                    elif update.message.video and update.message.video.mime_type == "video/mp4":
-                        context.user_data[f"file_type_{message_id}"] = "video"
-                        context.user_data[f"file_id_{message_id}"] = update.message.video.file_id
-                    elif update.message.animation and update.message.animation.mime_type == "video/mp4":
-                        context.user_data[f"file_type_{message_id}"] = "animation"
-                        context.user_data[f"file_id_{message_id}"] = update.message.animation.file_id
-                    else:
-                        context.user_data[f"file_type_{message_id}"] = None
-                        context.user_data[f"file_id_{message_id}"] = None
-
-                    try:
-                        if update.message.photo:
-                            await context.bot.send_photo(
-                                chat_id=trader_group["id"],
-                                photo=context.user_data[f"file_id_{message_id}"],
-                                caption=forward_text,
-                                reply_markup=reply_markup,
-                                parse_mode="MarkdownV2"
-                            )
-                        elif update.message.document:
-                            await context.bot.send_document(
-                                chat_id=trader_group["id"],
-                                document=context.user_data[f"file_id_{message_id}"],
-                                caption=forward_text,
-                                reply_markup=reply_markup,
-                                parse_mode="MarkdownV2"
-                            )
-                        elif update.message.video:
-                            await context.bot.send_video(
-                                chat_id=trader_group["id"],
-                                video=context.user_data[f"file_id_{message_id}"],
-                                caption=forward_text,
-                                reply_markup=reply_markup,
-                                parse_mode="MarkdownV2"
-                            )
-                        elif update.message.animation:
-                            await context.bot.send_animation(
-                                chat_id=trader_group["id"],
-                                animation=context.user_data[f"file_id_{message_id}"],
-                                caption=forward_text,
-                                reply_markup=reply_markup,
-                                parse_mode="MarkdownV2"
-                            )
-                        else:
-                            await context.bot.send_message(
-                                chat_id=trader_group["id"],
-                                text=forward_text,
-                                reply_markup=reply_markup,
-                                parse_mode="MarkdownV2"
-                            )
-                        logger.info("Forwarded appeal to %s (ID: %s)", trader_group["title"], trader_group["id"])
-
-                        trader_username = groups["trader_accounts"].get(str(trader_group["id"]), "")
-                        appeals_cache[f"{trader_group['id']}_{message_id}"] = {
-                            "timestamp": datetime.now().isoformat(),
-                            "trader_username": trader_username,
-                            "chat_id": trader_group["id"],
-                            "appeal_id": appeal_id
-                        }
-                        context.bot_data["appeals_cache"] = appeals_cache
-                        save_appeals_cache(appeals_cache)
-                        logger.info("Stored appeal %s in cache for %s", appeal_id, trader_group["title"])
-                        await update.message.reply_text(f"Test: Forwarded appeal '{appeal_id}'")
-                        break
-                    except Exception as e:
-                        logger.error("Failed to forward to %s (ID: %s): %s", trader_group["title"], trader_group["id"], e)
-                        await update.message.reply_text(f"Failed to send appeal: {e}")
-                        break
-            if not matched:
+        # Keyed by the merchant message and the appeal's index in it, so the callback finds it whichever trader taps
+        file_type, file_id = appeal_media(update.message)
+        pending = load_pending_appeals()
+        for index, (appeal_id, _) in enumerate(appeals):
+            pending.put(chat.id, message_id, appeal_id, file_type, file_id, index=index)
+        semaphore = asyncio.Semaphore(FORWARD_CONCURRENCY)
+        forwarded, unmatched, failed = [], [], []
+
+        async def forward_appeal(index, appeal_id, trader_nickname):
+            trader_group = router.match_nickname(trader_nickname)
+            if not trader_group:
                 logger.info("No trader group matched for nickname '%s'", trader_nickname)
-                await update.message.reply_text(f"No matching trader group found for nickname '{trader_nickname}' in appeal '{appeal_id}'")
+                unmatched.append((appeal_id, trader_nickname))
+                return
+            logger.info("Matched trader group '%s' for nickname '%s'", trader_group["title"], trader_nickname)
+            forward_text = f"Payment appeal `{appeal_id}`"
+            async with semaphore:
+                try:
+                    await send_media(context.bot, PRIORITY_FORWARD, trader_group["id"], forward_text, file_type, file_id,
+                                     reply_markup=appeal_keyboard(chat.id, message_id, index), parse_mode="MarkdownV2")
+                except Exception as e:
+                    logger.error("Failed to forward to %s (ID: %s): %s", trader_group["title"], trader_group["id"], e)
+                    failed.append((appeal_id, e))
+                    return
+            logger.info("Forwarded appeal to %s (ID: %s)", trader_group["title"], trader_group["id"])
+
+            trader_username = groups["trader_accounts"].get(str(trader_group["id"]), "")
+            key = appeal_key(chat.id, message_id, index)
+            appeals_cache[key] = {
+                "timestamp": datetime.now().isoformat(),
+                "trader_username": trader_username,
+                "chat_id": trader_group["id"],
+                "appeal_id": appeal_id
+            }
+            reminder_scheduler.schedule(key, appeals_cache[key])
+            logger.info("Stored appeal %s in cache for %s", appeal_id, trader_group["title"])
+            forwarded.append(appeal_id)
+
+        # return_exceptions: one appeal going wrong outside its own try must not cost the others their summary line
+        results = await asyncio.gather(*(forward_appeal(index, appeal_id, trader_nickname)
+                                         for index, (appeal_id, trader_nickname) in enumerate(appeals)),
+                                       return_exceptions=True)
+        for (appeal_id, _), result in zip(appeals, results):
+            if isinstance(result, Exception):
+                logger.error("Failed to process appeal %s: %s", appeal_id, result)
+                failed.append((appeal_id, result))
+        if forwarded:
+            # One commit for the whole message
+            context.bot_data["appeals_cache"] = appeals_cache
+            persister.mark_dirty("appeals")
+
+        summary = []
+        if forwarded:
+            summary.append(f"Test: Forwarded {len(forwarded)} appeal{'s' if len(forwarded) > 1 else ''}: " + ", ".join(f"'{a}'" for a in forwarded))
+        if unmatched:
+            summary.append("No matching trader group found for: " + ", ".join(f"'{a}' (nickname '{n}')" for a, n in unmatched))
+        if failed:
+            summary.append("Failed to send: " + ", ".join(f"'{a}' ({e})" for a, e in failed))
+        reply_later(update.message, "\n".join(summary))
         return  # Exit after processing all appeals
 
     # Existing appeal_id extraction (fallback)
     start_pos = merchant_group.get("appeal_id_start_pos", 0)
     appeal_length = merchant_group.get("appeal_id_length", 0)
-    if start_pos + appeal_length <= len(original_message):
-        appeal_id = original_message[start_pos:start_pos + appeal_length]
-    else:
-        appeal_id = None
+    appeal_id = positional_appeal_id(original_message, start_pos, appeal_length)
 
     if not appeal_id:
         logger.info("Could not extract appeal_id at start_pos=%s, length=%s from message: '%s'", start_pos, appeal_length, original_message)
-        await update.message.reply_text(f"Couldn’t find an appeal_id at position (start={start_pos}, length={appeal_length}). Use /define_appeal_id to set it.")
+        reply_later(update.message, f"Couldn’t find an appeal_id at position (start={start_pos}, length={appeal_length}). Use /define_appeal_id to set it.")
         return
 
     logger.info("TEST: Extracted appeal_id: '%s' at start_pos=%s, length=%s", appeal_id, start_pos, appeal_length)
-    await update.message.reply_text(f"TEST: Extracted appeal_id is '{appeal_id}' from start={start_pos}, length={appeal_length}")
+    reply_later(update.message, f"TEST: Extracted appeal_id is '{appeal_id}' from start={start_pos}, length={appeal_length}")
 
-    message_words = message_text.strip().split()
     appeals_cache = context.bot_data.get("appeals_cache", load_appeals_cache())
-    matched = False
-    for trader_group in groups["trader"]:
-        trader_title_lower = trader_group["title"].lower()
-        trader_name = trader_title_lower.split(' | trader')[0]
-        trader_name_words = trader_name.split()
-
-        if any(word in trader_name_words for word in message_words):
-            matched = True
-            logger.info("Match found with trader group: %s", trader_group["title"])
-            keyboard = [[InlineKeyboardButton("Approve", callback_data=f"approve_{chat.id}_{message_id}"),
-                        InlineKeyboardButton("Decline", callback_data=f"decline_{chat.id}_{message_id}")]]
-            reply_markup = InlineKeyboardMarkup(keyboard)
+    trader_group = router.match_words(parsed.words)
+    matched = trader_group is not None
+    if matched:
+        logger.info("Match found with trader group: %s", trader_group["title"])
+        reply_markup = appeal_keyboard(chat.id, message_id, 0)
 
-            forward_text = f"Payment appeal `{appeal_id}`"
+        forward_text = f"Payment appeal `{appeal_id}`"
 
-            # Store the original appeal_id in context.user_data
-            context.user_data[f"appeal_id_{message_id}"] = appeal_id
-
-            if update.message.photo:
-                context.user_data[f"file_type_{message_id}"] = "photo"
-                context.user_data[f"file_id_{message_id}"] = update.message.photo[-1].file_id
-            elif update.message.document and update.message.document.mime_type in ["image/jpeg", "image/png", "application/pdf"]:
-                context.user_data[f"file_type_{message_id}"] = "document"
-                context.user_data[f"file_id_{message_id}"] = update.message.document.file_id
-            elif update.message.video and update.message.video.mime_type == "video/mp4":
-                context.user_data[f"file_type_{message_id}"] = "video"
-                context.user_data[f"file_id_{message_id}"] = update.message.video.file_id
-            elif update.message.animation and update.message.animation.mime_type == "video/mp4":
-                context.user_data[f"file_type_{message_id}"] = "animation"
-                context.user_data[f"file_id_{message_id}"] = update.message.animation.file_id
-            else:
-                context.user_data[f"file_type_{message_id}"] = None
-                context.user_data[f"file_id_{message_id}"] = None
+        # Keyed by the merchant message so the callback finds it whichever trader taps
+        file_type, file_id = appeal_media(update.message)
+        load_pending_appeals().put(chat.id, message_id, appeal_id, file_type, file_id)
 
-            try:
-                if update.message.photo:
-                    await context.bot.send_photo(
-                        chat_id=trader_group["id"],
-                        photo=context.user_data[f"file_id_{message_id}"],
-                        caption=forward_text,
-                        reply_markup=reply_markup,
-                        parse_mode="MarkdownV2"
-                    )
-                elif update.message.document:
-                    await context.bot.send_document(
-                        chat_id=trader_group["id"],
-                        document=context.user_data[f"file_id_{message_id}"],
-                        caption=forward_text,
-                        reply_markup=reply_markup,
-                        parse_mode="MarkdownV2"
-                    )
-                elif update.message.video:
-                    await context.bot.send_video(
-                        chat_id=trader_group["id"],
-                        video=context.user_data[f"file_id_{message_id}"],
-                        caption=forward_text,
-                        reply_markup=reply_markup,
-                        parse_mode="MarkdownV2"
-                    )
-                elif update.message.animation:
-                    await context.bot.send_animation(
-                        chat_id=trader_group["id"],
-                        animation=context.user_data[f"file_id_{message_id}"],
-                        caption=forward_text,
-                        reply_markup=reply_markup,
-                        parse_mode="MarkdownV2"
-                    )
-                else:
-                    await context.bot.send_message(
-                        chat_id=trader_group["id"],
-                        text=forward_text,
-                        reply_markup=reply_markup,
-                        parse_mode="MarkdownV2"
-                    )
-                logger.info("Forwarded appeal to %s (ID: %s)", trader_group["title"], trader_group["id"])
-
-                trader_username = groups["trader_accounts"].get(str(trader_group["id"]), "")
-                appeals_cache[f"{trader_group['id']}_{message_id}"] = {
-                    "timestamp": datetime.now().isoformat(),
-                    "trader_username": trader_username,
-                    "chat_id": trader_group["id"],
-                    "appeal_id": appeal_id
-                }
-                context.bot_data["appeals_cache"] = appeals_cache
-                save_appeals_cache(appeals_cache)
-                logger.info("Stored appeal %s in cache for %s", appeal_id, trader_group["title"])
-                await update.message.reply_text(f"Test: Forwarded appeal '{appeal_id}'")
-                break
-            except Exception as e:
-                logger.error("Failed to forward to %s (ID: %s): %s", trader_group["title"], trader_group["id"], e)
-                await update.message.reply_text(f"Failed to send appeal: {e}")
-                break
+        try:
+            await send_media(context.bot, PRIORITY_FORWARD, trader_group["id"], forward_text, file_type, file_id,
+                             reply_markup=reply_markup, parse_mode="MarkdownV2")
+            logger.info("Forwarded appeal to %s (ID: %s)", trader_group["title"], trader_group["id"])
+
+            trader_username = groups["trader_accounts"].get(str(trader_group["id"]), "")
+            key = appeal_key(chat.id, message_id, 0)
+            appeals_cache[key] = {
+                "timestamp": datetime.now().isoformat(),
+                "trader_username": trader_username,
+                "chat_id": trader_group["id"],
+                "appeal_id": appeal_id
+            }
+            context.bot_data["appeals_cache"] = appeals_cache
+            persister.mark_dirty("appeals")
+            reminder_scheduler.schedule(key, appeals_cache[key])
+            logger.info("Stored appeal %s in cache for %s", appeal_id, trader_group["title"])
+            reply_later(update.message, f"Test: Forwarded appeal '{appeal_id}'")
+        except Exception as e:
+            logger.error("Failed to forward to %s (ID: %s): %s", trader_group["title"], trader_group["id"], e)
+            reply_later(update.message, f"Failed to send appeal: {e}")
     if not matched:
         logger.info("No matching trader group found for this appeal")
-        await update.message.reply_text("No matching trader group found.")
+        reply_later(update.message, "No matching trader group found.")
 
+@track_handler
 async def handle_callback(update: Update, context: ContextTypes.DEFAULT_TYPE):
     query = update.callback_query
-    logger.chat_info = set_chat_context(query.message.chat)
+    set_chat_context(query.message.chat)
     data = query.data
     logger.info("Callback received: %s", data)
 
     trader_username = query.from_user.username or query.from_user.first_name
-    action, merchant_chat_id, message_id = data.split("_")
+    action, merchant_chat_id, message_id, *index = data.split("_")
     merchant_chat_id = int(merchant_chat_id)
     trader_chat_id = query.message.chat_id
+    if index:
+        index = int(index[0])
+        key = appeal_key(merchant_chat_id, message_id, index)
+    else:
+        # Buttons sent before appeals carried their index
+        index = 0
+        key = f"{trader_chat_id}_{message_id}"
+
+    # Phase 1: stop the spinner and write the outcome before any slow work. The one edit
+    # also takes the buttons away, so a double tap is a no-op
+    callback_key = (trader_chat_id, query.message.message_id)
+    if callback_key in handled_callbacks:
+        logger.info("Ignoring repeated callback %s", data)
+        await query.answer("Already being handled")
+        return
+    handled_callbacks[callback_key] = True
+    while len(handled_callbacks) > HANDLED_CALLBACKS_MAX:
+        handled_callbacks.popitem(last=False)
+    await query.answer()
+
+    # Both records are per appeal (a merchant message can carry several); the pending one has the media to repost
+    pending = load_pending_appeals().get(merchant_chat_id, int(message_id), index)
+    appeal_data = context.bot_data.get("appeals_cache", load_appeals_cache()).get(key)
+    if appeal_data:
+        appeal_id = appeal_data["appeal_id"]
+    elif pending:
+        appeal_id = pending.appeal_id
+    else:
+        appeal_id = f"APPEAL_{message_id}"  # Fallback to old format if not found
+    file_type = pending.file_type if pending else None
+    file_id = pending.file_id if pending else None
+
     response = "approved ✅" if action == "approve" else "declined ❌"  # Add emojis here
+    updated_text = f"{escape_markdown_v2(trader_username)} {response} `{appeal_id}`"
+    try:
+        # One edit closes the appeal in place (caption or text, buttons dropped)
+        await edit_media_text(context.bot, PRIORITY_RELAY, query.message, updated_text, parse_mode="MarkdownV2")
+        logger.info("Edited trader group message with text: '%s'", updated_text)
+        edited = True
+    except Exception as e:
+        # Message gone or not editable any more: phase 2 deletes and reposts it
+        logger.warning("Could not edit message in trader group %s (%s), reposting", trader_chat_id, e)
+        edited = False
+
+    # Phase 2: API check, merchant relay and trader repost, tracked by the application
+    context.application.create_task(
+        close_appeal(context, query, callback_key, merchant_chat_id, message_id, index, appeal_id, key, response,
+                     updated_text, edited, file_type, file_id),
+        update=update
+    )
+
+async def show_outcome(context, query, text, edited, file_type, file_id):
+    # Put text on the trader message: edit it again if phase 1 could, else resend + delete.
+    # The original goes only once the repost is in, so a failed repost never empties the chat
+    trader_chat_id = query.message.chat_id
+    if edited:
+        await edit_media_text(context.bot, PRIORITY_RELAY, query.message, text, parse_mode="MarkdownV2")
+        logger.info("Edited trader group message with text: '%s'", text)
+        return
+    await send_media(context.bot, PRIORITY_RELAY, trader_chat_id, text, file_type, file_id, parse_mode="MarkdownV2")
+    logger.info("Reposted in trader group with text: '%s'", text)
+    try:
+        await outbound.send(PRIORITY_RELAY, trader_chat_id, context.bot.delete_message,
+            chat_id=trader_chat_id,
+            message_id=query.message.message_id
+        )
+        logger.info("Deleted original message in trader group %s", trader_chat_id)
+    except Exception as e:
+        logger.error("Failed to delete message in trader group %s: %s", trader_chat_id, e)
 
-    # Retrieve the original appeal_id from context.user_data
-    appeal_id = context.user_data.get(f"appeal_id_{message_id}", f"APPEAL_{message_id}")  # Fallback to old format if not found
+async def reopen_appeal(context, query, callback_key, merchant_chat_id, message_id, index, appeal_id):
+    # Closing failed: put the forward and its buttons back and let the next tap through
+    handled_callbacks.pop(callback_key, None)
+    try:
+        await edit_media_text(context.bot, PRIORITY_RELAY, query.message, f"Payment appeal `{appeal_id}`",
+                              reply_markup=appeal_keyboard(merchant_chat_id, message_id, index), parse_mode="MarkdownV2")
+        logger.info("Restored buttons for appeal %s in trader group %s", appeal_id, query.message.chat_id)
+    except Exception as e:
+        logger.error("Failed to restore buttons in trader group %s: %s", query.message.chat_id, e)
 
-    file_type = context.user_data.get(f"file_type_{message_id}")
-    file_id = context.user_data.get(f"file_id_{message_id}")
+@track_handler
+async def close_appeal(context, query, callback_key, merchant_chat_id, message_id, index, appeal_id, appeal_key, response,
+                       updated_text, edited, file_type, file_id):
+    trader_chat_id = query.message.chat_id
 
-    appeal_status = api_manager.get_appeal_status(appeal_id)
+    if api_manager.degraded:
+        # Appeals API down: close on the trader's word rather than wait out the timeouts
+        logger.warning("Appeals API circuit open, closing %s without the status check", appeal_id)
+        appeal_status = None
+    else:
+        appeal_status = await api_manager.get_appeal_status(appeal_id)
     if appeal_status and appeal_status.get("status") != "pending":
         logger.info("Appeal %s already resolved via API: %s", appeal_id, appeal_status["status"])
-        await query.answer(f"Appeal already {appeal_status['status']}")
+        # Phase 1 wrote the trader's answer; replace it with what the API has
+        try:
+            await show_outcome(context, query, f"Appeal `{appeal_id}` already {escape_markdown_v2(appeal_status['status'])}",
+                               edited, file_type, file_id)
+        except Exception as e:
+            logger.error("Failed to update trader group %s: %s", trader_chat_id, e)
+        load_pending_appeals().discard(merchant_chat_id, int(message_id), index)
         return
 
     try:
-        await context.bot.send_message(
+        await outbound.send(PRIORITY_RELAY, merchant_chat_id, context.bot.send_message,
             chat_id=merchant_chat_id,
             text=f"Trader response for `{appeal_id}`: {response}",
             reply_to_message_id=int(message_id),
@@ -478,131 +522,171 @@ async def handle_callback(update: Update, context: ContextTypes.DEFAULT_TYPE):
         logger.error("Failed to send to merchant group %s: %s", merchant_chat_id, e)
 
     try:
-        await context.bot.delete_message(
-            chat_id=trader_chat_id,
-            message_id=query.message.message_id
+        if not edited:
+            await show_outcome(context, query, updated_text, edited, file_type, file_id)
+
+        appeals_cache = context.bot_data.get("appeals_cache", load_appeals_cache())
+        if appeals_cache.discard(appeal_key):
+            context.bot_data["appeals_cache"] = appeals_cache
+            persister.mark_dirty("appeals")
+            logger.info("Removed closed appeal %s from cache", appeal_key)
+        reminder_scheduler.cancel(appeal_key)
+        # Closed: a late tap on the same buttons must not find the record
+        load_pending_appeals().discard(merchant_chat_id, int(message_id), index)
+    except Exception as e:
+        # The dispatcher has already retried transient errors and flood waits
+        logger.error("Failed to repost in trader group %s: %s", trader_chat_id, e)
+        await reopen_appeal(context, query, callback_key, merchant_chat_id, message_id, index, appeal_id)
+        try:
+            await outbound.send(PRIORITY_RELAY, trader_chat_id, context.bot.send_message, chat_id=trader_chat_id, text=f"Failed to repost: {e}")
+        except Exception as e:
+            logger.error("Failed to report the failed repost in trader group %s: %s", trader_chat_id, e)
+
+async def send_reminder(context, chat_id, text):
+    try:
+        await outbound.send(PRIORITY_REMINDER, chat_id, context.bot.send_message,
+            chat_id=chat_id,
+            text=text,
+            parse_mode="MarkdownV2"
         )
-        logger.info("Deleted original message in trader group %s", trader_chat_id)
+        return True
     except Exception as e:
-        logger.error("Failed to delete message in trader group %s: %s", trader_chat_id, e)
+        logger.error("Failed to send reminder to %s: %s", chat_id, e)
+        return False
+
+async def remind_chat(context, appeals_cache, chat_id, trader_username, appeals, now):
+    if REMINDER_DIGEST:
+        entries = [(appeal_key, appeal_id, max(intervals), now - datetime.fromisoformat(timestamp))
+                   for appeal_key, (appeal_id, timestamp, intervals) in appeals.items()]
+        messages = reminder_digest(trader_username, entries)
+    else:
+        messages = [(reminder_text(trader_username, appeal_id, interval), [appeal_key])
+                    for appeal_key, (appeal_id, _, intervals) in appeals.items() for interval in intervals]
+    for text, appeal_keys in messages:
+        logger.info("Attempting to send reminder for %s appeals to %s", len(appeal_keys), chat_id)
+        sent = await send_reminder(context, chat_id, text)
+        for appeal_key in appeal_keys:
+            # Closed while the send was in flight: nothing to flag or defer
+            if appeal_key not in appeals_cache:
+                continue
+            appeal_id, _, intervals = appeals[appeal_key]
+            if not sent:
+                logger.error("Reminder for %s not delivered, deferring", appeal_id)
+                for interval in intervals:
+                    reminder_scheduler.defer(appeal_key, interval, 60)
+                continue
+            appeal_data = appeals_cache[appeal_key]
+            for interval in intervals:
+                appeal_data[reminder_flag(interval)] = True
+            appeals_cache[appeal_key] = appeal_data
+            context.bot_data["appeals_cache"] = appeals_cache
+            persister.mark_dirty("appeals")
+        if sent:
+            reminders_sent.inc()
+            logger.info("Sent reminder for %s appeals to @%s in %s", len(appeal_keys), trader_username, chat_id)
 
-    escaped_username = escape_markdown_v2(trader_username)
-    updated_text = f"{escaped_username} {response} `{appeal_id}`"
-    retries = 3
-    for attempt in range(retries):
-        try:
-            if file_type == "photo" and file_id:
-                await context.bot.send_photo(
-                    chat_id=trader_chat_id,
-                    photo=file_id,
-                    caption=updated_text,
-                    parse_mode="MarkdownV2"
-                )
-            elif file_type == "document" and file_id:
-                await context.bot.send_document(
-                    chat_id=trader_chat_id,
-                    document=file_id,
-                    caption=updated_text,
-                    parse_mode="MarkdownV2"
-                )
-            elif file_type == "video" and file_id:
-                await context.bot.send_video(
-                    chat_id=trader_chat_id,
-                    video=file_id,
-                    caption=updated_text,
-                    parse_mode="MarkdownV2"
-                )
-            elif file_type == "animation" and file_id:
-                await context.bot.send_animation(
-                    chat_id=trader_chat_id,
-                    animation=file_id,
-                    caption=updated_text,
-                    parse_mode="MarkdownV2"
-                )
-            else:
-                await context.bot.send_message(
-                    chat_id=trader_chat_id,
-                    text=updated_text,
-                    parse_mode="MarkdownV2"
-                )
-            logger.info("Reposted in trader group with text: '%s'", updated_text)
-            
-            appeals_cache = context.bot_data.get("appeals_cache", load_appeals_cache())
-            appeal_key = f"{trader_chat_id}_{message_id}"
-            if appeal_key in appeals_cache:
+async def remind_traders(context: ContextTypes.DEFAULT_TYPE):
+    set_chat_context("Reminder Task")
+    reminder_scheduler.fired()
+    if not owns_reminders():
+        # Lease lapsed since this job was armed; the new holder sends these
+        logger.warning("Not the reminders leader any more, skipping sweep")
+        return
+    # Pick up appeals other replicas closed or created since the last sync
+    state_sync.sync()
+    started = time.perf_counter()
+    try:
+        due = reminder_scheduler.pop_due()
+        appeals_cache = context.bot_data.get("appeals_cache", load_appeals_cache())
+        due = [(appeal_key, interval) for appeal_key, interval in due if appeal_key in appeals_cache]
+        if not due:
+            return
+        logger.info("Processing %s due reminders", len(due))
+        if api_manager.degraded:
+            # Appeals API down: remind on schedule alone, resolved appeals get dropped once it is back
+            logger.warning("Appeals API circuit open, sending %s reminders without status checks", len(due))
+            statuses = {}
+        else:
+            statuses = await api_manager.get_appeal_statuses([appeals_cache[appeal_key]["appeal_id"] for appeal_key, _ in due])
+
+        # Collect what is still owed per trader chat: {(chat_id, username): {appeal_key: (appeal_id, timestamp, [intervals])}}.
+        # appeal_id and timestamp are copied now: a callback can close an appeal while we await a send below
+        owed = {}
+        for appeal_key, interval in due:
+            appeal_data = appeals_cache.get(appeal_key)
+            if appeal_data is None:
+                continue
+            trader_username = appeal_data["trader_username"]
+            chat_id = appeal_data["chat_id"]
+            appeal_id = appeal_data["appeal_id"]
+
+            appeal_status = statuses.get(appeal_id)
+            if appeal_status and appeal_status.get("status") != "pending":
+                logger.info("Appeal %s resolved via API: %s", appeal_id, appeal_status["status"])
                 del appeals_cache[appeal_key]
+                reminder_scheduler.cancel(appeal_key)
                 context.bot_data["appeals_cache"] = appeals_cache
-                save_appeals_cache(appeals_cache)
-                logger.info("Removed closed appeal %s from cache", appeal_key)
-            break
-        except Exception as e:
-            logger.error("Attempt %s/%s failed to repost: %s", attempt + 1, retries, e)
-            if attempt < retries - 1:
-                await asyncio.sleep(2)
-            else:
-                await context.bot.send_message(chat_id=trader_chat_id, text=f"Failed to repost after {retries} attempts: {e}")
+                persister.mark_dirty("appeals")
+                continue
+
+            if reminder_flag(interval) in appeal_data:
+                continue
+            if not trader_username:
+                logger.warning("No trader username for appeal %s in chat %s, skipping", appeal_id, chat_id)
+                continue
+            appeals = owed.setdefault((chat_id, trader_username), {})
+            appeals.setdefault(appeal_key, (appeal_id, appeal_data["timestamp"], []))[2].append(interval)
+
+        now = datetime.now()
+        for (chat_id, trader_username), appeals in owed.items():
+            try:
+                await remind_chat(context, appeals_cache, chat_id, trader_username, appeals, now)
+            except Exception as e:
+                # One chat's failure must not cost the other chats their reminders
+                logger.error("Reminder for chat %s failed: %s", chat_id, e)
+    except Exception as e:
+        logger.error("Reminder task error: %s", e)
+    finally:
+        reminder_scheduler.arm()
+        reminder_sweep_seconds.observe(time.perf_counter() - started)
+
+async def expire_appeals(context: ContextTypes.DEFAULT_TYPE):
+    set_chat_context("Retention Task")
+    # Same owner as reminders, so replicas don't archive an appeal twice
+    if not owns_reminders():
+        return
+    state_sync.sync()
+    try:
+        await retention.sweep(context.bot_data.get("appeals_cache", load_appeals_cache()))
+    except Exception as e:
+        logger.error("Retention sweep error: %s", e)
 
-async def remind_traders(context: ContextTypes.DEFAULT_TYPE):
-    logger.chat_info = "Reminder Task"
-    logger.info("Starting trader reminder task")
-    while True:
-        try:
-            appeals_cache = context.bot_data.get("appeals_cache", load_appeals_cache())
-            now = datetime.now()
-            reminder_intervals = [timedelta(minutes=1), timedelta(minutes=4), timedelta(minutes=8)]
-            
-            logger.info("Checking %s cached appeals at %s", len(appeals_cache), now)
-            for appeal_key, appeal_data in list(appeals_cache.items()):
-                appeal_time = datetime.fromisoformat(appeal_data["timestamp"])
-                trader_username = appeal_data["trader_username"]
-                chat_id = appeal_data["chat_id"]
-                appeal_id = appeal_data["appeal_id"]
-
-                appeal_status = api_manager.get_appeal_status(appeal_id)
-                if appeal_status and appeal_status.get("status") != "pending":
-                    logger.info("Appeal %s resolved via API: %s", appeal_id, appeal_status["status"])
-                    del appeals_cache[appeal_key]
-                    context.bot_data["appeals_cache"] = appeals_cache
-                    save_appeals_cache(appeals_cache)
-                    continue
-
-                time_elapsed = now - appeal_time
-                for interval in reminder_intervals:
-                    seconds = interval.total_seconds()
-                    if time_elapsed >= interval and f"reminded_{seconds}" not in appeal_data:
-                        if not trader_username:
-                            logger.warning("No trader username for appeal %s in chat %s, skipping", appeal_id, chat_id)
-                            continue
-                        escaped_username = escape_markdown_v2(f"@{trader_username}")
-                        minutes_str = str(seconds / 60).replace(".", "\\.")
-                        reminder_text = f"{escaped_username}, reminder: Appeal `{appeal_id}` is still unclosed after {minutes_str} minutes\\."
-                        logger.info("Attempting to send reminder: '%s' to %s", reminder_text, chat_id)
-                        
-                        retries = 3
-                        for attempt in range(retries):
-                            try:
-                                await context.bot.send_message(
-                                    chat_id=chat_id,
-                                    text=reminder_text,
-                                    parse_mode="MarkdownV2"
-                                )
-                                logger.info("Sent reminder for %s to @%s in %s", appeal_id, trader_username, chat_id)
-                                appeal_data[f"reminded_{seconds}"] = True
-                                appeals_cache[appeal_key] = appeal_data
-                                context.bot_data["appeals_cache"] = appeals_cache
-                                save_appeals_cache(appeals_cache)
-                                break
-                            except Exception as e:
-                                logger.error("Attempt %s/%s failed: %s", attempt + 1, retries, e)
-                                if attempt < retries - 1:
-                                    await asyncio.sleep(5)
-                                else:
-                                    logger.error("All retries exhausted for reminder %s", appeal_id)
-        except Exception as e:
-            logger.error("Reminder task error: %s", e)
-        await asyncio.sleep(60)
+@track_handler
+async def archived(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    set_chat_context(update.message.chat)
+    if not await admin_only(update):
+        return
+    if not context.args:
+        await reply(update.message, "Usage: /archived <appeal_id>")
+        return
+    appeal_id = context.args[0]
+    records = await retention.lookup(context.bot_data.get("appeals_cache", load_appeals_cache()), appeal_id)
+    if not records:
+        await reply(update.message, f"No archived appeal {appeal_id}.")
+        return
+    lines = [f"{record['appeal_id']}: trader @{record.get('trader_username') or '?'} in chat {record['chat_id']}, "
+             f"opened {record['timestamp']}, archived {record['archived_at']} ({record['expired']})"
+             for record in records]
+    await reply_long(update.message, "\n".join(lines))
 
+@track_handler
 async def debug_update(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    logger.chat_info = set_chat_context(update.message.chat if update.message else update.callback_query.message.chat)
-    logger.info("Received update")
-    logger.debug("Full update: %s", update.to_dict())
\ No newline at end of file
+    set_chat_context(update.effective_chat)
+    logger.info("Received update", extra={"category": "update"})
+    message = update.message or update.edited_message
+    if message and message.date:
+        update_latency.append((datetime.now(timezone.utc) - message.date).total_seconds())
+    logger.debug("Full update: %s", lazy(update.to_dict))
+
+def update_latency_stats():
+    return {"update_latency": percentiles(update_latency)}
@@ -0,0 +1,214 @@
+import asyncio
+import heapq
+import itertools
+import time
+from collections import deque
+from telegram import Update
+from telegram.ext import BaseUpdateProcessor
+from .config import UPDATE_WORKERS, UPDATE_LANE_SIZE, UPDATE_MAX_PENDING
+from .utils import logger, percentiles
+
+# Lower value gets a free worker first
+PRIORITY_CALLBACK = 0   # trader button presses
+PRIORITY_MESSAGE = 1    # merchant messages (and the debug_update pass over them)
+PRIORITY_OTHER = 2
+PRIORITY_NAMES = {PRIORITY_CALLBACK: "callback", PRIORITY_MESSAGE: "message", PRIORITY_OTHER: "other"}
+
+def update_priority(update):
+    if not isinstance(update, Update):
+        return PRIORITY_OTHER
+    if update.callback_query:
+        return PRIORITY_CALLBACK
+    if update.effective_message:
+        return PRIORITY_MESSAGE
+    return PRIORITY_OTHER
+
+def lane_key(update):
+    # Updates without a chat (custom updates, polls, ...) need no ordering
+    chat = update.effective_chat if isinstance(update, Update) else None
+    return chat.id if chat else None
+
+class ChatLane:
+    __slots__ = ("depth", "tail")
+
+    def __init__(self):
+        self.depth = 0      # admitted and not finished yet
+        self.tail = None    # future set when the lane's last update is done
+
+class PriorityGate:
+    # Counting semaphore that hands a freed slot to the waiter with the lowest
+    # (priority, arrival) instead of the longest-waiting one
+    def __init__(self, slots):
+        self.free = slots
+        self._waiters = []
+        self._seq = itertools.count()
+
+    def __len__(self):
+        return len(self._waiters)
+
+    async def acquire(self, priority):
+        if self.free > 0 and not self._waiters:
+            self.free -= 1
+            return
+        future = asyncio.get_running_loop().create_future()
+        entry = (priority, next(self._seq), future)
+        heapq.heappush(self._waiters, entry)
+        try:
+            await future
+        except asyncio.CancelledError:
+            if future.done() and not future.cancelled():
+                # The slot was handed over just before the cancel: pass it on
+                self.release()
+            elif entry in self._waiters:
+                self._waiters.remove(entry)
+                heapq.heapify(self._waiters)
+            raise
+
+    def release(self):
+        while self._waiters:
+            _, _, future = heapq.heappop(self._waiters)
+            if not future.done():
+                future.set_result(None)
+                return
+        self.free += 1
+
+class ChatLaneUpdateProcessor(BaseUpdateProcessor):
+    # Runs updates of different chats in parallel on `workers` slots while updates of
+    # one chat run strictly in arrival order: each update waits for the previous one
+    # of its chat before asking for a slot, so a waiting update never holds a worker.
+    # Callback queries are given free slots before messages. admit() bounds every
+    # lane and the total backlog; AdmissionQueue calls it from the ingress side so a
+    # flooding chat slows down getUpdates / the webhook instead of piling up tasks.
+    # PTB's own semaphore (taken by the final process_update) is sized to the
+    # backlog so it never blocks: the lane wait and PriorityGate in
+    # do_process_update do the limiting.
+    def __init__(self, workers=UPDATE_WORKERS, lane_size=UPDATE_LANE_SIZE, max_pending=UPDATE_MAX_PENDING):
+        super().__init__(max_concurrent_updates=max(workers, max_pending))
+        self.workers = workers
+        self.lane_size = lane_size
+        self.max_pending = max_pending
+        self.pending = 0
+        self.throttled = 0
+        self.processed = 0
+        self._lanes = {}
+        self._admitted = {}     # update_id -> admission times, several if Telegram redelivered it
+        self._gate = PriorityGate(workers)
+        self._room = asyncio.Event()
+        self._waits = {priority: deque(maxlen=1024) for priority in PRIORITY_NAMES}
+
+    async def initialize(self):
+        pass
+
+    async def shutdown(self):
+        if self.pending:
+            logger.warning(f"Update processor shut down with {self.pending} updates pending")
+
+    def _lane(self, key):
+        lane = self._lanes.get(key)
+        if lane is None:
+            lane = self._lanes[key] = ChatLane()
+        return lane
+
+    def _is_full(self, key):
+        if self.pending >= self.max_pending:
+            return True
+        lane = self._lanes.get(key) if key is not None else None
+        return lane is not None and lane.depth >= self.lane_size
+
+    async def admit(self, update):
+        key = lane_key(update)
+        if self._is_full(key):
+            self.throttled += 1
+            if self.throttled % 100 == 1:
+                logger.warning(f"Update lane {key} is full ({self.pending} pending), holding back ingress "
+                               f"(throttled {self.throttled} times)")
+            while self._is_full(key):
+                room = self._room
+                await room.wait()
+        if key is not None:
+            self._lane(key).depth += 1
+        self.pending += 1
+        if isinstance(update, Update):
+            self._admitted.setdefault(update.update_id, deque()).append(time.monotonic())
+
+    def _arrival(self, update):
+        # Undo one admission per processed update, so a redelivered update_id is counted once per delivery
+        arrivals = self._admitted.get(update.update_id) if isinstance(update, Update) else None
+        if not arrivals:
+            return None
+        arrived = arrivals.popleft()
+        if not arrivals:
+            del self._admitted[update.update_id]
+        return arrived
+
+    async def do_process_update(self, update, coroutine):
+        key = lane_key(update)
+        arrived = self._arrival(update)
+        if arrived is None:
+            # Not seen by admit() (put on the queue directly): count it now
+            arrived = time.monotonic()
+            if key is not None:
+                self._lane(key).depth += 1
+            self.pending += 1
+        lane = self._lanes.get(key) if key is not None else None
+        prev = done = None
+        if lane is not None:
+            prev, done = lane.tail, asyncio.get_running_loop().create_future()
+            lane.tail = done
+        priority = update_priority(update)
+        started = False
+        try:
+            if prev is not None and not prev.done():
+                # asyncio.wait, not await: a cancelled successor must not cancel prev
+                await asyncio.wait((prev,))
+            await self._gate.acquire(priority)
+            try:
+                self._waits[priority].append(time.monotonic() - arrived)
+                started = True
+                await coroutine
+            finally:
+                self._gate.release()
+        finally:
+            if not started:
+                coroutine.close()
+            self._finish(key, lane, prev, done)
+
+    def _finish(self, key, lane, prev, done):
+        self.processed += 1
+        self.pending -= 1
+        if lane is not None:
+            # Keep the chain intact if we were cancelled before prev finished
+            if prev is None or prev.done():
+                done.set_result(None)
+            else:
+                prev.add_done_callback(lambda _: done.done() or done.set_result(None))
+            lane.depth -= 1
+            if lane.depth <= 0 and self._lanes.get(key) is lane:
+                del self._lanes[key]
+        room, self._room = self._room, asyncio.Event()
+        room.set()
+
+    def stats(self):
+        depths = [lane.depth for lane in self._lanes.values()]
+        return {
+            "workers": self.workers,
+            "pending": self.pending,
+            "waiting_for_worker": len(self._gate),
+            "lanes": len(depths),
+            "max_lane_depth": max(depths, default=0),
+            "processed": self.processed,
+            "throttled": self.throttled,
+            "wait_seconds": {PRIORITY_NAMES[priority]: percentiles(samples) for priority, samples in self._waits.items()},
+        }
+
+class AdmissionQueue(asyncio.Queue):
+    # application.update_queue for both ingress paths (the polling Updater and the
+    # webhook server): put() waits until the update's lane has room
+    def __init__(self, processor):
+        super().__init__()
+        self.processor = processor
+
+    async def put(self, item):
+        if isinstance(item, Update):
+            await self.processor.admit(item)
+        await super().put(item)
@@ -0,0 +1,95 @@
+import atexit
+import itertools
+import logging
+import logging.handlers
+import queue
+from contextvars import ContextVar
+from .config import LOG_FILE, LOG_LEVEL, LOG_MAX_BYTES, LOG_BACKUP_COUNT, LOG_SAMPLING, LOG_HTTPX_LEVEL
+
+LOG_FORMAT = '%(asctime)s - %(name)s - %(levelname)s - [%(chat)s] %(message)s'
+
+# Chat the current handler works for. Every update runs in its own task and tasks
+# copy the context when created, so concurrent handlers never see each other's chat
+chat_context = ContextVar("chat_context", default=None)
+
+def set_chat_context(chat):
+    # A telegram Chat, or a plain label for work outside any chat ("Reminder Task")
+    if chat is None or isinstance(chat, str):
+        return chat_context.set(chat)
+    return chat_context.set(f"{chat.title or chat.username or chat.first_name} {chat.id}")
+
+class ChatContextFilter(logging.Filter):
+    def filter(self, record):
+        record.chat = chat_context.get() or "-"
+        return True
+
+class SamplingFilter(logging.Filter):
+    # Keeps 1 in n records per category for high-volume messages, e.g.
+    # logger.info("Received update", extra={"category": "update"}) with LOG_SAMPLING="update=0.1".
+    # Records without a category, and WARNING and above, always pass.
+    def __init__(self, rates):
+        super().__init__()
+        self.every = {category: max(1, round(1 / rate)) if rate > 0 else 0 for category, rate in rates.items()}
+        self._counters = {category: itertools.count() for category in rates}
+
+    def filter(self, record):
+        category = getattr(record, "category", None)
+        if category not in self.every or record.levelno >= logging.WARNING:
+            return True
+        every = self.every[category]
+        return every > 0 and next(self._counters[category]) % every == 0
+
+class lazy:
+    # Log argument built only when the record is actually formatted:
+    # logger.debug("Full update: %s", lazy(update.to_dict))
+    __slots__ = ("func", "args")
+
+    def __init__(self, func, *args):
+        self.func = func
+        self.args = args
+
+    def __str__(self):
+        return str(self.func(*self.args))
+
+    __repr__ = __str__
+
+def parse_sampling(spec):
+    rates = {}
+    for item in filter(None, (part.strip() for part in spec.split(","))):
+        category, _, rate = item.partition("=")
+        rates[category.strip()] = float(rate)
+    return rates
+
+_listener = None
+
+def setup_logging():
+    # Handlers on the event loop only enqueue the record; the file (with size-based
+    # rotation) and the console are written from the QueueListener's thread
+    global _listener
+    if _listener is not None:
+        return
+    formatter = logging.Formatter(LOG_FORMAT)
+    file_handler = logging.handlers.RotatingFileHandler(LOG_FILE, maxBytes=LOG_MAX_BYTES, backupCount=LOG_BACKUP_COUNT)
+    stream_handler = logging.StreamHandler()
+    for handler in (file_handler, stream_handler):
+        handler.setFormatter(formatter)
+
+    queue_handler = logging.handlers.QueueHandler(queue.SimpleQueue())
+    queue_handler.addFilter(SamplingFilter(parse_sampling(LOG_SAMPLING)))
+    queue_handler.addFilter(ChatContextFilter())
+    root = logging.getLogger()
+    root.setLevel(LOG_LEVEL)
+    root.addHandler(queue_handler)
+    # httpx logs every Bot API request (getUpdates included) at INFO
+    logging.getLogger("httpx").setLevel(LOG_HTTPX_LEVEL)
+
+    _listener = logging.handlers.QueueListener(queue_handler.queue, file_handler, stream_handler, respect_handler_level=True)
+    _listener.start()
+    atexit.register(stop_logging)
+
+def stop_logging():
+    # Flushes what is still queued
+    global _listener
+    if _listener is not None:
+        _listener.stop()
+        _listener = None
@@ -0,0 +1,48 @@
+from .outbound import outbound
+
+# file type -> (Bot method, keyword for the file id)
+SEND_METHODS = {
+    "photo": ("send_photo", "photo"),
+    "document": ("send_document", "document"),
+    "video": ("send_video", "video"),
+    "animation": ("send_animation", "animation"),
+}
+
+def appeal_media(message):
+    # Media we repost with an appeal; other documents/videos are forwarded as text only
+    if message.photo:
+        return "photo", message.photo[-1].file_id
+    elif message.document and message.document.mime_type in ["image/jpeg", "image/png", "application/pdf"]:
+        return "document", message.document.file_id
+    elif message.video and message.video.mime_type == "video/mp4":
+        return "video", message.video.file_id
+    elif message.animation and message.animation.mime_type == "video/mp4":
+        return "animation", message.animation.file_id
+    return None, None
+
+def message_media(message):
+    # Whatever media the message carries, no mime filtering (notifications)
+    if message.photo:
+        return "photo", message.photo[-1].file_id
+    for file_type in ("document", "video", "animation"):
+        attachment = getattr(message, file_type)
+        if attachment:
+            return file_type, attachment.file_id
+    return None, None
+
+async def send_media(bot, priority, chat_id, text, file_type=None, file_id=None, **kwargs):
+    if file_type and file_id:
+        method_name, file_arg = SEND_METHODS[file_type]
+        return await outbound.send(priority, chat_id, getattr(bot, method_name),
+                                   chat_id=chat_id, caption=text, **{file_arg: file_id}, **kwargs)
+    return await outbound.send(priority, chat_id, bot.send_message, chat_id=chat_id, text=text, **kwargs)
+
+async def edit_media_text(bot, priority, message, text, **kwargs):
+    # Rewrite a message we sent in place: the caption for media, the text otherwise.
+    # reply_markup is dropped unless the caller passes one.
+    kwargs.setdefault("reply_markup", None)
+    if message.text is not None:
+        return await outbound.send(priority, message.chat_id, bot.edit_message_text,
+                                   chat_id=message.chat_id, message_id=message.message_id, text=text, **kwargs)
+    return await outbound.send(priority, message.chat_id, bot.edit_message_caption,
+                               chat_id=message.chat_id, message_id=message.message_id, caption=text, **kwargs)
@@ -0,0 +1,273 @@
+import bisect
+import functools
+import time
+from aiohttp import web
+from .config import METRICS_LISTEN, METRICS_PORT
+from .utils import logger
+
+# Seconds; covers a cache hit up to a Telegram flood wait
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+def _format_labels(labelnames, values, extra=()):
+    pairs = list(zip(labelnames, values)) + list(extra)
+    if not pairs:
+        return ""
+    escaped = (str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"') for _, value in pairs)
+    return "{" + ",".join(f'{name}="{value}"' for (name, _), value in zip(pairs, escaped)) + "}"
+
+class Metric:
+    # labels(...) children are cached, so a hot path pays one dict lookup
+    kind = None
+
+    def __init__(self, name, documentation, labelnames=()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._children = {}
+        if not self.labelnames:
+            self._children[()] = self._child()
+
+    def labels(self, *values):
+        child = self._children.get(values)
+        if child is None:
+            if len(values) != len(self.labelnames):
+                raise ValueError(f"{self.name} expects labels {self.labelnames}, got {values}")
+            child = self._children[values] = self._child()
+        return child
+
+    def __getattr__(self, name):
+        # Unlabelled metrics: counter.inc(), histogram.observe(...)
+        if name.startswith("_") or self.__dict__.get("labelnames", True):
+            raise AttributeError(name)
+        return getattr(self._children[()], name)
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.kind}"]
+        for values, child in list(self._children.items()):
+            lines.extend(child.render(self.name, _format_labels(self.labelnames, values), self.labelnames, values))
+        return lines
+
+class CounterChild:
+    __slots__ = ("value",)
+
+    def __init__(self):
+        self.value = 0
+
+    def inc(self, amount=1):
+        self.value += amount
+
+    def render(self, name, labels, labelnames, values):
+        return [f"{name}{labels} {self.value}"]
+
+class Counter(Metric):
+    kind = "counter"
+    _child = CounterChild
+
+class GaugeChild:
+    __slots__ = ("value", "function")
+
+    def __init__(self):
+        self.value = 0
+        self.function = None
+
+    def set(self, value):
+        self.value = value
+
+    def inc(self, amount=1):
+        self.value += amount
+
+    def dec(self, amount=1):
+        self.value -= amount
+
+    def set_function(self, function):
+        # Read at scrape time, for sizes that already live elsewhere
+        self.function = function
+
+    def get(self):
+        if self.function is None:
+            return self.value
+        try:
+            return self.function()
+        except Exception:
+            return float("nan")
+
+    def render(self, name, labels, labelnames, values):
+        return [f"{name}{labels} {self.get()}"]
+
+class Gauge(Metric):
+    kind = "gauge"
+    _child = GaugeChild
+
+class HistogramChild:
+    __slots__ = ("buckets", "counts", "sum", "count")
+
+    def __init__(self, buckets):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value):
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+
+    def time(self):
+        return Timer(self)
+
+    def quantile(self, q):
+        # Linear interpolation inside the bucket, like PromQL histogram_quantile()
+        if not self.count:
+            return 0.0
+        rank = q * self.count
+        cumulative = 0
+        for index, count in enumerate(self.counts):
+            if cumulative + count >= rank and count:
+                if index == len(self.buckets):
+                    return self.buckets[-1]
+                lower = self.buckets[index - 1] if index else 0.0
+                return lower + (self.buckets[index] - lower) * (rank - cumulative) / count
+            cumulative += count
+        return self.buckets[-1]
+
+    def render(self, name, labels, labelnames, values):
+        lines = []
+        cumulative = 0
+        for bound, count in zip(self.buckets + (float("inf"),), self.counts):
+            cumulative += count
+            le = "+Inf" if bound == float("inf") else repr(bound)
+            lines.append(f"{name}_bucket{_format_labels(labelnames, values, [('le', le)])} {cumulative}")
+        lines.append(f"{name}_sum{labels} {self.sum}")
+        lines.append(f"{name}_count{labels} {self.count}")
+        return lines
+
+class Histogram(Metric):
+    kind = "histogram"
+
+    def __init__(self, name, documentation, labelnames=(), buckets=LATENCY_BUCKETS):
+        self.bucket_bounds = tuple(buckets)
+        super().__init__(name, documentation, labelnames)
+
+    def _child(self):
+        return HistogramChild(self.bucket_bounds)
+
+class Timer:
+    __slots__ = ("child", "started")
+
+    def __init__(self, child):
+        self.child = child
+
+    def __enter__(self):
+        self.started = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.child.observe(time.perf_counter() - self.started)
+        return False
+
+class Registry:
+    def __init__(self, prefix="aisbot_"):
+        self.prefix = prefix
+        self._metrics = {}
+
+    def _register(self, cls, name, *args, **kwargs):
+        name = self.prefix + name
+        metric = self._metrics.get(name)
+        if metric is None:
+            metric = self._metrics[name] = cls(name, *args, **kwargs)
+        return metric
+
+    def counter(self, name, documentation, labelnames=()):
+        return self._register(Counter, name, documentation, labelnames)
+
+    def gauge(self, name, documentation, labelnames=()):
+        return self._register(Gauge, name, documentation, labelnames)
+
+    def histogram(self, name, documentation, labelnames=(), buckets=LATENCY_BUCKETS):
+        return self._register(Histogram, name, documentation, labelnames, buckets=buckets)
+
+    def get(self, name):
+        return self._metrics.get(self.prefix + name)
+
+    def render(self):
+        lines = []
+        for metric in list(self._metrics.values()):
+            lines.extend(metric.render())
+        return "\n".join(lines) + "\n"
+
+registry = Registry()
+
+# Hot-path metrics, shared by the modules that record them
+handler_seconds = registry.histogram("handler_seconds", "Handler execution time", ("handler",))
+handler_errors = registry.counter("handler_errors_total", "Handlers that raised", ("handler",))
+api_request_seconds = registry.histogram("api_request_seconds", "Appeals API HTTP call time", ("endpoint", "outcome"))
+api_retries = registry.counter("api_retries_total", "Appeals API status lookups retried")
+api_auth = registry.counter("api_auth_total", "Appeals API logins and token refreshes", ("kind", "outcome"))
+api_unauthorized = registry.counter("api_unauthorized_total", "Appeals API calls answered 401 and retried with a renewed token")
+telegram_send_seconds = registry.histogram("telegram_send_seconds", "Telegram Bot API call time per method", ("method",))
+telegram_send_errors = registry.counter("telegram_send_errors_total", "Failed Telegram Bot API calls", ("method", "error"))
+persist_flush_seconds = registry.histogram("persist_flush_seconds", "Write-behind flush time")
+reminder_sweep_seconds = registry.histogram("reminder_sweep_seconds", "Reminder sweep time")
+reminders_sent = registry.counter("reminders_sent_total", "Reminder messages sent")
+
+def track_handler(func):
+    # Times a PTB callback (or any coroutine function) under its own name
+    seconds = handler_seconds.labels(func.__name__)
+    errors = handler_errors.labels(func.__name__)
+
+    @functools.wraps(func)
+    async def wrapper(*args, **kwargs):
+        started = time.perf_counter()
+        try:
+            return await func(*args, **kwargs)
+        except Exception:
+            errors.inc()
+            raise
+        finally:
+            seconds.observe(time.perf_counter() - started)
+    return wrapper
+
+def summary():
+    # Plain-text digest for the /stats command: p50/p95 per histogram series, counters, gauges
+    lines = []
+    for metric in list(registry._metrics.values()):
+        short = metric.name[len(registry.prefix):]
+        for values, child in sorted(metric._children.items()):
+            label = f"{short}{{{','.join(map(str, values))}}}" if values else short
+            if isinstance(metric, Histogram):
+                if child.count:
+                    lines.append(f"{label}: n={child.count} p50={child.quantile(0.5) * 1000:.1f}ms "
+                                 f"p95={child.quantile(0.95) * 1000:.1f}ms avg={child.sum / child.count * 1000:.1f}ms")
+            elif isinstance(metric, Gauge):
+                lines.append(f"{label}: {child.get()}")
+            elif child.value:
+                lines.append(f"{label}: {child.value}")
+    return "\n".join(lines)
+
+class MetricsServer:
+    # Local Prometheus scrape endpoint, separate from the webhook listener
+    def __init__(self, listen=METRICS_LISTEN, port=METRICS_PORT):
+        self.listen = listen
+        self.port = port
+        self._runner = None
+
+    async def handle_metrics(self, request):
+        return web.Response(body=registry.render().encode(),
+                            headers={"Content-Type": "text/plain; version=0.0.4; charset=utf-8", "Cache-Control": "no-store"})
+
+    async def start(self):
+        if not self.port:
+            return
+        app = web.Application()
+        app.router.add_get("/metrics", self.handle_metrics)
+        self._runner = web.AppRunner(app, access_log=None)
+        await self._runner.setup()
+        await web.TCPSite(self._runner, self.listen, self.port).start()
+        logger.info(f"Metrics endpoint on http://{self.listen}:{self.port}/metrics")
+
+    async def stop(self):
+        if self._runner is not None:
+            await self._runner.cleanup()
+            self._runner = None
+
+metrics_server = MetricsServer()
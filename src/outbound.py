@@ -0,0 +1,242 @@
+import asyncio
+import itertools
+import time
+from collections import deque
+from telegram.error import RetryAfter, NetworkError, TimedOut, BadRequest, Forbidden
+from .config import (OUTBOUND_WORKERS, OUTBOUND_GLOBAL_RATE, OUTBOUND_CHAT_RATE, OUTBOUND_GROUP_RATE,
+                     OUTBOUND_GROUP_BURST, OUTBOUND_MAX_RETRIES)
+from .utils import logger, percentiles
+from .metrics import telegram_send_seconds, telegram_send_errors
+
+# Lower value goes first
+PRIORITY_RELAY = 0      # trader responses relayed to merchants, trader-group reposts
+PRIORITY_FORWARD = 1    # appeals and notifications forwarded to trader groups
+PRIORITY_REPLY = 2      # status replies in the merchant chat
+PRIORITY_REMINDER = 3
+PRIORITY_NAMES = {PRIORITY_RELAY: "relay", PRIORITY_FORWARD: "forward", PRIORITY_REPLY: "reply", PRIORITY_REMINDER: "reminder"}
+
+class TokenBucket:
+    # Reservation-style bucket: reserve() always takes a token and returns how long the
+    # caller has to wait for it, so callers queue up in reservation order
+    def __init__(self, rate, capacity):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = time.monotonic()
+        self.blocked_until = 0.0
+
+    def reserve(self):
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+        self.tokens -= 1
+        wait = -self.tokens / self.rate if self.tokens < 0 else 0.0
+        return max(wait, self.blocked_until - now)
+
+    def block(self, seconds):
+        # Telegram told us to back off (RetryAfter): nothing goes out before then
+        self.blocked_until = max(self.blocked_until, time.monotonic() + seconds)
+        self.tokens = min(self.tokens, 0)
+
+class OutboundJob:
+    __slots__ = ("priority", "chat_id", "method", "args", "kwargs", "future", "enqueued", "attempts", "reserved")
+
+    def __init__(self, priority, chat_id, method, args, kwargs, future):
+        self.priority = priority
+        self.chat_id = chat_id
+        self.method = method
+        self.args = args
+        self.kwargs = kwargs
+        self.future = future
+        self.enqueued = time.monotonic()
+        self.attempts = 0
+        self.reserved = False
+
+class OutboundDispatcher:
+    # Every outgoing Telegram send goes through here: a priority queue drained by a
+    # few workers, a global token bucket (~30 msg/s) and one bucket per chat. Jobs
+    # whose chat is not ready yet are parked with call_later instead of holding a
+    # worker, so one busy chat never delays the others.
+    def __init__(self, workers=OUTBOUND_WORKERS, global_rate=OUTBOUND_GLOBAL_RATE, chat_rate=OUTBOUND_CHAT_RATE,
+                 group_rate=OUTBOUND_GROUP_RATE, group_burst=OUTBOUND_GROUP_BURST, max_retries=OUTBOUND_MAX_RETRIES):
+        self.workers = workers
+        self.global_bucket = TokenBucket(global_rate, global_rate)
+        self.chat_rate = chat_rate
+        self.group_rate = group_rate
+        self.group_burst = group_burst
+        self.max_retries = max_retries
+        self._chat_buckets = {}
+        self._seq = itertools.count()
+        self._queue = None
+        self._tasks = []
+        self._parked = 0
+        self.sent = 0
+        self.failed = 0
+        self.retries = 0
+        self.retry_after = 0
+        self._waits = {priority: deque(maxlen=1024) for priority in PRIORITY_NAMES}
+
+    @property
+    def running(self):
+        return bool(self._tasks)
+
+    def _bucket(self, chat_id):
+        bucket = self._chat_buckets.get(chat_id)
+        if bucket is None:
+            # Negative ids are groups/channels: Telegram allows ~20 messages a minute there
+            if chat_id < 0:
+                bucket = TokenBucket(self.group_rate, self.group_burst)
+            else:
+                bucket = TokenBucket(self.chat_rate, 1)
+            self._chat_buckets[chat_id] = bucket
+        return bucket
+
+    def start(self):
+        self._queue = asyncio.PriorityQueue()
+        self._tasks = [asyncio.create_task(self._worker(n)) for n in range(self.workers)]
+        logger.info(f"Outbound dispatcher started with {self.workers} workers")
+
+    async def stop(self, timeout=10):
+        if not self._tasks:
+            return
+        # Let queued and parked sends drain before cancelling the workers
+        deadline = time.monotonic() + timeout
+        while self.depth and time.monotonic() < deadline:
+            await asyncio.sleep(0.05)
+        try:
+            await asyncio.wait_for(self._queue.join(), max(0.0, deadline - time.monotonic()))
+        except asyncio.TimeoutError:
+            pass
+        if self.depth:
+            logger.warning(f"Outbound queue not drained on shutdown: {self.depth} sends dropped")
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+        logger.info("Outbound dispatcher stopped")
+
+    # priority, chat_id and method are positional-only: Bot API calls take a chat_id
+    # keyword of their own, which goes through to `method`
+    def submit(self, priority, chat_id, method, /, *args, **kwargs):
+        future = asyncio.get_running_loop().create_future()
+        job = OutboundJob(priority, chat_id, method, args, kwargs, future)
+        self._enqueue(job)
+        return future
+
+    async def send(self, priority, chat_id, method, /, *args, **kwargs):
+        if not self.running:
+            return await method(*args, **kwargs)
+        return await self.submit(priority, chat_id, method, *args, **kwargs)
+
+    def _enqueue(self, job):
+        self._queue.put_nowait((job.priority, next(self._seq), job))
+
+    def _park(self, job, delay):
+        self._parked += 1
+
+        def release():
+            self._parked -= 1
+            self._enqueue(job)
+        asyncio.get_running_loop().call_later(delay, release)
+
+    async def _worker(self, n):
+        while True:
+            _, _, job = await self._queue.get()
+            try:
+                await self._process(job)
+            except Exception as e:
+                logger.error(f"Outbound worker {n} failed on a send to {job.chat_id}: {e}")
+                if not job.future.done():
+                    job.future.set_exception(e)
+            finally:
+                self._queue.task_done()
+
+    async def _process(self, job):
+        if job.future.cancelled():
+            return
+        if not job.reserved:
+            job.reserved = True
+            wait = self._bucket(job.chat_id).reserve()
+            if wait > 0:
+                self._park(job, wait)
+                return
+        wait = self.global_bucket.reserve()
+        if wait > 0:
+            await asyncio.sleep(wait)
+        job.attempts += 1
+        try:
+            result = await self._call(job)
+        except RetryAfter as e:
+            self.retry_after += 1
+            delay = e.retry_after.total_seconds() if hasattr(e.retry_after, "total_seconds") else float(e.retry_after)
+            logger.warning(f"Flood control for chat {job.chat_id}: retrying in {delay}s")
+            self._bucket(job.chat_id).block(delay)
+            self._retry(job, delay, e)
+            return
+        except (BadRequest, Forbidden):
+            self.failed += 1
+            raise
+        except (TimedOut, NetworkError) as e:
+            self._retry(job, min(2 ** job.attempts, 30), e)
+            return
+        self.sent += 1
+        self._waits[job.priority].append(time.monotonic() - job.enqueued)
+        if not job.future.done():
+            job.future.set_result(result)
+
+    async def _call(self, job):
+        method_name = getattr(job.method, "__name__", "call")
+        started = time.perf_counter()
+        try:
+            return await job.method(*job.args, **job.kwargs)
+        except Exception as e:
+            telegram_send_errors.labels(method_name, type(e).__name__).inc()
+            raise
+        finally:
+            telegram_send_seconds.labels(method_name).observe(time.perf_counter() - started)
+
+    def _retry(self, job, delay, error):
+        if job.attempts >= self.max_retries:
+            self.failed += 1
+            logger.error(f"Giving up on send to {job.chat_id} after {job.attempts} attempts: {error}")
+            if not job.future.done():
+                job.future.set_exception(error)
+            return
+        self.retries += 1
+        job.reserved = False
+        self._park(job, delay)
+
+    @property
+    def depth(self):
+        return (self._queue.qsize() if self._queue is not None else 0) + self._parked
+
+    def stats(self):
+        waits = {PRIORITY_NAMES[priority]: percentiles(samples) for priority, samples in self._waits.items()}
+        return {
+            "depth": self.depth,
+            "parked": self._parked,
+            "sent": self.sent,
+            "failed": self.failed,
+            "retries": self.retries,
+            "retry_after": self.retry_after,
+            "wait_seconds": waits,
+        }
+
+outbound = OutboundDispatcher()
+
+async def reply(message, text, priority=PRIORITY_REPLY, **kwargs):
+    return await outbound.send(priority, message.chat_id, message.reply_text, text, **kwargs)
+
+def _log_failed_reply(chat_id, future):
+    if not future.cancelled() and future.exception() is not None:
+        logger.error(f"Reply to {chat_id} failed: {future.exception()}")
+
+def reply_later(message, text, priority=PRIORITY_REPLY, **kwargs):
+    # Queue a reply without waiting for it: the caller's chat lane moves on while the
+    # dispatcher paces the send; failures are only logged
+    if outbound.running:
+        future = outbound.submit(priority, message.chat_id, message.reply_text, text, **kwargs)
+    else:
+        future = asyncio.ensure_future(message.reply_text(text, **kwargs))
+    future.add_done_callback(lambda done: _log_failed_reply(message.chat_id, done))
+    return future
@@ -0,0 +1,61 @@
+import re
+
+# Second words that belong to a two-word trader nickname ("de niro", "clint eastwood", ...)
+MULTI_WORD_NICKNAMES = ("niro", "eastwood", "gosling")
+
+APPEAL_ID_PATTERN = re.compile(r"[0-9a-f]{8}-[0-9a-f]{4}-[0-9a-f]{4}-[0-9a-f]{4}-[0-9a-f]{12}")
+CYRILLIC_PATTERN = re.compile("[\u0410-\u044f]")  # А..я, same range as the old ord() check
+
+KIND_NOTIFICATION = "notification"  # Russian text with appeal ids anywhere: notify the groups it went to
+KIND_APPEALS = "appeals"            # lines starting with "<appeal id> <nickname>": forward each
+KIND_FALLBACK = "fallback"          # neither: positional appeal id + trader name words
+
+class ParsedMessage:
+    __slots__ = ("kind", "appeal_ids", "appeals", "words")
+
+    def __init__(self, kind, appeal_ids=(), appeals=(), words=()):
+        self.kind = kind
+        self.appeal_ids = appeal_ids    # every appeal id in the text, in order
+        self.appeals = appeals          # (appeal_id, nickname) per appeal line
+        self.words = words              # lowercased words, fallback only
+
+    def __repr__(self):
+        return f"ParsedMessage({self.kind!r}, appeal_ids={self.appeal_ids!r}, appeals={self.appeals!r}, words={self.words!r})"
+
+def parse_message(text):
+    # One regex scan for the appeal ids; each hit is then checked in place for being
+    # the first thing on its line, so the text is never split into lines or lowered
+    # as a whole unless the fallback needs its words. The Cyrillic check stops at
+    # the first hit.
+    matches = list(APPEAL_ID_PATTERN.finditer(text))
+    appeal_ids = tuple(match.group() for match in matches)
+    if appeal_ids and CYRILLIC_PATTERN.search(text):
+        return ParsedMessage(KIND_NOTIFICATION, appeal_ids)
+
+    appeals = []
+    for match in matches:
+        start, end = match.span()
+        line_start = text.rfind("\n", 0, start) + 1
+        if line_start < start and not text[line_start:start].isspace():
+            continue
+        line_end = text.find("\n", end)
+        rest = text[end:line_end if line_end != -1 else len(text)]
+        # "<appeal id><whitespace><something>" on a stripped line
+        if not rest[:1].isspace():
+            continue
+        parts = rest.split(None, 2)
+        if not parts:
+            continue
+        nickname = parts[0].lower()
+        if len(parts) > 1 and parts[1].lower() in MULTI_WORD_NICKNAMES:
+            nickname += " " + parts[1].lower()
+        appeals.append((match.group(), nickname))
+    if appeals:
+        return ParsedMessage(KIND_APPEALS, appeal_ids, tuple(appeals))
+    return ParsedMessage(KIND_FALLBACK, appeal_ids, words=tuple(text.lower().split()))
+
+def positional_appeal_id(text, start_pos, length):
+    # Merchant groups without appeal lines configure where the id sits in the message
+    if start_pos + length <= len(text):
+        return text[start_pos:start_pos + length]
+    return None
@@ -0,0 +1,105 @@
+import asyncio
+import inspect
+import json
+import time
+from .config import PERSIST_INTERVAL
+from .utils import logger, atomic_write
+from .metrics import persist_flush_seconds
+
+class WriteBehindPersister:
+    # Handlers only mark state dirty; a background task coalesces the marks into
+    # at most one flush per interval. JSON targets are serialized on the loop (so
+    # the snapshot is consistent) and written + renamed in a worker thread.
+    # A callback may return an awaitable (e.g. asyncio.to_thread(...)) to keep
+    # its I/O off the loop; the flush awaits it.
+    def __init__(self, interval=PERSIST_INTERVAL):
+        self.interval = interval
+        self._json_targets = {}
+        self._callbacks = {}
+        self._dirty = set()
+        self._event = None
+        self._task = None
+        self._flush_lock = None
+        self.flushes = 0
+        self.last_flush_duration = 0.0
+
+    def register_json(self, name, path, get_data):
+        self._json_targets[name] = (path, get_data)
+
+    def register_callback(self, name, callback):
+        self._callbacks[name] = callback
+
+    def mark_dirty(self, name):
+        if name not in self._json_targets and name not in self._callbacks:
+            raise KeyError(f"Unknown persistence target: {name}")
+        self._dirty.add(name)
+        if self._event is not None:
+            self._event.set()
+
+    @property
+    def pending(self):
+        return len(self._dirty)
+
+    def start(self):
+        self._event = asyncio.Event()
+        self._flush_lock = asyncio.Lock()
+        if self._dirty:
+            self._event.set()
+        self._task = asyncio.create_task(self._run())
+        logger.info(f"Write-behind persister started (interval {self.interval}s)")
+
+    async def _run(self):
+        while True:
+            await self._event.wait()
+            # Let the burst that woke us pile up before writing
+            await asyncio.sleep(self.interval)
+            self._event.clear()
+            try:
+                await self.flush()
+            except Exception as e:
+                logger.error(f"Write-behind flush failed: {e}")
+
+    async def flush(self):
+        async with self._flush_lock:
+            dirty, self._dirty = self._dirty, set()
+            if not dirty:
+                return
+            started = time.perf_counter()
+            failed = set()
+            for name in dirty:
+                try:
+                    if name in self._callbacks:
+                        result = self._callbacks[name]()
+                        if inspect.isawaitable(result):
+                            await result
+                    else:
+                        path, get_data = self._json_targets[name]
+                        text = json.dumps(get_data(), indent=4)
+                        await asyncio.to_thread(atomic_write, path, text)
+                except Exception as e:
+                    logger.error(f"Failed to persist {name}: {e}")
+                    failed.add(name)
+            # Retry failed targets on the next cycle
+            if failed:
+                self._dirty |= failed
+                self._event.set()
+            self.flushes += 1
+            self.last_flush_duration = time.perf_counter() - started
+            persist_flush_seconds.observe(self.last_flush_duration)
+            logger.info("Flushed %s in %.1f ms", ", ".join(sorted(dirty - failed)) or "nothing", self.last_flush_duration * 1000,
+                        extra={"category": "persist"})
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        if self._flush_lock is None:
+            self._flush_lock = asyncio.Lock()
+        await self.flush()
+        logger.info("Write-behind persister stopped, state flushed")
+
+persister = WriteBehindPersister()
@@ -0,0 +1,214 @@
+import asyncio
+import cProfile
+import io
+import os
+import pstats
+import signal
+import sys
+import threading
+import time
+from collections import Counter
+from datetime import datetime
+from .config import (LOG_DIR, PROFILE_SAMPLE_INTERVAL, PROFILE_SIGNAL_SECONDS, PROFILE_MAX_SECONDS,
+                     LOOP_LAG_INTERVAL, LOOP_LAG_WARN)
+from .metrics import registry
+from .utils import logger, percentiles
+
+MODES = ("sample", "cprofile")
+HEARTBEAT_INTERVAL = 0.01
+BLOCKED_AFTER = 0.05    # no heartbeat for this long: a synchronous call holds the loop
+TASK_SNAPSHOT_INTERVAL = 0.1
+
+loop_lag_seconds = registry.histogram("loop_lag_seconds", "How late the event loop woke up a sleeping timer",
+                                      buckets=(0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0))
+
+def frame_label(code):
+    # Semicolons separate frames in the collapsed format
+    return f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})".replace(";", ",")
+
+def collapse(frame):
+    labels = []
+    while frame is not None:
+        labels.append(frame_label(frame.f_code))
+        frame = frame.f_back
+    return ";".join(reversed(labels))
+
+class LoopLagMonitor:
+    # Always-on: a timer that should fire every `interval` seconds; how late it
+    # fires is the time the loop spent on something that never yielded
+    def __init__(self, interval=LOOP_LAG_INTERVAL, warn=LOOP_LAG_WARN):
+        self.interval = interval
+        self.warn = warn
+        self.stalls = 0
+        self._task = None
+
+    def start(self):
+        if self.interval > 0:
+            self._task = asyncio.create_task(self._run())
+
+    async def _run(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            expected = loop.time() + self.interval
+            await asyncio.sleep(self.interval)
+            lag = max(0.0, loop.time() - expected)
+            loop_lag_seconds.observe(lag)
+            if lag >= self.warn:
+                self.stalls += 1
+                logger.warning(f"Event loop blocked for {lag * 1000:.0f} ms")
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+class SamplingSession:
+    # A thread samples the loop thread's stack every `interval` seconds; samples
+    # taken while the loop's heartbeat is stale are marked as blocking. The loop
+    # side also snapshots where every task is suspended, per coroutine.
+    def __init__(self, seconds, interval=PROFILE_SAMPLE_INTERVAL):
+        self.seconds = seconds
+        self.interval = interval
+        self.stacks = Counter()
+        self.task_stacks = Counter()
+        self.lags = []
+        self.samples = 0
+        self.blocked = 0
+        self._heartbeat = time.monotonic()
+        self._stop = threading.Event()
+
+    def _sample(self, thread_id):
+        while not self._stop.is_set():
+            frame = sys._current_frames().get(thread_id)
+            if frame is not None:
+                stack = collapse(frame)
+                if time.monotonic() - self._heartbeat > BLOCKED_AFTER:
+                    self.blocked += 1
+                    stack = "[loop blocked];" + stack
+                self.stacks[stack] += 1
+                self.samples += 1
+            self._stop.wait(self.interval)
+
+    def _snapshot_tasks(self):
+        current = asyncio.current_task()
+        for task in asyncio.all_tasks():
+            if task is current or task.done():
+                continue
+            frames = task.get_stack(limit=32)
+            if frames:
+                self.task_stacks[f"{task.get_coro().__qualname__};" + ";".join(frame_label(f.f_code) for f in frames)] += 1
+
+    async def run(self):
+        loop = asyncio.get_running_loop()
+        sampler = threading.Thread(target=self._sample, args=(threading.get_ident(),), name="profile-sampler", daemon=True)
+        sampler.start()
+        deadline = loop.time() + self.seconds
+        next_snapshot = 0.0
+        try:
+            while loop.time() < deadline:
+                expected = loop.time() + HEARTBEAT_INTERVAL
+                await asyncio.sleep(HEARTBEAT_INTERVAL)
+                now = loop.time()
+                self.lags.append(max(0.0, now - expected))
+                self._heartbeat = time.monotonic()
+                if now >= next_snapshot:
+                    self._snapshot_tasks()
+                    next_snapshot = now + TASK_SNAPSHOT_INTERVAL
+        finally:
+            self._stop.set()
+            await asyncio.to_thread(sampler.join)
+
+    def write(self, path):
+        # Brendan Gregg's collapsed format: "frame;frame;frame count", one stack per line
+        with open(path, "w") as f:
+            for stack, count in self.stacks.most_common():
+                f.write(f"loop;{stack} {count}\n")
+            for stack, count in self.task_stacks.most_common():
+                f.write(f"await;{stack} {count}\n")
+        return [path]
+
+    def summary(self):
+        leaves = Counter()
+        handlers = Counter()
+        for stack, count in self.stacks.items():
+            frames = stack.split(";")
+            leaves[frames[-1]] += count
+            for frame in frames:
+                if "(handlers.py:" in frame:
+                    handlers[frame] += count
+                    break
+        lag = percentiles(self.lags)
+        lines = [f"{self.samples} samples over {self.seconds:g}s, loop blocked in {self.blocked} "
+                 f"({self.blocked / self.samples:.0%})" if self.samples else "No samples",
+                 f"Loop lag p50={lag['p50'] * 1000:.1f}ms p95={lag['p95'] * 1000:.1f}ms max={lag['max'] * 1000:.1f}ms"]
+        if handlers:
+            lines.append("Handlers on CPU:")
+            lines.extend(f"  {count:>6}  {frame}" for frame, count in handlers.most_common(10))
+        lines.append("Hottest frames:")
+        lines.extend(f"  {count:>6}  {frame}" for frame, count in leaves.most_common(10))
+        return "\n".join(lines)
+
+class CProfileSession:
+    # Deterministic profile of everything the loop thread runs for `seconds`
+    def __init__(self, seconds):
+        self.seconds = seconds
+        self.profile = cProfile.Profile()
+
+    async def run(self):
+        self.profile.enable()
+        try:
+            await asyncio.sleep(self.seconds)
+        finally:
+            self.profile.disable()
+
+    def write(self, path):
+        self.profile.dump_stats(path)
+        return [path]
+
+    def summary(self):
+        out = io.StringIO()
+        pstats.Stats(self.profile, stream=out).sort_stats("cumulative").print_stats(15)
+        return out.getvalue().strip()
+
+class Profiler:
+    # One session at a time, started from /profile or SIGUSR2; results go to logs/
+    def __init__(self, log_dir=LOG_DIR):
+        self.log_dir = log_dir
+        self.active = None
+
+    async def run(self, seconds, mode="sample"):
+        if self.active is not None:
+            raise RuntimeError("A profiling session is already running")
+        if mode not in MODES:
+            raise ValueError(f"Unknown profiling mode {mode!r}, expected one of {', '.join(MODES)}")
+        seconds = min(max(seconds, 1.0), PROFILE_MAX_SECONDS)
+        session = SamplingSession(seconds) if mode == "sample" else CProfileSession(seconds)
+        self.active = session
+        logger.info(f"Profiling ({mode}) for {seconds:g}s")
+        try:
+            await session.run()
+            name = f"profile-{datetime.now():%Y%m%d-%H%M%S}.{'collapsed' if mode == 'sample' else 'pstats'}"
+            paths = await asyncio.to_thread(session.write, os.path.join(self.log_dir, name))
+            summary = session.summary()
+        finally:
+            self.active = None
+        logger.info(f"Profile written to {', '.join(paths)}")
+        return paths, summary
+
+    def install_signal(self, application, seconds=PROFILE_SIGNAL_SECONDS):
+        # kill -USR2 <pid>: sample for `seconds`, summary goes to the log
+        async def from_signal():
+            try:
+                _, summary = await self.run(seconds)
+                logger.info(f"Profile summary:\n{summary}")
+            except RuntimeError as e:
+                logger.warning(f"Profiling signal ignored: {e}")
+
+        asyncio.get_running_loop().add_signal_handler(signal.SIGUSR2, lambda: application.create_task(from_signal()))
+
+loop_lag_monitor = LoopLagMonitor()
+profiler = Profiler()
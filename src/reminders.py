@@ -0,0 +1,154 @@
+import heapq
+import itertools
+from datetime import datetime, timedelta
+from .config import REMINDER_WINDOW
+from .utils import logger, escape_markdown_v2
+
+REMINDER_INTERVALS = (timedelta(minutes=1), timedelta(minutes=4), timedelta(minutes=8))
+MAX_MESSAGE_LENGTH = 4096
+
+def reminder_flag(interval):
+    # Same flag names the polling sweep stored ("reminded_60.0", ...)
+    return f"reminded_{interval.total_seconds()}"
+
+def reminder_text(trader_username, appeal_id, interval):
+    escaped_username = escape_markdown_v2(f"@{trader_username}")
+    minutes_str = str(interval.total_seconds() / 60).replace(".", "\\.")
+    return f"{escaped_username}, reminder: Appeal `{appeal_id}` is still unclosed after {minutes_str} minutes\\."
+
+def reminder_digest(trader_username, entries):
+    # entries: (appeal_key, appeal_id, interval, age) for one trader chat.
+    # Returns [(text, [appeal_key, ...])], one chunk per Telegram message.
+    if len(entries) == 1:
+        appeal_key, appeal_id, interval, _ = entries[0]
+        return [(reminder_text(trader_username, appeal_id, interval), [appeal_key])]
+    escaped_username = escape_markdown_v2(f"@{trader_username}")
+    chunks = []
+    header = f"{escaped_username}, reminder: {len(entries)} appeals are still unclosed:"
+    text, keys = header, []
+    for appeal_key, appeal_id, _, age in sorted(entries, key=lambda entry: entry[3], reverse=True):
+        line = f"\n• `{appeal_id}` \\- open {int(age.total_seconds() // 60)} min"
+        if keys and len(text) + len(line) > MAX_MESSAGE_LENGTH:
+            chunks.append((text, keys))
+            text, keys = f"{escaped_username}, reminder \\(continued\\):", []
+        text += line
+        keys.append(appeal_key)
+    chunks.append((text, keys))
+    return chunks
+
+class ReminderScheduler:
+    # Deadline-ordered heap of (due time, appeal key, interval). Only one JobQueue
+    # job is armed at a time, for the earliest deadline; when it fires the callback
+    # takes everything due within the window and re-arms. Cancelled appeals are
+    # dropped lazily when they reach the top of the heap. With several replicas only
+    # the lease holder is active; the others keep no heap and arm nothing.
+    def __init__(self, intervals=REMINDER_INTERVALS, window=REMINDER_WINDOW):
+        self.intervals = intervals
+        self.window = timedelta(seconds=window)
+        self._heap = []
+        self._pending = {}
+        self._seq = itertools.count()
+        self._job_queue = None
+        self._callback = None
+        self._job = None
+        self._armed_for = None
+        self.active = True
+
+    def __len__(self):
+        return sum(len(flags) for flags in self._pending.values())
+
+    def attach(self, job_queue, callback):
+        self._job_queue = job_queue
+        self._callback = callback
+
+    def schedule(self, appeal_key, appeal_data, arm=True):
+        if not self.active:
+            return
+        appeal_time = datetime.fromisoformat(appeal_data["timestamp"])
+        for interval in self.intervals:
+            flag = reminder_flag(interval)
+            if flag in appeal_data:
+                continue
+            self._pending.setdefault(appeal_key, set()).add(flag)
+            heapq.heappush(self._heap, (appeal_time + interval, next(self._seq), appeal_key, interval))
+        if arm:
+            self.arm()
+
+    def defer(self, appeal_key, interval, delay):
+        # Put a reminder that could not be delivered back on the heap
+        if not self.active:
+            return
+        self._pending.setdefault(appeal_key, set()).add(reminder_flag(interval))
+        heapq.heappush(self._heap, (datetime.now() + timedelta(seconds=delay), next(self._seq), appeal_key, interval))
+        self.arm()
+
+    def cancel(self, appeal_key):
+        if self._pending.pop(appeal_key, None) is not None:
+            logger.info(f"Cancelled reminders for {appeal_key}")
+        # Rebuild once the heap is mostly dead entries
+        if len(self._heap) > 64 and len(self._heap) > 2 * len(self):
+            self._heap = [entry for entry in self._heap if reminder_flag(entry[3]) in self._pending.get(entry[2], ())]
+            heapq.heapify(self._heap)
+
+    def restore(self, appeals_cache):
+        for appeal_key, appeal_data in appeals_cache.items():
+            self.schedule(appeal_key, appeal_data, arm=False)
+        logger.info(f"Restored {len(self)} pending reminders for {len(self._pending)} appeals")
+        self.arm()
+
+    def activate(self, appeals_cache):
+        # Took over reminders: rebuild from the shared store, whose flags record
+        # what the previous owner already sent
+        self._heap = []
+        self._pending = {}
+        self.active = True
+        self.restore(appeals_cache)
+
+    def deactivate(self):
+        self.active = False
+        self._heap = []
+        self._pending = {}
+        self.arm()
+
+    def _is_live(self, entry):
+        return reminder_flag(entry[3]) in self._pending.get(entry[2], ())
+
+    def pop_due(self, now=None):
+        now = now or datetime.now()
+        due = []
+        while self._heap and self._heap[0][0] <= now + self.window:
+            deadline, _, appeal_key, interval = heapq.heappop(self._heap)
+            flags = self._pending.get(appeal_key)
+            flag = reminder_flag(interval)
+            if not flags or flag not in flags:
+                continue
+            flags.discard(flag)
+            if not flags:
+                del self._pending[appeal_key]
+            due.append((appeal_key, interval))
+        return due
+
+    def fired(self):
+        self._job = None
+        self._armed_for = None
+
+    def arm(self):
+        while self._heap and not self._is_live(self._heap[0]):
+            heapq.heappop(self._heap)
+        if self._job_queue is None:
+            return
+        if not self._heap:
+            if self._job is not None:
+                self._job.schedule_removal()
+                self.fired()
+            return
+        deadline = self._heap[0][0]
+        if self._job is not None and self._armed_for <= deadline:
+            return
+        if self._job is not None:
+            self._job.schedule_removal()
+        delay = max(0.0, (deadline - datetime.now()).total_seconds())
+        self._job = self._job_queue.run_once(self._callback, delay, name="remind_traders")
+        self._armed_for = deadline
+
+reminder_scheduler = ReminderScheduler()
@@ -0,0 +1,92 @@
+import asyncio
+import gzip
+import json
+import os
+from datetime import datetime, timedelta
+from .config import APPEAL_MAX_AGE, APPEAL_FINAL_REMINDER_GRACE, ARCHIVE_DIR
+from .metrics import registry
+from .persistence import persister
+from .reminders import REMINDER_INTERVALS, reminder_flag, reminder_scheduler
+from .utils import logger
+
+appeals_archived = registry.counter("appeals_archived_total", "Appeals expired from the appeals cache into the archive", ("reason",))
+
+class AppealArchive:
+    # Append-only gzip JSONL, one file per archiving day: ARCHIVE_DIR/YYYY/MM/appeals-YYYY-MM-DD.jsonl.gz.
+    # Each sweep appends one gzip member, which gzip readers concatenate. The
+    # archived table (appeal_id -> file) keeps lookups from scanning every file.
+    def __init__(self, root=ARCHIVE_DIR):
+        self.root = root
+
+    def path_for(self, day):
+        return os.path.join(self.root, f"{day:%Y}", f"{day:%m}", f"appeals-{day:%Y-%m-%d}.jsonl.gz")
+
+    def write(self, records, day):
+        path = self.path_for(day)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with gzip.open(path, "at", encoding="utf-8") as f:
+            f.writelines(json.dumps(record, ensure_ascii=False) + "\n" for record in records)
+        return path
+
+    def read(self, paths, appeal_id):
+        found = []
+        for path in paths:
+            try:
+                with gzip.open(path, "rt", encoding="utf-8") as f:
+                    for line in f:
+                        record = json.loads(line)
+                        if record.get("appeal_id") == appeal_id:
+                            found.append(record)
+            except (OSError, EOFError, ValueError) as e:
+                logger.error(f"Could not read archive {path}: {e}")
+        return found
+
+def expiry_reason(appeal_data, now, max_age=APPEAL_MAX_AGE, grace=APPEAL_FINAL_REMINDER_GRACE):
+    # None while the appeal should stay in the working set
+    age = now - datetime.fromisoformat(appeal_data["timestamp"])
+    if max_age and age > timedelta(seconds=max_age):
+        return "max_age"
+    final = REMINDER_INTERVALS[-1]
+    if grace and reminder_flag(final) in appeal_data and age > final + timedelta(seconds=grace):
+        return "final_reminder"
+    return None
+
+class RetentionPolicy:
+    def __init__(self, archive=None):
+        self.archive = archive or AppealArchive()
+
+    async def sweep(self, appeals_cache, now=None):
+        now = now or datetime.now()
+        expired = []
+        for appeal_key, appeal_data in appeals_cache.items():
+            reason = expiry_reason(appeal_data, now)
+            if reason is not None:
+                expired.append((appeal_key, reason))
+        if not expired:
+            return 0
+        archived_at = now.isoformat(timespec="seconds")
+        records = [{**appeals_cache[appeal_key], "key": appeal_key, "expired": reason, "archived_at": archived_at}
+                   for appeal_key, reason in expired]
+        # File first: a crash before the rows go only archives them twice
+        path = await asyncio.to_thread(self.archive.write, records, now)
+        for record in records:
+            appeal_key = record["key"]
+            if appeal_key in appeals_cache:
+                del appeals_cache[appeal_key]
+            reminder_scheduler.cancel(appeal_key)
+            appeals_archived.labels(record["expired"]).inc()
+        appeals_cache.conn.executemany(
+            "INSERT INTO archived (appeal_id, key, path, archived_at) VALUES (?, ?, ?, ?)",
+            [(record["appeal_id"], record["key"], path, archived_at) for record in records])
+        persister.mark_dirty("appeals")
+        logger.info(f"Archived {len(records)} expired appeals to {path}, {len(appeals_cache)} still open")
+        return len(records)
+
+    async def lookup(self, appeals_cache, appeal_id):
+        paths = [row[0] for row in appeals_cache.conn.execute(
+            "SELECT DISTINCT path FROM archived WHERE appeal_id = ? ORDER BY archived_at", (appeal_id,))]
+        if not paths:
+            return []
+        return await asyncio.to_thread(self.archive.read, paths, appeal_id)
+
+retention = RetentionPolicy()
@@ -0,0 +1,92 @@
+from .utils import logger, load_groups
+
+GRAM_SIZE = 3
+MAX_MEMO = 4096
+
+def trader_name_words(title):
+    return title.lower().split(' | trader')[0].split()
+
+class TraderRouter:
+    # Routing index over the registered groups, built once and extended on registration.
+    # - merchants/traders: chat id -> group, O(1)
+    # - tokens: trader name word -> earliest trader group, for the positional fallback
+    # - grams: 1..3-character substrings of each trader title -> positions, so
+    #   "nickname in title" only verifies the few titles that share all its grams
+    # Both matchers return the earliest registered group, like the old linear scans.
+    def __init__(self, groups):
+        self.rebuild(groups)
+
+    def rebuild(self, groups):
+        self.merchants = {}
+        self.traders = {}
+        self._trader_list = []
+        self._titles = []
+        self._tokens = {}
+        self._grams = {}
+        self._memo = {}
+        for group in groups["merchant"]:
+            self.add_merchant(group)
+        for group in groups["trader"]:
+            self.add_trader(group)
+        logger.info(f"Built routing index: {len(self.merchants)} merchants, {len(self.traders)} traders, {len(self._grams)} grams")
+
+    def add_merchant(self, group):
+        self.merchants[group["id"]] = group
+
+    def add_trader(self, group):
+        position = len(self._trader_list)
+        title = group["title"].lower()
+        self._trader_list.append(group)
+        self._titles.append(title)
+        self.traders[group["id"]] = group
+        for word in trader_name_words(group["title"]):
+            self._tokens.setdefault(word, position)
+        for size in range(1, GRAM_SIZE + 1):
+            for start in range(len(title) - size + 1):
+                self._grams.setdefault(title[start:start + size], set()).add(position)
+        # A new group can turn an earlier miss into a match
+        self._memo.clear()
+
+    def merchant(self, chat_id):
+        return self.merchants.get(chat_id)
+
+    def trader(self, chat_id):
+        return self.traders.get(chat_id)
+
+    def match_nickname(self, nickname):
+        if nickname in self._memo:
+            position = self._memo[nickname]
+        else:
+            position = self._find_substring(nickname)
+            if len(self._memo) >= MAX_MEMO:
+                self._memo.clear()
+            self._memo[nickname] = position
+        return self._trader_list[position] if position is not None else None
+
+    def _find_substring(self, nickname):
+        if not nickname:
+            return 0 if self._trader_list else None
+        size = min(len(nickname), GRAM_SIZE)
+        candidates = None
+        for start in range(len(nickname) - size + 1):
+            positions = self._grams.get(nickname[start:start + size])
+            if not positions:
+                return None
+            candidates = set(positions) if candidates is None else candidates & positions
+            if not candidates:
+                return None
+        for position in sorted(candidates):
+            if nickname in self._titles[position]:
+                return position
+        return None
+
+    def match_words(self, words):
+        positions = [self._tokens[word] for word in words if word in self._tokens]
+        return self._trader_list[min(positions)] if positions else None
+
+def router_for(bot_data):
+    router = bot_data.get("router")
+    if router is None:
+        router = TraderRouter(bot_data.get("groups") or load_groups())
+        bot_data["router"] = router
+    return router
@@ -0,0 +1,539 @@
+import json
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from collections.abc import MutableMapping
+from .config import APPEALS_FILE, APPEALS_DB, PENDING_APPEALS_MAX, PENDING_APPEALS_TTL, MULTI_REPLICA, SHARED_DB_BUSY_TIMEOUT
+from .utils import logger
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS appeals (
+    key TEXT PRIMARY KEY,
+    appeal_id TEXT NOT NULL,
+    chat_id INTEGER NOT NULL,
+    trader_username TEXT NOT NULL DEFAULT '',
+    timestamp TEXT NOT NULL,
+    extra TEXT NOT NULL DEFAULT '{}'
+);
+CREATE INDEX IF NOT EXISTS idx_appeals_appeal_id ON appeals(appeal_id);
+CREATE INDEX IF NOT EXISTS idx_appeals_chat_id ON appeals(chat_id);
+CREATE INDEX IF NOT EXISTS idx_appeals_timestamp ON appeals(timestamp);
+CREATE TABLE IF NOT EXISTS pending_appeals (
+    merchant_chat_id INTEGER NOT NULL,
+    message_id INTEGER NOT NULL,
+    appeal_index INTEGER NOT NULL DEFAULT 0,
+    appeal_id TEXT NOT NULL,
+    file_type TEXT,
+    file_id TEXT,
+    created REAL NOT NULL,
+    PRIMARY KEY (merchant_chat_id, message_id, appeal_index)
+);
+CREATE INDEX IF NOT EXISTS idx_pending_appeals_created ON pending_appeals(created);
+CREATE TABLE IF NOT EXISTS meta (
+    name TEXT PRIMARY KEY,
+    value TEXT NOT NULL
+);
+CREATE TABLE IF NOT EXISTS archived (
+    appeal_id TEXT NOT NULL,
+    key TEXT NOT NULL,
+    path TEXT NOT NULL,
+    archived_at TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_archived_appeal_id ON archived(appeal_id);
+CREATE TABLE IF NOT EXISTS kv (
+    name TEXT PRIMARY KEY,
+    value TEXT NOT NULL,
+    version INTEGER NOT NULL
+);
+"""
+
+# Shared mode only: every write to appeals, from any replica, leaves its key here so
+# the others reload just the rows that changed
+CHANGES_SCHEMA = """
+CREATE TABLE IF NOT EXISTS appeal_changes (
+    seq INTEGER PRIMARY KEY AUTOINCREMENT,
+    key TEXT NOT NULL,
+    at REAL NOT NULL
+);
+CREATE TRIGGER IF NOT EXISTS appeals_inserted AFTER INSERT ON appeals BEGIN
+    INSERT INTO appeal_changes (key, at) VALUES (NEW.key, julianday('now'));
+END;
+CREATE TRIGGER IF NOT EXISTS appeals_updated AFTER UPDATE ON appeals BEGIN
+    INSERT INTO appeal_changes (key, at) VALUES (NEW.key, julianday('now'));
+END;
+CREATE TRIGGER IF NOT EXISTS appeals_deleted AFTER DELETE ON appeals BEGIN
+    INSERT INTO appeal_changes (key, at) VALUES (OLD.key, julianday('now'));
+END;
+"""
+DROP_CHANGES_SCHEMA = """
+DROP TRIGGER IF EXISTS appeals_inserted;
+DROP TRIGGER IF EXISTS appeals_updated;
+DROP TRIGGER IF EXISTS appeals_deleted;
+"""
+
+CORE_FIELDS = ("appeal_id", "chat_id", "trader_username", "timestamp")
+
+def connect(path=APPEALS_DB, shared=MULTI_REPLICA):
+    # Shared with other replicas: autocommit, so no write transaction stays open
+    # between write-behind flushes and blocks the other processes, and a short busy
+    # timeout: a write waiting on another replica's lock stalls the loop. Not bound
+    # to one thread: the write-behind flush commits from a worker thread.
+    if shared:
+        conn = sqlite3.connect(path, timeout=SHARED_DB_BUSY_TIMEOUT, isolation_level=None, check_same_thread=False)
+    else:
+        conn = sqlite3.connect(path, check_same_thread=False)
+    conn.execute("PRAGMA journal_mode=WAL")
+    conn.execute("PRAGMA synchronous=NORMAL")
+    conn.executescript(SCHEMA)
+    conn.executescript(CHANGES_SCHEMA if shared else DROP_CHANGES_SCHEMA)
+    migrate_pending_index(conn)
+    return conn
+
+def migrate_pending_index(conn):
+    # pending_appeals used to hold one appeal per merchant message; the appeal's
+    # position in the message is now part of the key (old rows become index 0)
+    if "appeal_index" in {row[1] for row in conn.execute("PRAGMA table_info(pending_appeals)")}:
+        return
+    conn.execute("BEGIN IMMEDIATE")
+    try:
+        # Another replica may have migrated while we waited for the lock
+        if "appeal_index" not in {row[1] for row in conn.execute("PRAGMA table_info(pending_appeals)")}:
+            conn.execute("ALTER TABLE pending_appeals RENAME TO pending_appeals_old")
+            conn.execute("DROP INDEX IF EXISTS idx_pending_appeals_created")
+            for statement in SCHEMA.split(";"):
+                if "pending_appeals" in statement:
+                    conn.execute(statement)
+            conn.execute("INSERT INTO pending_appeals (merchant_chat_id, message_id, appeal_index, appeal_id, file_type, file_id, created) "
+                         "SELECT merchant_chat_id, message_id, 0, appeal_id, file_type, file_id, created FROM pending_appeals_old")
+            conn.execute("DROP TABLE pending_appeals_old")
+            logger.info("Added appeal_index to pending_appeals")
+        conn.execute("COMMIT")
+    except BaseException:
+        conn.execute("ROLLBACK")
+        raise
+
+class AppealsStore(MutableMapping):
+    # Dict-like view of the appeals table: reads come from an in-memory mirror,
+    # every assignment/deletion touches only its own row. save_appeals_cache commits.
+    # A reverse index appeal_id -> cache keys is kept in step with every write.
+    # Shared with other replicas, the mirror can be stale: known keys are only
+    # ever updated, never re-inserted, so a row another replica deleted stays gone.
+    # refresh() reads appeal_changes to reload only the rows written elsewhere. A
+    # write that outwaits the busy timeout is kept in _unsaved and retried by
+    # flush_unsaved() on the next write-behind flush.
+    def __init__(self, conn, shared=MULTI_REPLICA):
+        self.conn = conn
+        self.shared = shared
+        self._unsaved = {}      # key -> (value or None for a delete, whether the row already existed)
+        self._load()
+
+    def _load(self):
+        self._data_version = self.conn.execute("PRAGMA data_version").fetchone()[0]
+        self._rows = {}
+        self._by_appeal = {}
+        if self.shared:
+            # One snapshot for the rows and the change log position
+            self.conn.execute("BEGIN")
+        try:
+            self._change_seq = self._last_change() if self.shared else 0
+            for key, appeal_id, chat_id, trader_username, timestamp, extra in self.conn.execute(
+                    "SELECT key, appeal_id, chat_id, trader_username, timestamp, extra FROM appeals"):
+                self._rows[key] = self._decode(appeal_id, chat_id, trader_username, timestamp, extra)
+                self._index(key, appeal_id)
+        finally:
+            if self.shared:
+                self.conn.execute("COMMIT")
+
+    def _last_change(self):
+        return self.conn.execute("SELECT COALESCE(MAX(seq), 0) FROM appeal_changes").fetchone()[0]
+
+    def refresh(self):
+        # data_version only moves when another connection commits: catch up then and
+        # return (added keys, removed keys), otherwise None
+        data_version = self.conn.execute("PRAGMA data_version").fetchone()[0]
+        if data_version == self._data_version:
+            return None
+        before = set(self._rows)
+        if self.shared:
+            self._data_version = data_version
+            self._reload_changed()
+        else:
+            self._load()
+        self._reapply_unsaved()
+        return self._rows.keys() - before, before - self._rows.keys()
+
+    def _reload_changed(self):
+        first = self.conn.execute("SELECT MIN(seq) FROM appeal_changes").fetchone()[0]
+        if first is not None and first > self._change_seq + 1:
+            # Pruned past our position: only a full reload is safe
+            logger.warning("Appeals change log pruned past this replica, reloading all appeals")
+            self._load()
+            return
+        self.conn.execute("BEGIN")
+        try:
+            changes = self.conn.execute("SELECT seq, key FROM appeal_changes WHERE seq > ? ORDER BY seq",
+                                        (self._change_seq,)).fetchall()
+            for key in {key for _, key in changes}:
+                row = self.conn.execute("SELECT appeal_id, chat_id, trader_username, timestamp, extra FROM appeals WHERE key = ?",
+                                        (key,)).fetchone()
+                self._forget(key)
+                if row is not None:
+                    self._rows[key] = self._decode(*row)
+                    self._index(key, row[0])
+            if changes:
+                self._change_seq = changes[-1][0]
+            self.conn.execute("COMMIT")
+        except BaseException:
+            self.conn.execute("ROLLBACK")
+            raise
+
+    def _reapply_unsaved(self):
+        # Writes still waiting for a retry win over what was just read
+        for key, (value, existed) in list(self._unsaved.items()):
+            if value is None:
+                self._forget(key)
+            elif existed and key not in self._rows:
+                # Another replica deleted it meanwhile: let it stay gone
+                del self._unsaved[key]
+            else:
+                self._set(key, value)
+
+    def prune_changes(self, max_age):
+        # Log entries every replica has had max_age seconds to read
+        return self.conn.execute("DELETE FROM appeal_changes WHERE at < julianday('now') - ?",
+                                 (max_age / 86400,)).rowcount
+
+    def _index(self, key, appeal_id):
+        self._by_appeal.setdefault(appeal_id, set()).add(key)
+
+    def _unindex(self, key, appeal_id):
+        keys = self._by_appeal.get(appeal_id)
+        if keys is not None:
+            keys.discard(key)
+            if not keys:
+                del self._by_appeal[appeal_id]
+
+    @staticmethod
+    def _decode(appeal_id, chat_id, trader_username, timestamp, extra):
+        value = {"timestamp": timestamp, "trader_username": trader_username, "chat_id": chat_id, "appeal_id": appeal_id}
+        value.update(json.loads(extra))
+        return value
+
+    @staticmethod
+    def _encode(key, value):
+        extra = {k: v for k, v in value.items() if k not in CORE_FIELDS}
+        return (key, value["appeal_id"], value["chat_id"], value.get("trader_username") or "",
+                value["timestamp"], json.dumps(extra))
+
+    def __getitem__(self, key):
+        return self._rows[key]
+
+    def __setitem__(self, key, value):
+        # A row we only hold in _unsaved was never inserted: it needs the upsert, not the update
+        existed = key in self._rows and self._unsaved.get(key, (None, True))[1]
+        try:
+            if not self._write(key, value, existed):
+                self._unsaved.pop(key, None)
+                return
+            self._unsaved.pop(key, None)
+        except sqlite3.OperationalError as e:
+            if not self.shared:
+                raise
+            logger.warning(f"Appeal {key} not written ({e}), retrying on the next flush")
+            self._unsaved[key] = (value, existed)
+        self._set(key, value)
+
+    def _write(self, key, value, existed):
+        # False when the row is gone: another replica closed the appeal
+        if self.shared and existed:
+            row = self._encode(key, value)
+            updated = self.conn.execute(
+                "UPDATE appeals SET appeal_id = ?, chat_id = ?, trader_username = ?, timestamp = ?, extra = ? WHERE key = ?",
+                row[1:] + row[:1]).rowcount
+            if not updated:
+                logger.info(f"Appeal {key} was closed by another replica, not restoring it")
+                self._forget(key)
+                return False
+        else:
+            self._upsert(key, value)
+        return True
+
+    def _set(self, key, value):
+        previous = self._rows.get(key)
+        if previous is not None and previous["appeal_id"] != value["appeal_id"]:
+            self._unindex(key, previous["appeal_id"])
+        self._rows[key] = value
+        self._index(key, value["appeal_id"])
+
+    def _upsert(self, key, value):
+        self.conn.execute(
+            "INSERT INTO appeals (key, appeal_id, chat_id, trader_username, timestamp, extra) VALUES (?, ?, ?, ?, ?, ?) "
+            "ON CONFLICT(key) DO UPDATE SET appeal_id=excluded.appeal_id, chat_id=excluded.chat_id, "
+            "trader_username=excluded.trader_username, timestamp=excluded.timestamp, extra=excluded.extra",
+            self._encode(key, value))
+
+    def _forget(self, key):
+        value = self._rows.pop(key, None)
+        if value is not None:
+            self._unindex(key, value["appeal_id"])
+
+    def __delitem__(self, key):
+        if key not in self._rows:
+            raise KeyError(key)
+        self.discard(key)
+
+    def discard(self, key):
+        # Delete by key whether or not the mirror has caught up with the row yet
+        # (another replica may have written it since the last sync)
+        known = key in self._rows
+        self._forget(key)
+        try:
+            removed = self.conn.execute("DELETE FROM appeals WHERE key = ?", (key,)).rowcount > 0
+        except sqlite3.OperationalError as e:
+            if not self.shared:
+                raise
+            logger.warning(f"Appeal {key} not deleted ({e}), retrying on the next flush")
+            self._unsaved[key] = (None, True)
+            return known
+        self._unsaved.pop(key, None)
+        return removed
+
+    def flush_unsaved(self):
+        # Retry writes that outwaited the busy timeout; raises if the database is still locked
+        for key, (value, existed) in list(self._unsaved.items()):
+            if value is None:
+                self.conn.execute("DELETE FROM appeals WHERE key = ?", (key,))
+            else:
+                self._write(key, value, existed)
+            del self._unsaved[key]
+        return len(self._unsaved)
+
+    def __iter__(self):
+        return iter(self._rows)
+
+    def __len__(self):
+        return len(self._rows)
+
+    def __contains__(self, key):
+        return key in self._rows
+
+    def __repr__(self):
+        return f"AppealsStore({len(self._rows)} appeals)"
+
+    def keys_for_appeal(self, appeal_id):
+        return set(self._by_appeal.get(appeal_id, ()))
+
+    def trader_chats_for(self, appeal_id):
+        return {self._rows[key]["chat_id"] for key in self._by_appeal.get(appeal_id, ())}
+
+    def commit(self):
+        self.conn.commit()
+
+    @property
+    def unsaved(self):
+        return len(self._unsaved)
+
+    def close(self):
+        self.conn.commit()
+        self.conn.close()
+
+class PendingAppeal:
+    __slots__ = ("appeal_id", "file_type", "file_id", "created")
+
+    def __init__(self, appeal_id, file_type=None, file_id=None, created=None):
+        self.appeal_id = appeal_id
+        self.file_type = file_type
+        self.file_id = file_id
+        self.created = created if created is not None else time.time()
+
+class PendingAppealStore:
+    # What a callback needs to close an appeal, keyed by the merchant message the
+    # buttons point at and the appeal's position in it. Hot records live in a bounded LRU; every record is also a
+    # row next to the appeals table so callbacks still resolve after a restart.
+    def __init__(self, conn, max_size=PENDING_APPEALS_MAX, ttl=PENDING_APPEALS_TTL):
+        self.conn = conn
+        self.max_size = max_size
+        self.ttl = ttl
+        self._records = OrderedDict()
+        self._writes = 0
+
+    def __len__(self):
+        return len(self._records)
+
+    def put(self, merchant_chat_id, message_id, appeal_id, file_type=None, file_id=None, index=0):
+        record = PendingAppeal(appeal_id, file_type, file_id)
+        self.conn.execute(
+            "INSERT OR REPLACE INTO pending_appeals (merchant_chat_id, message_id, appeal_index, appeal_id, file_type, file_id, created) "
+            "VALUES (?, ?, ?, ?, ?, ?, ?)",
+            (merchant_chat_id, message_id, index, appeal_id, file_type, file_id, record.created))
+        self._remember((merchant_chat_id, message_id, index), record)
+        self._writes += 1
+        if self._writes % 500 == 0:
+            self.purge_expired()
+        return record
+
+    def get(self, merchant_chat_id, message_id, index=0):
+        key = (merchant_chat_id, message_id, index)
+        record = self._records.get(key)
+        if record is None:
+            row = self.conn.execute(
+                "SELECT appeal_id, file_type, file_id, created FROM pending_appeals "
+                "WHERE merchant_chat_id = ? AND message_id = ? AND appeal_index = ?",
+                key).fetchone()
+            if row is None:
+                return None
+            record = PendingAppeal(*row)
+        if time.time() - record.created > self.ttl:
+            self.discard(merchant_chat_id, message_id, index)
+            return None
+        self._remember(key, record)
+        return record
+
+    def discard(self, merchant_chat_id, message_id, index=0):
+        self._records.pop((merchant_chat_id, message_id, index), None)
+        self.conn.execute("DELETE FROM pending_appeals WHERE merchant_chat_id = ? AND message_id = ? AND appeal_index = ?",
+                          (merchant_chat_id, message_id, index))
+
+    def _remember(self, key, record):
+        self._records[key] = record
+        self._records.move_to_end(key)
+        while len(self._records) > self.max_size:
+            self._records.popitem(last=False)
+
+    def purge_expired(self):
+        cutoff = time.time() - self.ttl
+        removed = self.conn.execute("DELETE FROM pending_appeals WHERE created < ?", (cutoff,)).rowcount
+        for key in [key for key, record in self._records.items() if record.created < cutoff]:
+            del self._records[key]
+        if removed:
+            logger.info(f"Purged {removed} expired pending appeals")
+        return removed
+
+def merge_groups(theirs, ours):
+    # Registrations only ever add or update: union by chat id, our copy wins for
+    # a chat both sides know
+    merged = {"trader_accounts": {**theirs.get("trader_accounts", {}), **ours.get("trader_accounts", {})}}
+    for kind in ("merchant", "trader"):
+        groups = {group["id"]: group for group in theirs.get(kind, [])}
+        groups.update((group["id"], group) for group in ours.get(kind, []))
+        merged[kind] = list(groups.values())
+    return merged
+
+class SharedGroups:
+    # Group registrations as one JSON document in the kv table, for replicas that
+    # share APPEALS_DB. version guards the read-modify-write: a save that lost a
+    # race merges with the stored copy instead of overwriting it. Runs on its own
+    # connection from worker threads, so the lock keeps save and refresh apart.
+    def __init__(self, conn):
+        self.conn = conn
+        self.version = None
+        self._lock = threading.Lock()
+
+    def _read(self):
+        return self.conn.execute("SELECT value, version FROM kv WHERE name = 'groups'").fetchone()
+
+    def load(self, seed):
+        row = self._read()
+        if row is None:
+            self.save(seed)
+            logger.info("Seeded shared groups from %s merchants, %s traders", len(seed["merchant"]), len(seed["trader"]))
+            return seed
+        self.version = row[1]
+        return json.loads(row[0])
+
+    def refresh(self):
+        # The stored document if another replica changed it since we last saw it
+        with self._lock:
+            row = self._read()
+            if row is None or row[1] == self.version:
+                return None
+            self.version = row[1]
+            return json.loads(row[0])
+
+    def save(self, groups):
+        with self._lock:
+            self._save(groups)
+
+    def _save(self, groups):
+        self.conn.execute("BEGIN IMMEDIATE")
+        try:
+            row = self._read()
+            version = row[1] + 1 if row else 1
+            if row and row[1] != self.version:
+                # Leave self.version stale so refresh() picks up the merged document
+                groups = merge_groups(json.loads(row[0]), groups)
+                logger.info("Merged group registrations from another replica")
+            else:
+                self.version = version
+            self.conn.execute("INSERT OR REPLACE INTO kv (name, value, version) VALUES ('groups', ?, ?)",
+                              (json.dumps(groups), version))
+            self.conn.execute("COMMIT")
+        except BaseException:
+            self.conn.execute("ROLLBACK")
+            raise
+
+def migrate_json(conn, path=APPEALS_FILE):
+    if conn.execute("SELECT 1 FROM meta WHERE name = 'json_migrated'").fetchone():
+        return 0
+    try:
+        with open(path, "r") as f:
+            data = json.load(f)
+    except (FileNotFoundError, json.JSONDecodeError):
+        data = {}
+    # Replicas starting together race for this: the check is repeated under the write lock
+    conn.execute("BEGIN IMMEDIATE")
+    try:
+        if conn.execute("SELECT 1 FROM meta WHERE name = 'json_migrated'").fetchone():
+            conn.execute("COMMIT")
+            return 0
+        for key, value in data.items():
+            conn.execute(
+                "INSERT OR REPLACE INTO appeals (key, appeal_id, chat_id, trader_username, timestamp, extra) VALUES (?, ?, ?, ?, ?, ?)",
+                AppealsStore._encode(key, value))
+        conn.execute("INSERT INTO meta (name, value) VALUES ('json_migrated', ?)", (str(len(data)),))
+        conn.execute("COMMIT")
+    except BaseException:
+        conn.execute("ROLLBACK")
+        raise
+    if data:
+        os.replace(path, f"{path}.migrated")
+        logger.info(f"Migrated {len(data)} appeals from {path} to {APPEALS_DB}")
+    return len(data)
+
+_store = None
+_pending = None
+
+def load_appeals_cache():
+    global _store
+    if _store is None:
+        conn = connect()
+        migrate_json(conn)
+        _store = AppealsStore(conn)
+        logger.info(f"Loaded appeals cache: {len(_store)} appeals")
+    return _store
+
+def load_pending_appeals():
+    # Shares the appeals connection, so save_appeals_cache commits both
+    global _pending
+    if _pending is None:
+        # Replicas: no LRU, another process may have closed the appeal since
+        _pending = PendingAppealStore(load_appeals_cache().conn, max_size=0 if MULTI_REPLICA else PENDING_APPEALS_MAX)
+        _pending.purge_expired()
+    return _pending
+
+def save_appeals_cache(appeals):
+    try:
+        appeals.commit()
+        logger.info("Saved appeals cache: %s appeals", len(appeals), extra={"category": "persist"})
+    except Exception as e:
+        logger.error(f"Failed to save appeals cache: {e}")
+        raise
+
+def close_appeals_cache():
+    global _store, _pending
+    _pending = None
+    if _store is not None:
+        _store.close()
+        _store = None
@@ -1,15 +1,11 @@
 import json
 import logging
-from .config import GROUP_FILE, APPEALS_FILE, LOG_FILE
+import os
+import tempfile
+from .config import GROUP_FILE
+from .logs import setup_logging, set_chat_context, lazy
 
-logging.basicConfig(
-    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s',
-    level=logging.INFO,
-    handlers=[
-        logging.FileHandler(LOG_FILE),
-        logging.StreamHandler()
-    ]
-)
+setup_logging()
 logger = logging.getLogger(__name__)
 
 def escape_markdown_v2(text):
@@ -18,41 +14,46 @@ def escape_markdown_v2(text):
         text = text.replace(char, f"\\{char}")
     return text
 
+def percentiles(samples):
+    ordered = sorted(samples)
+    return {
+        "count": len(ordered),
+        "p50": ordered[len(ordered) // 2] if ordered else 0.0,
+        "p95": ordered[int(len(ordered) * 0.95)] if ordered else 0.0,
+        "max": ordered[-1] if ordered else 0.0,
+    }
+
 def load_groups():
     try:
         with open(GROUP_FILE, "r") as f:
             data = json.load(f)
-            logger.info(f"Loaded groups from {GROUP_FILE}: {data}")
+            logger.info("Loaded groups from %s: %s merchants, %s traders", GROUP_FILE, len(data["merchant"]), len(data["trader"]))
+            logger.debug("Groups: %s", data)
             return data
     except (FileNotFoundError, json.JSONDecodeError):
         default_data = {"merchant": [], "trader": [], "trader_accounts": {}}
         logger.info(f"No groups file found, initializing with: {default_data}")
         return default_data
 
-def save_groups(groups):
+def atomic_write(path, text):
+    # Write to a temp file next to the target, then rename over it so a crash never leaves a truncated file
+    fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path), prefix=f".{os.path.basename(path)}.", suffix=".tmp")
     try:
-        with open(GROUP_FILE, "w") as f:
-            json.dump(groups, f, indent=4)
-        logger.info(f"Groups saved to {GROUP_FILE}: {groups}")
-    except Exception as e:
-        logger.error(f"Failed to save groups: {e}")
+        with os.fdopen(fd, "w") as f:
+            f.write(text)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, path)
+    except BaseException:
+        if os.path.exists(tmp_path):
+            os.unlink(tmp_path)
         raise
 
-def load_appeals_cache():
-    try:
-        with open(APPEALS_FILE, "r") as f:
-            data = json.load(f)
-            logger.info(f"Loaded appeals cache: {len(data)} appeals")
-            return data
-    except (FileNotFoundError, json.JSONDecodeError):
-        logger.info("No appeals cache found, initializing empty")
-        return {}
-
-def save_appeals_cache(appeals):
+def save_groups(groups):
     try:
-        with open(APPEALS_FILE, "w") as f:
-            json.dump(appeals, f, indent=4)
-        logger.info(f"Saved appeals cache: {len(appeals)} appeals")
+        atomic_write(GROUP_FILE, json.dumps(groups, indent=4))
+        logger.info("Groups saved to %s: %s merchants, %s traders", GROUP_FILE, len(groups["merchant"]), len(groups["trader"]))
+        logger.debug("Groups: %s", groups)
     except Exception as e:
-        logger.error(f"Failed to save appeals cache: {e}")
-        raise
\ No newline at end of file
+        logger.error(f"Failed to save groups: {e}")
+        raise
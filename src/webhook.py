@@ -0,0 +1,109 @@
+import asyncio
+import hmac
+import secrets
+import signal
+from aiohttp import web
+from telegram import Update
+from .config import (WEBHOOK_URL, WEBHOOK_LISTEN, WEBHOOK_PORT, WEBHOOK_PATH, WEBHOOK_SECRET,
+                     WEBHOOK_MAX_CONNECTIONS, HEALTH_PATH)
+from .outbound import outbound
+from .utils import logger
+
+SECRET_HEADER = "X-Telegram-Bot-Api-Secret-Token"
+
+class WebhookServer:
+    # Small aiohttp app in front of the Application: Telegram (or a local fake server)
+    # POSTs each update to WEBHOOK_PATH, the secret token header is checked and the
+    # update goes straight onto application.update_queue, same as the polling fetcher.
+    def __init__(self, application, listen=WEBHOOK_LISTEN, port=WEBHOOK_PORT, path=WEBHOOK_PATH, secret=WEBHOOK_SECRET,
+                 health_path=HEALTH_PATH, health_info=None):
+        self.application = application
+        self.listen = listen
+        self.port = port
+        self.path = path
+        self.health_path = health_path
+        self.health_info = health_info
+        # Telegram allows 1-256 characters of A-Z, a-z, 0-9, _ and -
+        self.secret = secret or secrets.token_urlsafe(32)
+        self.received = 0
+        self.rejected = 0
+        self._runner = None
+
+    def make_app(self):
+        app = web.Application()
+        app.router.add_post(self.path, self.handle_update)
+        app.router.add_get(self.health_path, self.handle_health)
+        return app
+
+    async def handle_update(self, request):
+        if not hmac.compare_digest(request.headers.get(SECRET_HEADER, ""), self.secret):
+            self.rejected += 1
+            logger.warning(f"Rejected webhook request from {request.remote}: bad secret token")
+            return web.Response(status=403)
+        try:
+            update = Update.de_json(await request.json(), self.application.bot)
+        except Exception as e:
+            logger.error(f"Rejected malformed webhook update: {e}")
+            return web.Response(status=400)
+        # Answer Telegram right away, the handlers run off the queue
+        await self.application.update_queue.put(update)
+        self.received += 1
+        return web.Response()
+
+    async def handle_health(self, request):
+        health = {
+            "status": "ok" if self.application.running else "stopping",
+            "mode": "webhook",
+            "updates_received": self.received,
+            "updates_rejected": self.rejected,
+            "update_queue": self.application.update_queue.qsize(),
+            "outbound_queue": outbound.depth,
+        }
+        if self.health_info:
+            health.update(self.health_info())
+        return web.json_response(health, status=200 if self.application.running else 503)
+
+    async def start(self):
+        self._runner = web.AppRunner(self.make_app(), access_log=None)
+        await self._runner.setup()
+        await web.TCPSite(self._runner, self.listen, self.port).start()
+        logger.info(f"Webhook server listening on {self.listen}:{self.port}{self.path}")
+
+    async def stop(self):
+        if self._runner is not None:
+            await self._runner.cleanup()
+            self._runner = None
+            logger.info("Webhook server stopped")
+
+async def run_webhook(application, server, url=WEBHOOK_URL):
+    # run_polling() drives the whole Application lifecycle; with our own ingress
+    # we do the same steps by hand, including the post_init/post_shutdown hooks
+    stop = asyncio.Event()
+    loop = asyncio.get_running_loop()
+    for sig in (signal.SIGINT, signal.SIGTERM):
+        loop.add_signal_handler(sig, stop.set)
+
+    await application.initialize()
+    try:
+        if application.post_init:
+            await application.post_init(application)
+        await application.start()
+        await server.start()
+        await application.bot.set_webhook(
+            url=url,
+            secret_token=server.secret,
+            allowed_updates=Update.ALL_TYPES,
+            max_connections=WEBHOOK_MAX_CONNECTIONS
+        )
+        logger.info(f"Webhook set to {url}")
+        await stop.wait()
+        logger.info("Shutting down bot...")
+    finally:
+        # Stop taking updates first, then let the Application drain what is queued
+        await server.stop()
+        if application.running:
+            await application.stop()
+        if application.post_shutdown:
+            await application.post_shutdown(application)
+        await application.shutdown()
+        logger.info("Bot stopped.")
@@ -0,0 +1,10 @@
+import os
+import tempfile
+
+# src.config reads these at import time
+os.environ.setdefault("DATA_DIR", tempfile.mkdtemp())
+os.environ.setdefault("LOG_DIR", tempfile.mkdtemp())
+os.environ.setdefault("METRICS_PORT", "0")
+os.environ.setdefault("BOT_TOKEN", "123456:test")
+os.environ.setdefault("API_KEY", "test")
+os.environ.setdefault("API_URL", "http://appeals.test")
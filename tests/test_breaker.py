@@ -0,0 +1,69 @@
+import asyncio
+import os
+import tempfile
+import time
+from datetime import datetime, timedelta
+
+os.environ.setdefault("DATA_DIR", tempfile.mkdtemp())
+os.environ.setdefault("LOG_DIR", tempfile.mkdtemp())
+os.environ.setdefault("METRICS_PORT", "0")
+os.environ.setdefault("BOT_TOKEN", "123456:test")
+os.environ.setdefault("API_KEY", "test")
+os.environ.setdefault("API_URL", "http://appeals.test")
+
+import httpx
+
+from src.api import APIManager
+from src.breaker import CLOSED, HALF_OPEN, OPEN, CircuitBreaker
+
+def open_breaker(breaker):
+    for _ in range(breaker.failure_threshold):
+        breaker.record_failure()
+    assert breaker.state == OPEN
+    breaker.retry_at = time.monotonic()
+
+def test_half_open_success_closes():
+    breaker = CircuitBreaker("test", failure_threshold=2, half_open_calls=1)
+    open_breaker(breaker)
+    assert breaker.allow()
+    assert breaker.state == HALF_OPEN
+    assert not breaker.allow()
+    breaker.record_success()
+    assert breaker.state == CLOSED
+    assert breaker.allow()
+
+def test_half_open_failure_reopens():
+    breaker = CircuitBreaker("test", failure_threshold=2, half_open_calls=1)
+    open_breaker(breaker)
+    assert breaker.allow()
+    breaker.record_failure()
+    assert breaker.state == OPEN
+    assert not breaker.allow()
+
+def test_cancelled_probe_frees_its_slot():
+    breaker = CircuitBreaker("test", failure_threshold=2, half_open_calls=1)
+    open_breaker(breaker)
+    assert breaker.allow()
+    breaker.release()
+    assert breaker.allow()
+
+def test_half_open_probe_answered_4xx_closes_breaker():
+    # A 404 proves the API is up: the probe must close the breaker, not leave
+    # it half-open with its only probe slot taken
+    def handler(request):
+        return httpx.Response(404, json={"detail": "not found"})
+
+    async def run():
+        manager = APIManager(retries=1, retry_delay=0)
+        manager.breaker = CircuitBreaker("test", failure_threshold=2, half_open_calls=1)
+        manager._client = httpx.AsyncClient(base_url="http://appeals.test", transport=httpx.MockTransport(handler))
+        manager.access_token = "token"
+        manager.access_expiry = manager.refresh_expiry = datetime.now() + timedelta(hours=1)
+        open_breaker(manager.breaker)
+        assert await manager._fetch_appeal_status("missing") is None
+        assert manager.breaker.state == CLOSED
+        assert not manager.degraded
+        assert manager.breaker.allow()
+        await manager._client.aclose()
+
+    asyncio.run(run())
@@ -0,0 +1,72 @@
+import asyncio
+from types import SimpleNamespace
+
+import pytest
+from telegram.error import BadRequest
+
+from src import handlers
+from src.api import api_manager
+from src.persistence import persister
+from src.storage import AppealsStore, PendingAppealStore, connect
+
+TRADER_CHAT = -200
+MERCHANT_CHAT = -100
+
+class FakeBot:
+    def __init__(self, failing=()):
+        self.calls = []
+        self.failing = set(failing)
+
+    def __getattr__(self, name):
+        async def method(**kwargs):
+            self.calls.append(name)
+            if name in self.failing:
+                raise BadRequest(f"{name} failed")
+            return kwargs
+        return method
+
+@pytest.fixture
+def appeals(monkeypatch):
+    async def status(appeal_id):
+        return None
+    monkeypatch.setattr(api_manager, "get_appeal_status", status)
+    persister.register_callback("appeals", lambda: None)
+    conn = connect(":memory:", shared=False)
+    pending = PendingAppealStore(conn)
+    pending.put(MERCHANT_CHAT, 5, "A1")
+    monkeypatch.setattr(handlers, "load_pending_appeals", lambda: pending)
+    store = AppealsStore(conn, shared=False)
+    store["key"] = {"appeal_id": "A1", "chat_id": TRADER_CHAT, "timestamp": "2026-01-01T00:00:00"}
+    return store
+
+def close(bot, appeals, edited):
+    query = SimpleNamespace(message=SimpleNamespace(chat_id=TRADER_CHAT, message_id=7, text=None))
+    context = SimpleNamespace(bot=bot, bot_data={"appeals_cache": appeals})
+    callback_key = (TRADER_CHAT, 7)
+    handlers.handled_callbacks[callback_key] = True
+    asyncio.run(handlers.close_appeal(context, query, callback_key, MERCHANT_CHAT, "5", 0, "A1", "key",
+                                      "approved", "closed", edited, None, None))
+    return callback_key
+
+def test_edited_close_relays_once_and_drops_appeal(appeals):
+    bot = FakeBot()
+    close(bot, appeals, edited=True)
+    assert bot.calls == ["send_message"]
+    assert "key" not in appeals
+    assert handlers.load_pending_appeals().get(MERCHANT_CHAT, 5) is None
+
+def test_repost_goes_out_before_the_original_is_deleted(appeals):
+    bot = FakeBot()
+    close(bot, appeals, edited=False)
+    assert bot.calls == ["send_message", "send_message", "delete_message"]
+    assert "key" not in appeals
+
+def test_failed_repost_keeps_the_original_and_reopens(appeals):
+    # Every send fails: the relay, the repost and the "Failed to repost" notice
+    bot = FakeBot(failing={"send_message"})
+    callback_key = close(bot, appeals, edited=False)
+    assert "delete_message" not in bot.calls
+    assert "edit_message_caption" in bot.calls
+    assert callback_key not in handlers.handled_callbacks
+    assert "key" in appeals
+    assert handlers.load_pending_appeals().get(MERCHANT_CHAT, 5).appeal_id == "A1"
@@ -0,0 +1,59 @@
+import asyncio
+import sqlite3
+from types import SimpleNamespace
+
+from src import handlers
+from src.persistence import persister
+from src.routing import TraderRouter
+from src.storage import AppealsStore, PendingAppealStore, connect
+
+MERCHANT_CHAT = -100
+FIRST = "11111111-1111-1111-1111-111111111111"
+SECOND = "22222222-2222-2222-2222-222222222222"
+
+class FakeBot:
+    def __init__(self):
+        self.sent = []
+
+    async def send_message(self, chat_id, text, **kwargs):
+        self.sent.append((chat_id, text))
+        return {"chat_id": chat_id}
+
+class FlakyAppeals(AppealsStore):
+    # The cache write for one appeal fails after its forward went out
+    def __setitem__(self, key, value):
+        if value["appeal_id"] == SECOND:
+            raise sqlite3.OperationalError("disk I/O error")
+        super().__setitem__(key, value)
+
+def merchant_message(text, replies):
+    async def reply_text(reply, **kwargs):
+        replies.append(reply)
+    chat = SimpleNamespace(id=MERCHANT_CHAT, title="Merchant", username=None, first_name=None)
+    return SimpleNamespace(chat=chat, chat_id=MERCHANT_CHAT, message_id=5, text=text, caption=None, photo=None,
+                           document=None, video=None, animation=None, reply_text=reply_text)
+
+def test_one_failing_appeal_keeps_the_summary(monkeypatch):
+    conn = connect(":memory:", shared=False)
+    pending = PendingAppealStore(conn)
+    monkeypatch.setattr(handlers, "load_pending_appeals", lambda: pending)
+    persister.register_callback("appeals", lambda: None)
+    groups = {"merchant": [{"id": MERCHANT_CHAT, "title": "Merchant"}],
+              "trader": [{"id": -1, "title": "alice | trader"}, {"id": -2, "title": "bob | trader"}],
+              "trader_accounts": {}}
+    bot = FakeBot()
+    appeals = FlakyAppeals(conn, shared=False)
+    context = SimpleNamespace(bot=bot, bot_data={"groups": groups, "router": TraderRouter(groups), "appeals_cache": appeals})
+    replies = []
+    update = SimpleNamespace(message=merchant_message(f"{FIRST} alice\n{SECOND} bob", replies), to_dict=dict)
+
+    async def run():
+        await handlers.handle_message(update, context)
+        await asyncio.sleep(0)
+
+    asyncio.run(run())
+    assert [chat_id for chat_id, _ in bot.sent] == [-1, -2]
+    assert pending.get(MERCHANT_CHAT, 5, 1).appeal_id == SECOND
+    assert len(replies) == 1
+    assert f"Forwarded 1 appeal: '{FIRST}'" in replies[0]
+    assert f"Failed to send: '{SECOND}'" in replies[0]
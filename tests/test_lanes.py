@@ -0,0 +1,120 @@
+import asyncio
+
+from telegram import Chat, Message, Update, User, CallbackQuery
+
+from src.lanes import PRIORITY_CALLBACK, PRIORITY_MESSAGE, ChatLaneUpdateProcessor, PriorityGate
+
+USER = User(1, "trader", False)
+
+def message_update(update_id, chat_id):
+    message = Message(update_id, None, Chat(chat_id, Chat.GROUP), from_user=USER, text="hi")
+    return Update(update_id, message=message)
+
+def callback_update(update_id, chat_id):
+    message = Message(update_id, None, Chat(chat_id, Chat.GROUP), from_user=USER, text="appeal")
+    return Update(update_id, callback_query=CallbackQuery(str(update_id), USER, "chat", message=message, data="x"))
+
+def test_one_chat_in_order_chats_in_parallel():
+    async def run():
+        processor = ChatLaneUpdateProcessor(workers=4, lane_size=10, max_pending=100)
+        order = []
+
+        async def handle(name, delay):
+            await asyncio.sleep(delay)
+            order.append(name)
+
+        updates = [(message_update(1, -1), "a1", 0.05), (message_update(2, -1), "a2", 0), (message_update(3, -2), "b1", 0)]
+        for update, _, _ in updates:
+            await processor.admit(update)
+        await asyncio.gather(*(processor.process_update(update, handle(name, delay)) for update, name, delay in updates))
+        assert order == ["b1", "a1", "a2"]
+        assert processor.stats()["pending"] == 0
+        assert processor.stats()["lanes"] == 0
+
+    asyncio.run(run())
+
+def test_redelivered_update_is_undone_per_delivery():
+    async def run():
+        processor = ChatLaneUpdateProcessor(workers=2, lane_size=10, max_pending=100)
+
+        async def handle():
+            pass
+
+        first, again = message_update(7, -1), message_update(7, -1)
+        await processor.admit(first)
+        await processor.admit(again)
+        await processor.process_update(first, handle())
+        await processor.process_update(again, handle())
+        assert processor.pending == 0
+        assert processor._admitted == {}
+        assert processor.stats()["lanes"] == 0
+
+    asyncio.run(run())
+
+def test_full_lane_holds_back_admission():
+    async def run():
+        processor = ChatLaneUpdateProcessor(workers=1, lane_size=1, max_pending=100)
+        release = asyncio.Event()
+
+        async def handle():
+            await release.wait()
+
+        first = message_update(1, -1)
+        await processor.admit(first)
+        running = asyncio.create_task(processor.process_update(first, handle()))
+        admitted = asyncio.create_task(processor.admit(message_update(2, -1)))
+        await asyncio.sleep(0.01)
+        assert not admitted.done()
+        assert processor.throttled == 1
+        release.set()
+        await running
+        await asyncio.wait_for(admitted, 1)
+
+    asyncio.run(run())
+
+def test_gate_serves_callbacks_before_messages():
+    async def run():
+        gate = PriorityGate(1)
+        await gate.acquire(PRIORITY_MESSAGE)
+        order = []
+
+        async def waiter(name, priority):
+            await gate.acquire(priority)
+            order.append(name)
+            gate.release()
+
+        tasks = [asyncio.create_task(waiter("message", PRIORITY_MESSAGE)),
+                 asyncio.create_task(waiter("callback", PRIORITY_CALLBACK))]
+        await asyncio.sleep(0)
+        gate.release()
+        await asyncio.gather(*tasks)
+        assert order == ["callback", "message"]
+        assert gate.free == 1
+
+    asyncio.run(run())
+
+def test_callbacks_get_the_free_worker_first():
+    async def run():
+        processor = ChatLaneUpdateProcessor(workers=1, lane_size=10, max_pending=100)
+        release = asyncio.Event()
+        order = []
+
+        async def block():
+            await release.wait()
+
+        async def handle(name):
+            order.append(name)
+
+        busy = message_update(1, -9)
+        queued = [(message_update(2, -1), "message"), (callback_update(3, -2), "callback")]
+        for update in [busy] + [update for update, _ in queued]:
+            await processor.admit(update)
+        tasks = [asyncio.create_task(processor.process_update(busy, block()))]
+        await asyncio.sleep(0)
+        tasks += [asyncio.create_task(processor.process_update(update, handle(name))) for update, name in queued]
+        await asyncio.sleep(0.01)
+        release.set()
+        await asyncio.gather(*tasks)
+        assert order == ["callback", "message"]
+
+    asyncio.run(run())
@@ -0,0 +1,56 @@
+import asyncio
+
+from src.media import edit_media_text, send_media
+from src.outbound import PRIORITY_RELAY, outbound
+
+class FakeBot:
+    def __init__(self):
+        self.calls = []
+
+    def __getattr__(self, name):
+        async def method(**kwargs):
+            self.calls.append((name, kwargs))
+            return kwargs
+        return method
+
+class FakeMessage:
+    def __init__(self, chat_id, message_id, text=None):
+        self.chat_id = chat_id
+        self.message_id = message_id
+        self.text = text
+
+def run_with_dispatcher(coroutine_function):
+    async def run():
+        outbound.start()
+        try:
+            await coroutine_function()
+        finally:
+            await outbound.stop()
+
+    asyncio.run(run())
+
+def test_send_media_photo_and_text():
+    bot = FakeBot()
+
+    async def sends():
+        await send_media(bot, PRIORITY_RELAY, -100, "caption", "photo", "file-1", parse_mode="MarkdownV2")
+        await send_media(bot, PRIORITY_RELAY, -100, "plain")
+
+    run_with_dispatcher(sends)
+    assert bot.calls == [
+        ("send_photo", {"chat_id": -100, "caption": "caption", "photo": "file-1", "parse_mode": "MarkdownV2"}),
+        ("send_message", {"chat_id": -100, "text": "plain"}),
+    ]
+
+def test_edit_media_text_caption_and_text():
+    bot = FakeBot()
+
+    async def edits():
+        await edit_media_text(bot, PRIORITY_RELAY, FakeMessage(-100, 7), "closed")
+        await edit_media_text(bot, PRIORITY_RELAY, FakeMessage(-100, 8, text="Payment appeal"), "closed")
+
+    run_with_dispatcher(edits)
+    assert bot.calls == [
+        ("edit_message_caption", {"chat_id": -100, "message_id": 7, "caption": "closed", "reply_markup": None}),
+        ("edit_message_text", {"chat_id": -100, "message_id": 8, "text": "closed", "reply_markup": None}),
+    ]
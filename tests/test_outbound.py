@@ -0,0 +1,73 @@
+import asyncio
+
+import pytest
+from telegram.error import BadRequest
+
+from src.outbound import PRIORITY_RELAY, OutboundDispatcher, reply_later
+
+class FakeBot:
+    def __init__(self, fail=None):
+        self.calls = []
+        self.fail = fail
+
+    async def send_message(self, chat_id, text, **kwargs):
+        if self.fail is not None:
+            raise self.fail
+        self.calls.append(("send_message", chat_id, text, kwargs))
+        return {"chat_id": chat_id, "text": text}
+
+class FakeMessage:
+    def __init__(self, bot, chat_id):
+        self.bot = bot
+        self.chat_id = chat_id
+
+    async def reply_text(self, text, **kwargs):
+        return await self.bot.send_message(self.chat_id, text, **kwargs)
+
+def dispatcher():
+    return OutboundDispatcher(workers=2, global_rate=1000, chat_rate=1000, group_rate=1000, group_burst=1000)
+
+def test_send_passes_chat_id_keyword_through():
+    async def run():
+        bot = FakeBot()
+        outbound = dispatcher()
+        outbound.start()
+        result = await outbound.send(PRIORITY_RELAY, -100, bot.send_message, chat_id=-100, text="hi", parse_mode="MarkdownV2")
+        await outbound.stop()
+        assert result == {"chat_id": -100, "text": "hi"}
+        assert bot.calls == [("send_message", -100, "hi", {"parse_mode": "MarkdownV2"})]
+        assert outbound.sent == 1
+
+    asyncio.run(run())
+
+def test_send_before_start_calls_directly():
+    async def run():
+        bot = FakeBot()
+        assert await dispatcher().send(PRIORITY_RELAY, 42, bot.send_message, chat_id=42, text="hi") == {"chat_id": 42, "text": "hi"}
+
+    asyncio.run(run())
+
+def test_send_raises_permanent_errors():
+    async def run():
+        outbound = dispatcher()
+        outbound.start()
+        with pytest.raises(BadRequest):
+            await outbound.send(PRIORITY_RELAY, 42, FakeBot(BadRequest("chat not found")).send_message, chat_id=42, text="hi")
+        await outbound.stop()
+        assert outbound.failed == 1
+
+    asyncio.run(run())
+
+def test_reply_later_does_not_block():
+    async def run():
+        bot = FakeBot()
+        future = reply_later(FakeMessage(bot, 42), "queued")
+        assert not future.done()
+        await future
+        assert bot.calls == [("send_message", 42, "queued", {})]
+        # A failed reply is only logged by the done-callback
+        failed = reply_later(FakeMessage(FakeBot(BadRequest("gone")), 42), "lost")
+        await asyncio.wait((failed,))
+        assert isinstance(failed.exception(), BadRequest)
+
+    asyncio.run(run())
@@ -0,0 +1,83 @@
+# The parser and the router against the linear code they replaced in handlers.py
+import random
+import re
+import uuid
+
+from src.parser import KIND_APPEALS, KIND_FALLBACK, KIND_NOTIFICATION, parse_message
+from src.routing import TraderRouter
+
+def old_parse(text):
+    has_russian = any(1040 <= ord(char) <= 1103 for char in text)
+    appeal_ids = re.findall(r"[0-9a-f]{8}-[0-9a-f]{4}-[0-9a-f]{4}-[0-9a-f]{4}-[0-9a-f]{12}", text)
+    if has_russian and appeal_ids:
+        return KIND_NOTIFICATION, tuple(appeal_ids), ()
+    appeals = []
+    for line in text.split("\n"):
+        uuid_match = re.match(r"([0-9a-f]{8}-[0-9a-f]{4}-[0-9a-f]{4}-[0-9a-f]{4}-[0-9a-f]{12})\s+(.+)", line.strip())
+        if uuid_match:
+            message_parts = uuid_match.group(2).strip().split()
+            trader_nickname = message_parts[0].lower()
+            if len(message_parts) > 1 and message_parts[1].lower() in ["niro", "eastwood", "gosling"]:
+                trader_nickname += " " + message_parts[1].lower()
+            appeals.append((uuid_match.group(1), trader_nickname))
+    if appeals:
+        return KIND_APPEALS, tuple(appeal_ids), tuple(appeals)
+    return KIND_FALLBACK, tuple(appeal_ids), tuple(text.lower().strip().split())
+
+def old_match_nickname(groups, nickname):
+    return next((group for group in groups["trader"] if nickname in group["title"].lower()), None)
+
+def old_match_words(groups, words):
+    for group in groups["trader"]:
+        if any(word in group["title"].lower().split(" | trader")[0].split() for word in words):
+            return group
+    return None
+
+PIECES = ["Alice", "de", "Niro", "clint", "Eastwood", "bob", "paid", "оплатил", "проверьте", " ", "  ", "\t", "\n",
+          "\r\n", "\n  ", "x", "-", "|"]
+
+def random_text(rng):
+    parts = []
+    for _ in range(rng.randint(1, 12)):
+        if rng.random() < 0.3:
+            parts.append(str(uuid.UUID(int=rng.getrandbits(128))))
+        else:
+            parts.append(rng.choice(PIECES))
+    return "".join(parts)
+
+def test_parse_message_matches_the_old_line_scan():
+    rng = random.Random(17)
+    for _ in range(5000):
+        text = random_text(rng)
+        parsed = parse_message(text)
+        kind, appeal_ids, rest = old_parse(text)
+        assert parsed.kind == kind, text
+        assert parsed.appeal_ids == appeal_ids, text
+        if kind == KIND_APPEALS:
+            assert parsed.appeals == rest, text
+        elif kind == KIND_FALLBACK:
+            assert parsed.words == rest, text
+
+def test_router_matches_the_old_linear_scans():
+    rng = random.Random(23)
+    names = ["alice", "bob", "de niro", "clint eastwood", "ryan gosling", "al", "ali", "bo", "carol", "dave"]
+    groups = {"merchant": [], "trader": [], "trader_accounts": {}}
+    for chat_id in range(1, 40):
+        title = f"{rng.choice(names).title()} {rng.choice(['', 'Jr', '2'])} | Trader {chat_id}".replace("  ", " ")
+        groups["trader"].append({"id": -chat_id, "title": title})
+    router = TraderRouter(groups)
+    queries = names + ["", "a", "li", "trader", "| trader", "zzz", "de", "niro", "eastwood", "jr", "2"]
+    for _ in range(2):  # second round answers from the memo
+        for nickname in queries:
+            assert router.match_nickname(nickname) is old_match_nickname(groups, nickname), nickname
+    for _ in range(500):
+        words = [rng.choice(queries) for _ in range(rng.randint(0, 4))]
+        assert router.match_words(words) is old_match_words(groups, words), words
+
+def test_router_sees_groups_added_after_a_miss():
+    groups = {"merchant": [], "trader": [{"id": -1, "title": "Alice | Trader"}], "trader_accounts": {}}
+    router = TraderRouter(groups)
+    assert router.match_nickname("bob") is None
+    bob = {"id": -2, "title": "Bob | Trader"}
+    router.add_trader(bob)
+    assert router.match_nickname("bob") is bob
@@ -0,0 +1,119 @@
+import asyncio
+from datetime import datetime, timedelta
+from types import SimpleNamespace
+
+from src import handlers
+from src.outbound import outbound
+
+class FakeBot:
+    def __init__(self, on_send=None):
+        self.sent = []
+        self.on_send = on_send
+
+    async def send_message(self, chat_id, text, **kwargs):
+        self.sent.append((chat_id, text))
+        if self.on_send is not None:
+            self.on_send(chat_id)
+        return {"chat_id": chat_id}
+
+def test_send_reminder_goes_through_the_dispatcher():
+    async def run():
+        bot = FakeBot()
+        outbound.start()
+        try:
+            assert await handlers.send_reminder(SimpleNamespace(bot=bot), -200, "reminder")
+        finally:
+            await outbound.stop()
+        assert bot.sent == [(-200, "reminder")]
+
+    asyncio.run(run())
+
+def test_appeal_closed_mid_sweep_does_not_cost_other_chats(monkeypatch):
+    from src.api import api_manager
+    from src.persistence import persister
+    from src.reminders import reminder_scheduler
+    from src.storage import AppealsStore, connect
+
+    async def statuses(appeal_ids):
+        return {}
+    monkeypatch.setattr(api_manager, "get_appeal_statuses", statuses)
+    persister.register_callback("appeals", lambda: None)
+    appeals = AppealsStore(connect(":memory:", shared=False), shared=False)
+    opened = (datetime.now() - timedelta(seconds=90)).isoformat()
+    for key, chat_id in (("a", -1), ("b", -2), ("c", -2)):
+        appeals[key] = {"appeal_id": key.upper(), "chat_id": chat_id, "trader_username": "trader", "timestamp": opened}
+
+    def close_b(chat_id):
+        # A trader closes b while the reminder to the first chat is in flight
+        if chat_id == -1 and "b" in appeals:
+            del appeals["b"]
+
+    bot = FakeBot(on_send=close_b)
+    context = SimpleNamespace(bot=bot, bot_data={"appeals_cache": appeals})
+    reminder_scheduler.activate(appeals)
+    asyncio.run(handlers.remind_traders(context))
+    assert [chat_id for chat_id, _ in bot.sent] == [-1, -2]
+    assert any(key.startswith("reminded_") for key in appeals["c"])
+    assert "b" not in appeals
+
+class FakeJob:
+    def __init__(self, delay):
+        self.delay = delay
+        self.removed = False
+
+    def schedule_removal(self):
+        self.removed = True
+
+class FakeJobQueue:
+    def __init__(self):
+        self.jobs = []
+
+    def run_once(self, callback, delay, name=None):
+        self.jobs.append(FakeJob(delay))
+        return self.jobs[-1]
+
+def test_scheduler_pops_due_reminders_in_deadline_order():
+    from src.reminders import REMINDER_INTERVALS, ReminderScheduler, reminder_flag
+
+    scheduler = ReminderScheduler(window=0)
+    opened = datetime(2026, 1, 1)
+    scheduler.schedule("late", {"timestamp": (opened + timedelta(minutes=2)).isoformat()}, arm=False)
+    scheduler.schedule("early", {"timestamp": opened.isoformat(), reminder_flag(REMINDER_INTERVALS[0]): True}, arm=False)
+    assert len(scheduler) == 5  # "early" already had its first reminder
+    assert scheduler.pop_due(opened + timedelta(minutes=3)) == [("late", REMINDER_INTERVALS[0])]
+    assert scheduler.pop_due(opened + timedelta(minutes=6)) == [("early", REMINDER_INTERVALS[1]), ("late", REMINDER_INTERVALS[1])]
+    scheduler.cancel("late")
+    assert scheduler.pop_due(opened + timedelta(hours=1)) == [("early", REMINDER_INTERVALS[2])]
+    assert len(scheduler) == 0
+
+def test_scheduler_keeps_one_job_armed_for_the_earliest_deadline():
+    from src.reminders import ReminderScheduler
+
+    scheduler = ReminderScheduler(window=0)
+    job_queue = FakeJobQueue()
+    scheduler.attach(job_queue, None)
+    now = datetime.now()
+    scheduler.schedule("later", {"timestamp": (now + timedelta(hours=1)).isoformat()})
+    scheduler.schedule("sooner", {"timestamp": now.isoformat()})
+    assert len(job_queue.jobs) == 2
+    assert job_queue.jobs[0].removed and not job_queue.jobs[1].removed
+    assert job_queue.jobs[1].delay < job_queue.jobs[0].delay
+    # A later deadline does not re-arm
+    scheduler.schedule("latest", {"timestamp": (now + timedelta(hours=2)).isoformat()})
+    assert len(job_queue.jobs) == 2
+    scheduler.cancel("sooner")
+    scheduler.cancel("later")
+    scheduler.cancel("latest")
+    scheduler.arm()
+    assert job_queue.jobs[1].removed
+
+def test_deferred_reminder_comes_back_and_inactive_scheduler_keeps_nothing():
+    from src.reminders import REMINDER_INTERVALS, ReminderScheduler
+
+    scheduler = ReminderScheduler(window=0)
+    scheduler.defer("a", REMINDER_INTERVALS[0], 60)
+    assert scheduler.pop_due(datetime.now()) == []
+    assert scheduler.pop_due(datetime.now() + timedelta(seconds=61)) == [("a", REMINDER_INTERVALS[0])]
+    scheduler.deactivate()
+    scheduler.schedule("b", {"timestamp": datetime(2026, 1, 1).isoformat()})
+    assert len(scheduler) == 0
@@ -0,0 +1,78 @@
+import os
+import sqlite3
+import tempfile
+
+import pytest
+
+from src.storage import AppealsStore, SharedGroups, connect
+
+def appeal(appeal_id, chat_id=-1):
+    return {"appeal_id": appeal_id, "chat_id": chat_id, "trader_username": "trader", "timestamp": "2026-01-01T00:00:00"}
+
+@pytest.fixture
+def path():
+    return os.path.join(tempfile.mkdtemp(), "appeals.db")
+
+def test_refresh_reads_only_rows_written_elsewhere(path, monkeypatch):
+    first = AppealsStore(connect(path, shared=True), shared=True)
+    second = AppealsStore(connect(path, shared=True), shared=True)
+    first["a"] = appeal("A")
+    first["b"] = appeal("B")
+    assert second.refresh() == ({"a", "b"}, set())
+    first.discard("a")
+    first["b"] = {**appeal("B"), "reminded_60.0": True}
+    monkeypatch.setattr(second, "_load", lambda: pytest.fail("full reload"))
+    assert second.refresh() == (set(), {"a"})
+    assert second["b"]["reminded_60.0"]
+    assert second.refresh() is None
+
+def test_own_groups_commit_does_not_reload_appeals(path, monkeypatch):
+    appeals = AppealsStore(connect(path, shared=True), shared=True)
+    appeals["a"] = appeal("A")
+    groups = SharedGroups(connect(path, shared=True))
+    groups.save({"merchant": [], "trader": [], "trader_accounts": {}})
+    monkeypatch.setattr(appeals, "_load", lambda: pytest.fail("full reload"))
+    assert appeals.refresh() == (set(), set())
+
+def test_deleted_elsewhere_stays_deleted(path):
+    first = AppealsStore(connect(path, shared=True), shared=True)
+    second = AppealsStore(connect(path, shared=True), shared=True)
+    first["a"] = appeal("A")
+    second.refresh()
+    first.discard("a")
+    second["a"] = {**appeal("A"), "reminded_60.0": True}
+    assert "a" not in second
+    assert connect(path, shared=True).execute("SELECT COUNT(*) FROM appeals").fetchone()[0] == 0
+
+def test_locked_write_is_kept_and_retried(path):
+    appeals = AppealsStore(connect(path, shared=True), shared=True)
+    blocker = sqlite3.connect(path, isolation_level=None)
+    blocker.execute("BEGIN IMMEDIATE")
+    appeals["a"] = appeal("A")
+    appeals["a"] = {**appeal("A"), "reminded_60.0": True}
+    assert appeals["a"]["reminded_60.0"]
+    assert appeals.unsaved == 1
+    with pytest.raises(sqlite3.OperationalError):
+        appeals.flush_unsaved()
+    blocker.execute("ROLLBACK")
+    assert appeals.flush_unsaved() == 0
+    row = appeals.conn.execute("SELECT extra FROM appeals WHERE key = 'a'").fetchone()
+    assert row == ('{"reminded_60.0": true}',)
+
+def test_pruned_change_log_falls_back_to_full_reload(path):
+    first = AppealsStore(connect(path, shared=True), shared=True)
+    second = AppealsStore(connect(path, shared=True), shared=True)
+    first["a"] = appeal("A")
+    first["b"] = appeal("B")
+    assert first.prune_changes(-1) == 2
+    first["c"] = appeal("C")
+    assert second.refresh() == ({"a", "b", "c"}, set())
+
+def test_json_migration_runs_once_across_replicas(path):
+    from src.storage import migrate_json
+
+    first, second = connect(path, shared=True), connect(path, shared=True)
+    missing = os.path.join(os.path.dirname(path), "appeals.json")
+    assert migrate_json(first, missing) == 0
+    assert migrate_json(second, missing) == 0
+    assert first.execute("SELECT COUNT(*) FROM meta WHERE name = 'json_migrated'").fetchone()[0] == 1
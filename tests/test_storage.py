@@ -0,0 +1,66 @@
+import json
+import os
+import sqlite3
+import tempfile
+import time
+
+from src.storage import AppealsStore, PendingAppealStore, connect, migrate_json
+
+def test_json_cache_migrates_once():
+    directory = tempfile.mkdtemp()
+    path = os.path.join(directory, "appeals.json")
+    with open(path, "w") as f:
+        json.dump({"-1_5": {"appeal_id": "A", "chat_id": -1, "trader_username": "bob",
+                            "timestamp": "2026-01-01T00:00:00", "reminded_60.0": True}}, f)
+    conn = connect(os.path.join(directory, "appeals.db"), shared=False)
+    assert migrate_json(conn, path) == 1
+    assert not os.path.exists(path)
+    assert os.path.exists(f"{path}.migrated")
+    store = AppealsStore(conn, shared=False)
+    assert store["-1_5"]["reminded_60.0"]
+    assert store.keys_for_appeal("A") == {"-1_5"}
+    assert store.trader_chats_for("A") == {-1}
+    assert migrate_json(conn, path) == 0
+
+def test_row_writes_survive_a_reopen():
+    path = os.path.join(tempfile.mkdtemp(), "appeals.db")
+    store = AppealsStore(connect(path, shared=False), shared=False)
+    store["a"] = {"appeal_id": "A", "chat_id": -1, "timestamp": "2026-01-01T00:00:00"}
+    store["b"] = {"appeal_id": "A", "chat_id": -2, "timestamp": "2026-01-01T00:00:00"}
+    del store["a"]
+    store.close()
+    reopened = AppealsStore(connect(path, shared=False), shared=False)
+    assert list(reopened) == ["b"]
+    assert reopened.trader_chats_for("A") == {-2}
+
+def test_pending_appeals_gain_the_appeal_index():
+    path = os.path.join(tempfile.mkdtemp(), "appeals.db")
+    old = sqlite3.connect(path)
+    old.execute("CREATE TABLE pending_appeals (merchant_chat_id INTEGER NOT NULL, message_id INTEGER NOT NULL, "
+                "appeal_id TEXT NOT NULL, file_type TEXT, file_id TEXT, created REAL NOT NULL, "
+                "PRIMARY KEY (merchant_chat_id, message_id))")
+    old.execute("INSERT INTO pending_appeals VALUES (-100, 5, 'A', 'photo', 'file', ?)", (time.time(),))
+    old.commit()
+    old.close()
+    pending = PendingAppealStore(connect(path, shared=False))
+    assert pending.get(-100, 5).appeal_id == "A"
+    pending.put(-100, 5, "B", index=1)
+    assert pending.get(-100, 5, 1).appeal_id == "B"
+    assert pending.get(-100, 5, 0).file_id == "file"
+    pending.conn.commit()
+    # Already migrated: a second connect leaves the rows alone
+    again = PendingAppealStore(connect(path, shared=False))
+    assert again.get(-100, 5, 1).appeal_id == "B"
+
+def test_pending_appeals_expire_and_fall_back_to_the_table():
+    pending = PendingAppealStore(connect(":memory:", shared=False), max_size=1, ttl=60)
+    pending.put(-100, 1, "A")
+    pending.put(-100, 2, "B")
+    assert len(pending) == 1
+    assert pending.get(-100, 1).appeal_id == "A"
+    pending.conn.execute("UPDATE pending_appeals SET created = ? WHERE message_id = 2", (time.time() - 120,))
+    pending._records.clear()
+    assert pending.get(-100, 2) is None
+    assert pending.purge_expired() == 0
+    pending.discard(-100, 1)
+    assert pending.get(-100, 1) is None